@@ -0,0 +1,275 @@
+# --- Almacén del estado de medición: en memoria (un worker) o SQLite en modo WAL (todos los workers del host) ---
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from config_optimizacion import CONFIG_ALMACEN
+
+BACKENDS_ALMACEN = ('memoria', 'sqlite')
+
+class AlmacenMemoria:
+    """
+    Estado en el propio proceso. Los valores se guardan tal cual, sin copiarlos
+    ni serializarlos: quien lee recibe el mismo objeto y sus cambios ya quedan
+    guardados. Solo sirve con un único worker.
+    """
+    compartido = False
+
+    def __init__(self):
+        self._espacios = {}  # espacio -> OrderedDict clave -> (valor, expira), del menos al más reciente
+        self._lock = threading.RLock()
+
+    def _purgar(self, datos, tiempo_actual, maximo):
+        while datos:
+            clave, (_, expira) = next(iter(datos.items()))
+            if (maximo is not None and len(datos) > maximo) or (expira is not None and expira < tiempo_actual):
+                datos.pop(clave)
+            else:
+                break
+
+    def leer(self, espacio, clave):
+        with self._lock:
+            entrada = self._espacios.get(espacio, {}).get(clave)
+            if entrada is None or (entrada[1] is not None and entrada[1] < time.time()):
+                return None
+            return entrada[0]
+
+    def escribir(self, espacio, clave, valor, expiracion=None, maximo=None):
+        tiempo_actual = time.time()
+        with self._lock:
+            datos = self._espacios.setdefault(espacio, OrderedDict())
+            datos.pop(clave, None)
+            datos[clave] = (valor, tiempo_actual + expiracion if expiracion else None)
+            self._purgar(datos, tiempo_actual, maximo)
+
+    def actualizar(self, espacio, clave, funcion, expiracion=None, maximo=None):
+        with self._lock:
+            valor = funcion(self.leer(espacio, clave))
+            if valor is None:
+                self.borrar(espacio, clave)
+            else:
+                self.escribir(espacio, clave, valor, expiracion, maximo)
+            return valor
+
+    def borrar(self, espacio, clave):
+        with self._lock:
+            self._espacios.get(espacio, {}).pop(clave, None)
+
+    def valores(self, espacio):
+        tiempo_actual = time.time()
+        with self._lock:
+            return [valor for valor, expira in self._espacios.get(espacio, {}).values()
+                    if expira is None or expira >= tiempo_actual]
+
+    def entradas(self):
+        with self._lock:
+            return {espacio: len(datos) for espacio, datos in self._espacios.items()}
+
+class AlmacenSQLite:
+    """
+    Estado en un fichero SQLite en modo WAL, compartido por todos los workers
+    del host: las lecturas no esperan a las escrituras y cada escritura es una
+    transacción corta. Los valores se guardan con pickle (el fichero es local
+    y solo lo escribe el propio servidor), así que quien lee recibe una copia
+    y tiene que volver a escribirla si la cambia.
+    """
+    compartido = True
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        conexion = self._conexion()
+        conexion.execute('''CREATE TABLE IF NOT EXISTS estado (
+            espacio TEXT NOT NULL, clave TEXT NOT NULL, valor BLOB NOT NULL, expira REAL, tiempo REAL NOT NULL,
+            PRIMARY KEY (espacio, clave)) WITHOUT ROWID''')
+        conexion.execute('CREATE INDEX IF NOT EXISTS estado_tiempo ON estado (espacio, tiempo)')
+
+    def _conexion(self):
+        """
+        Una conexión por hilo y proceso: las conexiones no se pueden usar en otro
+        hilo ni heredar en un fork (gunicorn --preload).
+        """
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.ruta, timeout=CONFIG_ALMACEN['ESPERA_BLOQUEO'], isolation_level=None)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')  # Sin fsync por transacción: es estado efímero
+            self._local.conexion, self._local.pid = conexion, os.getpid()
+        return conexion
+
+    @contextmanager
+    def _transaccion(self):
+        """
+        Transacción de escritura. BEGIN IMMEDIATE toma el bloqueo antes de leer:
+        ningún otro worker puede escribir entre la lectura y la escritura.
+        """
+        conexion = self._conexion()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            yield conexion
+        except BaseException:
+            conexion.execute('ROLLBACK')
+            raise
+        conexion.execute('COMMIT')
+
+    def _leer(self, conexion, espacio, clave):
+        fila = conexion.execute('SELECT valor, expira FROM estado WHERE espacio = ? AND clave = ?',
+                                (espacio, clave)).fetchone()
+        if fila is None or (fila[1] is not None and fila[1] < time.time()):
+            return None
+        return pickle.loads(fila[0])
+
+    def _escribir(self, conexion, espacio, clave, valor, expiracion, maximo):
+        tiempo_actual = time.time()
+        conexion.execute('INSERT OR REPLACE INTO estado VALUES (?, ?, ?, ?, ?)', (
+            espacio, clave, pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL),
+            tiempo_actual + expiracion if expiracion else None, tiempo_actual))
+        conexion.execute('DELETE FROM estado WHERE espacio = ? AND expira < ?', (espacio, tiempo_actual))
+        if maximo is not None:
+            conexion.execute('''DELETE FROM estado WHERE espacio = ? AND clave IN (
+                SELECT clave FROM estado WHERE espacio = ? ORDER BY tiempo DESC LIMIT -1 OFFSET ?)''',
+                             (espacio, espacio, maximo))
+
+    def leer(self, espacio, clave):
+        return self._leer(self._conexion(), espacio, clave)
+
+    def escribir(self, espacio, clave, valor, expiracion=None, maximo=None):
+        with self._transaccion() as conexion:
+            self._escribir(conexion, espacio, clave, valor, expiracion, maximo)
+
+    def actualizar(self, espacio, clave, funcion, expiracion=None, maximo=None):
+        with self._transaccion() as conexion:
+            valor = funcion(self._leer(conexion, espacio, clave))
+            if valor is None:
+                conexion.execute('DELETE FROM estado WHERE espacio = ? AND clave = ?', (espacio, clave))
+            else:
+                self._escribir(conexion, espacio, clave, valor, expiracion, maximo)
+        return valor
+
+    def borrar(self, espacio, clave):
+        with self._transaccion() as conexion:
+            conexion.execute('DELETE FROM estado WHERE espacio = ? AND clave = ?', (espacio, clave))
+
+    def valores(self, espacio):
+        filas = self._conexion().execute('SELECT valor FROM estado WHERE espacio = ? AND (expira IS NULL OR expira >= ?)',
+                                         (espacio, time.time())).fetchall()
+        return [pickle.loads(fila[0]) for fila in filas]
+
+    def entradas(self):
+        filas = self._conexion().execute('SELECT espacio, COUNT(*) FROM estado GROUP BY espacio').fetchall()
+        return dict(filas)
+
+_almacen = None
+_lock = threading.Lock()
+_estadisticas = {'lecturas': 0, 'escrituras': 0, 'suma_ms_lectura': 0.0, 'suma_ms_escritura': 0.0}
+
+def obtener_almacen():
+    """
+    Almacén del proceso según CONFIG_ALMACEN (se crea en el primer uso).
+
+    Raises:
+        ValueError: Si el backend configurado no existe
+    """
+    global _almacen
+    with _lock:
+        if _almacen is None:
+            backend = CONFIG_ALMACEN['BACKEND']
+            if backend == 'memoria':
+                _almacen = AlmacenMemoria()
+            elif backend == 'sqlite':
+                _almacen = AlmacenSQLite(CONFIG_ALMACEN['RUTA'])
+            else:
+                raise ValueError(f"ALMACEN_ESTADO no válido: {backend}. Usa: {', '.join(BACKENDS_ALMACEN)}")
+        return _almacen
+
+def almacen_compartido():
+    """
+    True si el estado se comparte entre workers (y quien lee recibe una copia).
+    """
+    return obtener_almacen().compartido
+
+def _contar(operacion, inicio):
+    with _lock:
+        _estadisticas[operacion + 's'] += 1
+        _estadisticas['suma_ms_' + operacion] += (time.perf_counter() - inicio) * 1000
+
+def leer(espacio, clave):
+    """
+    Valor guardado en espacio/clave, o None si no existe o expiró.
+    """
+    inicio = time.perf_counter()
+    valor = obtener_almacen().leer(espacio, clave)
+    _contar('lectura', inicio)
+    return valor
+
+def escribir(espacio, clave, valor, expiracion=None, maximo=None):
+    """
+    Guarda un valor. Con expiración, deja de leerse pasados esos segundos desde
+    la última escritura; con máximo, se descartan las claves del espacio escritas
+    hace más tiempo.
+    """
+    inicio = time.perf_counter()
+    obtener_almacen().escribir(espacio, clave, valor, expiracion, maximo)
+    _contar('escritura', inicio)
+
+def actualizar(espacio, clave, funcion, expiracion=None, maximo=None):
+    """
+    Lee, transforma y guarda un valor de forma atómica entre hilos y workers.
+
+    Args:
+        funcion: Recibe el valor guardado (o None) y devuelve el nuevo (None lo borra)
+
+    Returns:
+        El valor devuelto por funcion
+    """
+    inicio = time.perf_counter()
+    valor = obtener_almacen().actualizar(espacio, clave, funcion, expiracion, maximo)
+    _contar('escritura', inicio)
+    return valor
+
+def borrar(espacio, clave):
+    """
+    Elimina una clave (no falla si no existe).
+    """
+    inicio = time.perf_counter()
+    obtener_almacen().borrar(espacio, clave)
+    _contar('escritura', inicio)
+
+def valores(espacio):
+    """
+    Valores vigentes de un espacio (para las métricas).
+    """
+    return obtener_almacen().valores(espacio)
+
+def publicar_perfil(perfil):
+    """
+    Guarda el perfil activo para que lo apliquen los demás workers.
+    """
+    escribir('configuracion', 'perfil', perfil)
+
+def perfil_publicado():
+    """
+    Último perfil activado con /configuracion en cualquier worker, o None.
+    """
+    return leer('configuracion', 'perfil')
+
+def estado_almacen():
+    """
+    Backend, claves guardadas por espacio y coste medio de lecturas y escrituras en este proceso.
+    """
+    almacen = obtener_almacen()
+    with _lock:
+        lecturas, escrituras = _estadisticas['lecturas'], _estadisticas['escrituras']
+        estado = {
+            "backend": CONFIG_ALMACEN['BACKEND'],
+            "compartido": almacen.compartido,
+            "lecturas": lecturas,
+            "escrituras": escrituras,
+            "media_ms_lectura": round(_estadisticas['suma_ms_lectura'] / lecturas, 4) if lecturas else None,
+            "media_ms_escritura": round(_estadisticas['suma_ms_escritura'] / escrituras, 4) if escrituras else None,
+        }
+    estado["entradas"] = almacen.entradas()
+    return estado
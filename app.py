@@ -1,8 +1,37 @@
 # --- Importaciones necesarias ---
-from flask import Flask, request, jsonify, render_template, url_for
+from flask import Flask, request, jsonify, render_template, url_for, Response, has_request_context
 from flask_cors import CORS
-from calcular_luminarias import calcular_y_generar_imagen
-from config_optimizacion import obtener_configuracion, cambiar_configuracion
+from calcular_luminarias import calcular_y_generar_imagen, calcular_luminarias_poligono
+from config_optimizacion import (obtener_configuracion, cambiar_configuracion, obtener_perfil, usar_perfil,
+                                 CONFIG_PROGRESIVO)
+from calibracion_camara import (calibrar_camara, guardar_calibracion, cargar_calibracion,
+                                obtener_intrinsecos, corregir_esquinas)
+from registro_marcadores import obtener_tamano_marcador, interpretar_ids, describir_diccionario
+from hojas_marcadores import generar_hoja, FORMATOS, MAX_IDS_HOJA
+from ingesta_cruda import TIPO_CONTENIDO as TIPO_CONTENIDO_CRUDO, decodificar_gris_crudo, compresiones_disponibles
+from cascada_deteccion import estado_cascada
+from refinamiento_esquinas import refinar_lote, estado_refinamiento
+from medicion_marcadores import (calcular_tamano_deteccion, mejorar_deteccion_aruco, calcular_geometria_medicion,
+                                 filtrar_mediciones_temporales, seleccionar_distancia)
+from contorno_habitacion import calcular_contorno, MIN_ESQUINAS
+from buffers_imagen import prestar_buffers, estado_buffers
+from sugerencias_captura import sugerir_captura, lado_medido_px
+from grabador_frames import grabar_frame_si_procede, estado_grabador
+from memoria_peticiones import (medir_memoria, anotar_array, adjuntar_memoria, estado_memoria,
+                                tomar_instantanea_base, diferencias_instantanea)
+from perfilador import (comprobar_token, iniciar_perfilado, detener_perfilado,
+                         estado_perfilado, exportar_perfil)
+from sesiones_medicion import (crear_sesion, obtener_sesion, obtener_seguimiento, registrar_frame,
+                               resumen_sesion, estado_sesiones, obtener_filtro_global, guardar_filtro_global)
+from almacen_estado import almacen_compartido, publicar_perfil, perfil_publicado, estado_almacen
+from pool_cv import pool_habilitado, procesar_en_pool, estado_pool
+from formatos_respuesta import formato_pedido, responder, codificaciones_disponibles, FORMATOS_RESPUESTA
+from calidad_frame import evaluar_calidad, estado_calidad, MENSAJES_RECHAZO
+from mediciones_progresivas import progresivo_disponible, programar_refinado, obtener_medicion, estado_progresivas
+from seguimiento_esquinas import (seguimiento_habilitado, gris_seguimiento, seguir_esquinas, iniciar_seguimiento,
+                                  reiniciar_seguimiento, mantener_encuadre, estado_seguimiento)
+from homografia_plano import (calcular_homografia_marcador, actualizar_homografia_sesion,
+                              obtener_homografia_sesion, medir_pares)
 import os
 import cv2
 import numpy as np
@@ -20,15 +49,12 @@ import matplotlib.patches as patches
 app = Flask(__name__)
 CORS(app)  # Permite peticiones desde otros orígenes
 
-# --- Variables globales para filtrado temporal ---
-mediciones_previas = deque(maxlen=10)  # Almacena las últimas 10 mediciones
-ultima_medicion_tiempo = 0
-
 # --- Funciones mejoradas para detección precisa ---
 
 def detectar_esquinas_subpixel(imagen, corners, ventana=None, zona_muerta=(-1, -1)):
     """
-    Refina las esquinas detectadas con precisión subpíxel (optimizada para velocidad).
+    Refina las esquinas detectadas con precisión subpíxel (un solo cornerSubPix
+    para todos los marcadores).
     
     Args:
         imagen: Imagen en escala de grises
@@ -39,134 +65,7 @@ def detectar_esquinas_subpixel(imagen, corners, ventana=None, zona_muerta=(-1, -
     Returns:
         corners_refinadas: Esquinas con precisión subpíxel
     """
-    config = obtener_configuracion()
-    if ventana is None:
-        ventana = config['VENTANA_SUBPIXEL']
-    
-    corners_refinadas = []
-    
-    for marker_corners in corners:
-        # Convertir a formato float32 para subpíxel
-        corners_float = np.float32(marker_corners)
-        
-        # Una sola iteración para mayor velocidad
-        corners_refinadas_marker = cv2.cornerSubPix(
-            imagen, 
-            corners_float, 
-            ventana, 
-            zona_muerta,
-            criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 
-                     config['ITERACIONES_SUBPIXEL'], 
-                     config['PRECISION_SUBPIXEL'])
-        )
-        
-        corners_refinadas.append(corners_refinadas_marker)
-    
-    return corners_refinadas
-
-def calcular_distancia_multipunto(corners1, corners2, metros_por_pixel):
-    """
-    Calcula la distancia usando múltiples puntos de referencia para mayor precisión.
-    
-    Args:
-        corners1: Esquinas del primer marcador ArUco
-        corners2: Esquinas del segundo marcador ArUco
-        metros_por_pixel: Factor de conversión
-    
-    Returns:
-        distancia_promedio: Distancia promedio calculada
-        puntos_medicion: Puntos utilizados para la medición
-    """
-    # Calcular centro de masa de cada marcador
-    centro1 = np.mean(corners1, axis=0)
-    centro2 = np.mean(corners2, axis=0)
-    
-    # Calcular distancia entre centros
-    distancia_centros = np.linalg.norm(centro2 - centro1)
-    
-    # Calcular distancias desde múltiples esquinas
-    distancias_esquinas = []
-    puntos_medicion = []
-    
-    # Vector dirección entre centros
-    direccion = centro2 - centro1
-    direccion_normalizada = direccion / np.linalg.norm(direccion)
-    
-    # Para cada esquina del primer marcador, encontrar la esquina más cercana del segundo
-    for i, esquina1 in enumerate(corners1):
-        # Encontrar la esquina del segundo marcador más alejada en la dirección opuesta
-        distancias_proyeccion = []
-        for esquina2 in corners2:
-            # Proyección de la línea entre esquinas en la dirección de los centros
-            vector_esquinas = esquina2 - esquina1
-            proyeccion = np.dot(vector_esquinas, direccion_normalizada)
-            distancias_proyeccion.append(proyeccion)
-        
-        # Usar la esquina con mayor proyección (más alejada)
-        idx_max = np.argmax(distancias_proyeccion)
-        esquina2_seleccionada = corners2[idx_max]
-        
-        # Calcular distancia entre estas esquinas
-        distancia_esquinas = np.linalg.norm(esquina2_seleccionada - esquina1)
-        distancias_esquinas.append(distancia_esquinas)
-        puntos_medicion.append((esquina1, esquina2_seleccionada))
-    
-    # Calcular distancia promedio ponderada con pesos mejorados
-    distancias_esquinas = np.array(distancias_esquinas)
-    
-    # Usar pesos basados en la estabilidad y consistencia
-    # Dar más peso a las mediciones que están más cerca de la mediana
-    mediana = np.median(distancias_esquinas)
-    desviaciones = np.abs(distancias_esquinas - mediana)
-    
-    # Pesos inversamente proporcionales a la desviación, con suavizado
-    pesos = 1.0 / (1.0 + desviaciones / (mediana * 0.1))  # Factor de suavizado
-    pesos = pesos / np.sum(pesos)
-    
-    distancia_promedio_px = np.sum(distancias_esquinas * pesos)
-    distancia_promedio_metros = distancia_promedio_px * metros_por_pixel
-    
-    return distancia_promedio_metros, puntos_medicion, distancia_centros * metros_por_pixel
-
-def calcular_distancia_con_correccion_perspectiva(corners1, corners2, metros_por_pixel, imagen_shape):
-    """
-    Calcula la distancia con corrección de perspectiva para mayor precisión.
-    
-    Args:
-        corners1: Esquinas del primer marcador ArUco
-        corners2: Esquinas del segundo marcador ArUco
-        metros_por_pixel: Factor de conversión
-        imagen_shape: Forma de la imagen (altura, ancho)
-    
-    Returns:
-        distancia_corregida: Distancia corregida por perspectiva
-    """
-    # Calcular centro de cada marcador
-    centro1 = np.mean(corners1, axis=0)
-    centro2 = np.mean(corners2, axis=0)
-    
-    # Calcular distancia básica
-    distancia_basica = np.linalg.norm(centro2 - centro1)
-    
-    # Corrección de perspectiva basada en la posición en la imagen
-    # Los objetos más cerca del centro de la imagen tienen menos distorsión
-    centro_imagen = np.array([imagen_shape[1] / 2, imagen_shape[0] / 2])
-    
-    # Calcular factor de corrección basado en la distancia al centro
-    distancia_al_centro1 = np.linalg.norm(centro1 - centro_imagen)
-    distancia_al_centro2 = np.linalg.norm(centro2 - centro_imagen)
-    
-    # Factor de corrección (mayor para objetos más alejados del centro)
-    factor_correccion1 = 1.0 + (distancia_al_centro1 / (imagen_shape[0] + imagen_shape[1])) * 0.1
-    factor_correccion2 = 1.0 + (distancia_al_centro2 / (imagen_shape[0] + imagen_shape[1])) * 0.1
-    
-    # Factor de corrección promedio
-    factor_correccion = (factor_correccion1 + factor_correccion2) / 2
-    
-    # Aplicar corrección
-    distancia_corregida = distancia_basica / factor_correccion
-    
-    return distancia_corregida * metros_por_pixel
+    return refinar_lote(imagen, corners, ventana, zona_muerta)
 
 def calcular_escala_precisa(corners, tamano_real_lado):
     """
@@ -220,154 +119,41 @@ def calcular_escala_precisa(corners, tamano_real_lado):
     
     return metros_por_pixel, lado_px
 
-def filtrar_mediciones_temporales(nueva_medicion, ventana_tiempo=2.0):
+class PeticionCancelada(Exception):
     """
-    Filtra outliers y promedia mediciones temporales con algoritmo mejorado.
-    
-    Args:
-        nueva_medicion: Nueva medición a agregar
-        ventana_tiempo: Ventana de tiempo en segundos para considerar mediciones válidas
-    
-    Returns:
-        medicion_filtrada: Medición filtrada y promediada
-        confianza: Nivel de confianza de la medición
+    El cliente se desconectó antes de recibir la respuesta (solo en modo ASGI).
     """
-    global mediciones_previas, ultima_medicion_tiempo
-    
-    tiempo_actual = time.time()
-    
-    # Limpiar mediciones muy antiguas
-    while mediciones_previas and (tiempo_actual - mediciones_previas[0]['tiempo']) > ventana_tiempo:
-        mediciones_previas.popleft()
-    
-    # Agregar nueva medición
-    mediciones_previas.append({
-        'distancia': nueva_medicion,
-        'tiempo': tiempo_actual
-    })
-    
-    if len(mediciones_previas) < 3:
-        # Si hay pocas mediciones, usar la más reciente
-        return nueva_medicion, 0.5
-    
-    # Extraer distancias y tiempos
-    distancias = [m['distancia'] for m in mediciones_previas]
-    tiempos = [m['tiempo'] for m in mediciones_previas]
-    
-    # Calcular estadísticas robustas
-    mediana = np.median(distancias)
-    mad = np.median(np.abs(distancias - mediana))  # Median Absolute Deviation
-    
-    # Usar MAD para detectar outliers (más robusto que desviación estándar)
-    umbral_outlier = 2.5 * mad
-    distancias_filtradas = [d for d in distancias if abs(d - mediana) <= umbral_outlier]
-    
-    if len(distancias_filtradas) == 0:
-        # Si todas son outliers, usar la mediana
-        medicion_filtrada = mediana
-        confianza = 0.3
-    else:
-        # Usar promedio ponderado por tiempo (mediciones más recientes tienen más peso)
-        pesos_tiempo = []
-        for t in tiempos:
-            # Peso basado en qué tan reciente es la medición
-            tiempo_relativo = tiempo_actual - t
-            peso = np.exp(-tiempo_relativo / ventana_tiempo)  # Decaimiento exponencial
-            pesos_tiempo.append(peso)
-        
-        # Normalizar pesos
-        pesos_tiempo = np.array(pesos_tiempo)
-        pesos_tiempo = pesos_tiempo / np.sum(pesos_tiempo)
-        
-        # Calcular promedio ponderado
-        medicion_filtrada = np.sum(np.array(distancias) * pesos_tiempo)
-        
-        # Calcular confianza basada en consistencia y número de mediciones
-        desviacion_filtrada = np.std(distancias_filtradas)
-        consistencia = 1.0 - (desviacion_filtrada / mediana) if mediana > 0 else 0.5
-        factor_muestras = min(1.0, len(distancias_filtradas) / 5.0)  # Más muestras = mayor confianza
-        
-        confianza = consistencia * factor_muestras
-        confianza = max(0.1, min(1.0, confianza))
-    
-    return medicion_filtrada, confianza
 
-def mejorar_deteccion_aruco(imagen):
+def comprobar_cancelacion():
+    """
+    Interrumpe el procesamiento entre etapas si el servidor ASGI marcó la petición
+    como abandonada (evento 'luminaria.desconectado' del environ WSGI).
     """
-    Mejora la detección de ArUco con múltiples técnicas (optimizada para velocidad).
+    if not has_request_context():
+        return
+    desconectado = request.environ.get('luminaria.desconectado')
+    if desconectado is not None and desconectado.is_set():
+        raise PeticionCancelada()
+
+def decodificar_imagen_base64(image_data):
+    """
+    Decodifica una imagen recibida como data URL (o base64 plano) a formato OpenCV.
     
     Args:
-        imagen: Imagen de entrada
+        image_data: Cadena 'data:image/jpeg;base64,...' o base64 sin prefijo
     
     Returns:
-        corners_mejoradas: Esquinas detectadas mejoradas
-        ids: IDs de los marcadores
+        img: Imagen BGR o None si no se pudo decodificar
     """
-    # Convertir a escala de grises
-    if len(imagen.shape) == 3:
-        gray = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = imagen.copy()
-    
-    # Reducir tamaño de imagen para mayor velocidad (si es muy grande)
-    config = obtener_configuracion()
-    if config['REDUCIR_IMAGEN']:
-        height, width = gray.shape
-        if width > config['MAX_WIDTH'] or height > config['MAX_HEIGHT']:
-            scale_factor = min(config['MAX_WIDTH']/width, config['MAX_HEIGHT']/height)
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            gray = cv2.resize(gray, (new_width, new_height))
-    
-    # Aplicar filtros para mejorar la detección (optimizados)
-    # Filtro Gaussiano más pequeño para mayor velocidad
-    gray_suavizada = cv2.GaussianBlur(gray, (3, 3), 0)
-    
-    # Configurar detector ArUco con parámetros optimizados para velocidad
-    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    aruco_params = cv2.aruco.DetectorParameters()
-    
-    # Parámetros optimizados para velocidad y precisión balanceada
-    config = obtener_configuracion()
-    aruco_params.adaptiveThreshWinSizeMin = 3
-    aruco_params.adaptiveThreshWinSizeMax = 23
-    aruco_params.adaptiveThreshWinSizeStep = 10
-    aruco_params.adaptiveThreshConstant = 7
-    aruco_params.minMarkerPerimeterRate = 0.03
-    aruco_params.maxMarkerPerimeterRate = 4.0
-    aruco_params.polygonalApproxAccuracyRate = config['POLYGONAL_ACCURACY']
-    aruco_params.minCornerDistanceRate = 0.05
-    aruco_params.minDistanceToBorder = 3
-    aruco_params.minOtsuStdDev = 5.0
-    aruco_params.perspectiveRemovePixelPerCell = 4
-    aruco_params.perspectiveRemoveIgnoredMarginPerCell = 0.13
-    aruco_params.maxErroneousBitsInBorderRate = 0.35
-    
-    # Configurar refinamiento de esquinas (reducido para velocidad)
-    if hasattr(aruco_params, 'cornerRefinementMethod'):
-        aruco_params.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
-    if hasattr(aruco_params, 'cornerRefinementWinSize'):
-        aruco_params.cornerRefinementWinSize = config['CORNER_REFINEMENT_WIN_SIZE']
-    if hasattr(aruco_params, 'cornerRefinementMaxIterations'):
-        aruco_params.cornerRefinementMaxIterations = config['CORNER_REFINEMENT_MAX_ITER']
-    if hasattr(aruco_params, 'cornerRefinementMinAccuracy'):
-        aruco_params.cornerRefinementMinAccuracy = config['CORNER_REFINEMENT_MIN_ACCURACY']
-    
-    # Detectar ArUco
-    detector = cv2.aruco.ArucoDetector(aruco_dict, aruco_params)
-    corners, ids, rejected = detector.detectMarkers(gray_suavizada)
-    
-    if ids is None or len(ids) < 2:
-        # Intentar con imagen original si falla
-        corners, ids, rejected = detector.detectMarkers(gray)
-    
-    if ids is None or len(ids) < 2:
-        return None, None
-    
-    # Refinar esquinas con precisión subpíxel (solo si es necesario)
-    corners_refinadas = detectar_esquinas_subpixel(gray, corners)
-    
-    return corners_refinadas, ids
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    image_bytes = base64.b64decode(image_data)
+    anotar_array('base64', image_data)
+    anotar_array('jpeg', image_bytes)
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    anotar_array('imagen', img)
+    return img
 
 # --- Rutas de la app web ---
 @app.route("/")
@@ -382,6 +168,18 @@ def privacy():
 def terms():
     return render_template("terms.html")
 
+@app.before_request
+def sincronizar_perfil():
+    """
+    Con un almacén de estado compartido, aplica el perfil que otro worker
+    activó con /configuracion (una lectura del almacén por petición).
+    """
+    if not almacen_compartido():
+        return
+    perfil = perfil_publicado()
+    if perfil is not None and perfil != obtener_perfil():
+        cambiar_configuracion(perfil)
+
 @app.route("/configuracion", methods=["POST"])
 def cambiar_configuracion_route():
     """
@@ -392,6 +190,7 @@ def cambiar_configuracion_route():
         tipo = data.get('tipo', 'velocidad')  # 'velocidad' o 'precision'
         
         cambiar_configuracion(tipo)
+        publicar_perfil(tipo)  # Los demás workers lo aplican en su siguiente petición
         config_actual = obtener_configuracion()
         
         return jsonify({
@@ -422,41 +221,109 @@ def generar():
     except Exception as e:
         return jsonify({"error": str(e)})
 
-def calcular_distancia_entre_bordes(corners1, corners2, metros_por_pixel):
+# --- Ruta para generar marcadores y hojas imprimibles bajo demanda ---
+@app.route("/marcadores")
+def marcadores():
     """
-    Calcula la distancia entre los bordes externos de dos marcadores ArUco.
-    Usa el punto más cercano entre los bordes externos para mayor precisión.
+    Genera un marcador o una hoja de marcadores al tamaño físico exacto.
+    Parámetros: ids ('0,1,5-9'), tamano_cm, dpi, formato (pdf/svg/png), papel (a4/a3/carta).
     """
-    # Obtener los bordes externos de cada marcador
-    # Para cada marcador, los bordes externos son los puntos más alejados
-    # en la dirección de la línea que conecta los centros
-    
-    # Calcular centros de los marcadores
-    center1 = np.mean(corners1, axis=0)
-    center2 = np.mean(corners2, axis=0)
-    
-    # Vector dirección entre centros
-    direction = center2 - center1
-    direction_normalized = direction / np.linalg.norm(direction)
-    
-    # Encontrar los puntos más externos en cada marcador
-    # en la dirección del otro marcador
-    
-    # Para el primer marcador: punto más alejado en dirección al segundo
-    distances1 = [np.dot(corner - center1, direction_normalized) for corner in corners1]
-    edge1_idx = np.argmax(distances1)
-    edge1 = corners1[edge1_idx]
-    
-    # Para el segundo marcador: punto más alejado en dirección al primero
-    distances2 = [np.dot(corner - center2, -direction_normalized) for corner in corners2]
-    edge2_idx = np.argmax(distances2)
-    edge2 = corners2[edge2_idx]
-    
-    # Calcular distancia entre bordes externos
-    distancia_bordes_px = np.linalg.norm(edge2 - edge1)
-    distancia_bordes_metros = distancia_bordes_px * metros_por_pixel
-    
-    return distancia_bordes_metros, edge1, edge2
+    try:
+        ids = interpretar_ids(request.args.get("ids", "0"), MAX_IDS_HOJA)
+        tamano_lado = float(request.args.get("tamano_cm", 5)) / 100.0
+        dpi = int(request.args.get("dpi", 300))
+        formato = request.args.get("formato", "pdf").lower()
+        papel = request.args.get("papel", "a4").lower()
+        
+        if tamano_lado <= 0 or not 72 <= dpi <= 1200:
+            return jsonify({"error": "El tamaño debe ser mayor que 0 y el DPI estar entre 72 y 1200."})
+        
+        contenido, etag = generar_hoja(ids, tamano_lado, dpi, formato, papel)
+        
+        respuesta = Response(contenido, mimetype=FORMATOS[formato])
+        respuesta.set_etag(etag)
+        respuesta.headers['Cache-Control'] = 'public, max-age=86400'
+        respuesta.headers['Content-Disposition'] = f'inline; filename="marcadores.{formato}"'
+        return respuesta.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": str(e)})
+
+@app.route("/metricas_cv")
+def metricas_cv():
+    """
+    Devuelve el estado del pool de visión (trabajadores, ocupación de la cola
+    y tiempos medios y máximos por etapa), la memoria del pool de buffers y las
+    estadísticas de la cascada de detección, del refinamiento de esquinas, del
+    seguimiento de esquinas entre detecciones, del filtro de calidad de los
+    frames, de las mediciones progresivas, de las sesiones de medición, del
+    almacén de estado, del servidor ASGI (None si se sirve por WSGI) y del
+    grabador de frames lentos, si hay un perfilado en curso y la memoria por
+    petición (si MEMORIA_RASTREO está activo).
+    """
+    estado_asgi = app.extensions.get('servidor_asgi')
+    return jsonify({
+        "pool_habilitado": pool_habilitado(),
+        "pool": estado_pool(),
+        "buffers": estado_buffers(),
+        "cascada": estado_cascada(),
+        "refinamiento": estado_refinamiento(),
+        "seguimiento": estado_seguimiento(),
+        "calidad": estado_calidad(),
+        "progresivas": estado_progresivas(),
+        "sesiones": estado_sesiones(),
+        "almacen": estado_almacen(),
+        "asgi": estado_asgi() if estado_asgi else None,
+        "grabador": estado_grabador(),
+        "perfilador": {"activo": estado_perfilado()["activa"]},
+        "memoria": estado_memoria()
+    })
+
+# --- Rutas de calibración de cámara ---
+@app.route("/calibracion", methods=["POST"])
+def calibrar_dispositivo():
+    """
+    Calibra la cámara de un modelo de dispositivo con fotos de un tablero de ajedrez
+    y guarda los intrínsecos para las mediciones posteriores.
+    """
+    try:
+        data = request.get_json()
+        modelo = data.get('modelo')
+        imagenes_data = data.get('imagenes', [])
+        
+        if not modelo:
+            return jsonify({"error": "Falta el modelo del dispositivo"})
+        
+        imagenes = [decodificar_imagen_base64(imagen_data) for imagen_data in imagenes_data]
+        imagenes = [imagen for imagen in imagenes if imagen is not None]
+        
+        calibracion = calibrar_camara(
+            imagenes,
+            columnas=int(data.get('columnas', 9)),
+            filas=int(data.get('filas', 6)),
+            tamano_cuadro=float(data.get('tamano_cuadro', 0.025))
+        )
+        guardar_calibracion(modelo, calibracion)
+        
+        return jsonify({"success": True, "modelo": modelo, "calibracion": calibracion})
+    except Exception as e:
+        return jsonify({"error": str(e)})
+
+@app.route("/calibracion/<modelo>")
+def obtener_calibracion(modelo):
+    """
+    Devuelve la calibración guardada de un modelo de dispositivo.
+    """
+    calibracion = cargar_calibracion(modelo)
+    if calibracion is None:
+        return jsonify({"error": f"No hay calibración para el modelo {modelo}"})
+    return jsonify({
+        "success": True,
+        "modelo": modelo,
+        "matriz_camara": calibracion['matriz_camara'].tolist(),
+        "coeficientes_distorsion": calibracion['coeficientes_distorsion'].tolist(),
+        "tamano_imagen": list(calibracion['tamano_imagen']),
+        "error_reproyeccion": calibracion['error_reproyeccion']
+    })
 
 def calcular_escala_precisa(corners, tamano_real_lado):
     """
@@ -492,9 +359,19 @@ def generar_visualizacion_medicion_optimizada(imagen_original, corners1, corners
     """
     Genera una visualización ultra-rápida mostrando solo la distancia entre ArUcos.
     """
-    # Crear una copia de la imagen para dibujar
-    imagen_visualizacion = imagen_original.copy()
-    
+    with prestar_buffers(imagen_original.shape) as buffers:
+        # Copia para dibujar en un buffer reutilizado (en color si llegó en escala de grises)
+        imagen_visualizacion = buffers.obtener('visualizacion', imagen_original.shape[:2] + (3,))
+        if len(imagen_original.shape) == 2:
+            cv2.cvtColor(imagen_original, cv2.COLOR_GRAY2BGR, dst=imagen_visualizacion)
+        else:
+            np.copyto(imagen_visualizacion, imagen_original)
+        return _dibujar_visualizacion(imagen_visualizacion, corners1, corners2, puntos_visualizacion, metodo_usado)
+
+def _dibujar_visualizacion(imagen_visualizacion, corners1, corners2, puntos_visualizacion, metodo_usado):
+    """
+    Dibuja los marcadores y la línea de medición sobre la imagen y la codifica en JPEG base64.
+    """
     # Colores para los marcadores
     color_rojo = (0, 0, 255)  # BGR
     color_azul = (255, 0, 0)  # BGR
@@ -537,6 +414,8 @@ def generar_visualizacion_medicion_optimizada(imagen_original, corners1, corners
     _, buffer = cv2.imencode('.jpg', imagen_visualizacion, 
                            [cv2.IMWRITE_JPEG_QUALITY, 70])  # Compresión máxima
     imagen_base64 = base64.b64encode(buffer).decode('utf-8')
+    anotar_array('jpeg_visualizacion', buffer)
+    anotar_array('base64_visualizacion', imagen_base64)
     
     return imagen_base64
 
@@ -550,165 +429,654 @@ def generar_visualizacion_medicion(imagen_original, corners1, corners2, puntos_v
         distancia_final, metodo_usado, confianza, debug_info
     )
 
-# --- Ruta para procesar imagen y detectar ArUco con precisión mejorada ---
-@app.route("/detectar_aruco", methods=["POST"])
-def detectar_aruco():
+def procesar_modo_homografia(img, data, tamano_lado):
+    """
+    Actualiza la homografía del suelo de la sesión con el primer marcador detectado
+    y mide los pares de puntos enviados por el cliente.
+    
+    Args:
+        img: Imagen BGR decodificada
+        data: Cuerpo JSON de la petición (sesion_id y pares opcionales)
+        tamano_lado: Tamaño real del lado del marcador en metros
+    
+    Returns:
+        dict: Resultado listo para serializar
+    """
+    sesion_id = data.get('sesion_id')
+    if not sesion_id:
+        return {"error": "El modo homografía requiere un sesion_id"}
+    
+    corners, ids = mejorar_deteccion_aruco(img, min_marcadores=1)
+    if ids is None:
+        return {"error": "No se detectó ningún código ArUco. Asegúrate de que el marcador sea completamente visible."}
+    
+    # Usar el marcador de menor ID para que la referencia sea estable entre frames
+    indice = int(np.argmin(ids.flatten()))
+    marker_corners = np.asarray(corners[indice]).reshape(4, 2)
+    
+    ancho_deteccion, alto_deteccion = calcular_tamano_deteccion(img.shape[1], img.shape[0])
+    escala_imagen = (ancho_deteccion / img.shape[1], alto_deteccion / img.shape[0])
+    corners_originales = marker_corners / np.array(escala_imagen)
+    
+    tamano_lado = obtener_tamano_marcador(ids.flatten()[indice], tamano_lado)
+    homografia = calcular_homografia_marcador(marker_corners, tamano_lado, escala_imagen)
+    estado = actualizar_homografia_sesion(sesion_id, homografia, corners_originales, tamano_lado)
+    
+    resultado = {
+        "success": True,
+        "modo": "homografia",
+        "sesion_id": sesion_id,
+        "id_referencia": int(ids.flatten()[indice]),
+        "homografia": estado['homografia'].tolist(),
+        "frames_homografia": estado['num_frames']
+    }
+    
+    pares = data.get('pares')
+    if pares:
+        resultado["distancias"] = [round(float(d), 3) for d in medir_pares(estado['homografia'], pares)]
+    
+    return resultado
+
+def procesar_modo_contorno(img, data, tamano_lado):
+    """
+    Mide el contorno de la sala con un marcador en cada esquina y calcula
+    directamente la distribución de luminarias para esa planta.
+    
+    Args:
+        img: Imagen decodificada
+        data: Opciones de la petición ('orden': 'angular' o 'ids', modelo_dispositivo)
+        tamano_lado: Tamaño real del lado del marcador en metros
+    
+    Returns:
+        dict: Resultado listo para serializar
+    """
+    corners, ids = mejorar_deteccion_aruco(img, min_marcadores=MIN_ESQUINAS)
+    if ids is None:
+        return {"error": f"Se necesitan al menos {MIN_ESQUINAS} códigos ArUco, uno en cada esquina de la sala, completamente visibles."}
+    comprobar_cancelacion()
+    
+    # Intrínsecos calibrados si el dispositivo los tiene (si no, se estima la focal)
+    tamano_deteccion = calcular_tamano_deteccion(img.shape[1], img.shape[0])
+    matriz_camara, coeficientes = (None, None)
+    if data.get('modelo_dispositivo'):
+        matriz_camara, coeficientes = obtener_intrinsecos(data['modelo_dispositivo'], tamano_deteccion)
+    if matriz_camara is not None:
+        corners = corregir_esquinas([np.asarray(c).reshape(4, 2) for c in corners], matriz_camara, coeficientes)
+    
+    try:
+        contorno, error = calcular_contorno(corners, ids, tamano_lado, obtener_tamano_marcador,
+                                            tamano_deteccion, matriz_camara, data.get('orden', 'angular'))
+    except ValueError as e:
+        return {"error": str(e)}
+    if error:
+        return {"error": error}
+    
+    luminarias = calcular_luminarias_poligono(contorno['vertices'])
+    return {
+        "success": True,
+        "modo": "contorno",
+        "ids_orden": contorno['ids_orden'],
+        "focal_px": round(contorno['focal_px'], 1),
+        "focal_estimada": contorno['focal_estimada'],
+        "vertices": luminarias['vertices'],
+        "lados": [round(float(lado), 3) for lado in contorno['lados']],
+        "perimetro": round(contorno['perimetro'], 3),
+        "area": round(contorno['area'], 3),
+        "luminarias": {
+            "nl": luminarias["nl"],
+            "x": luminarias["x"],
+            "y": luminarias["y"],
+            "total": luminarias["total"],
+            "image_url": url_for("static", filename=os.path.basename(luminarias["image_path"]))
+        }
+    }
+
+@app.route("/medir_puntos", methods=["POST"])
+def medir_puntos():
+    """
+    Mide pares de puntos (en píxeles de la imagen original) con la homografía
+    guardada de la sesión, sin volver a detectar marcadores.
+    """
     try:
-        # Recibe imagen y tamaño del lado del ArUco (en metros)
         data = request.get_json()
-        image_data = data.get('image')
-        TAMANO_REAL_LADO = float(data.get('tamano_lado', 0.05))  # 0.05 m = 5 cm por defecto
-        config = obtener_configuracion()
-        generar_visualizacion = data.get('generar_visualizacion', True)  # Por defecto siempre generar visualización
+        homografia = obtener_homografia_sesion(data.get('sesion_id'))
+        if homografia is None:
+            return jsonify({"error": "La sesión no tiene homografía. Envía primero un frame en modo homografía."})
         
-        if not image_data:
-            return jsonify({"error": "No se recibió imagen"})
-        
-        # Decodifica la imagen base64
-        image_data = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        
-        # Convierte a imagen OpenCV
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            return jsonify({"error": "No se pudo decodificar la imagen"})
+        pares = data.get('pares', [])
+        if not pares:
+            return jsonify({"error": "No se recibieron pares de puntos"})
         
+        distancias = medir_pares(homografia, pares)
+        return jsonify({
+            "success": True,
+            "distancias": [round(float(d), 3) for d in distancias]
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)})
+
+def leer_frame_peticion():
+    """
+    Lee el frame de la petición actual en cualquiera de los formatos de entrada:
+    JSON con la imagen JPEG en base64, o un buffer crudo en escala de grises
+    (application/octet-stream con cabeceras X-Ancho, X-Alto y X-Compresion y
+    las opciones en la query string).
+    
+    Returns:
+        data: Opciones de la petición
+        img: Imagen decodificada (BGR o escala de grises) o None
+        error: Mensaje de error o None
+    """
+    if request.mimetype == TIPO_CONTENIDO_CRUDO:
+        data = request.args.to_dict()
+        for opcion in ('generar_visualizacion', 'progresivo'):
+            if opcion in data:
+                data[opcion] = data[opcion].lower() in ('1', 'true', 'si')
+        try:
+            cuerpo = request.get_data(cache=False)
+            anotar_array('cuerpo', cuerpo)
+            img = decodificar_gris_crudo(
+                cuerpo,
+                int(request.headers.get('X-Ancho', 0)),
+                int(request.headers.get('X-Alto', 0)),
+                request.headers.get('X-Compresion', 'ninguna')
+            )
+            anotar_array('imagen', img)
+        except ValueError as e:
+            return data, None, str(e)
+        return data, img, None
+    
+    data = request.get_json()
+    anotar_array('cuerpo', request.get_data())  # Ya en caché tras get_json
+    image_data = data.get('image')
+    if not image_data:
+        return data, None, "No se recibió imagen"
+    
+    # Decodifica la imagen base64 y la convierte a imagen OpenCV
+    img = decodificar_imagen_base64(image_data)
+    if img is None:
+        return data, None, "No se pudo decodificar la imagen"
+    return data, img, None
+
+@app.route("/capacidades")
+def capacidades():
+    """
+    Formatos de entrada y compresiones que acepta /detectar_aruco, formatos y
+    codificaciones de respuesta, si la medición progresiva está disponible con
+    el perfil activo, para que el cliente negocie el modo de envío, y marcadores
+    que reconoce el detector.
+    """
+    return jsonify({
+        "formatos_entrada": ["jpeg_base64", "gris_crudo"],
+        "compresiones": compresiones_disponibles(),
+        "formatos_respuesta": list(FORMATOS_RESPUESTA),
+        "codificaciones_respuesta": codificaciones_disponibles(),
+        "progresivo": progresivo_disponible(),
+        "diccionario": describir_diccionario()
+    })
+
+def medir_frame(img, data, historial=None, tiempos=None, seguimiento=None):
+    """
+    Mide la distancia entre dos marcadores en un frame: filtro de calidad,
+    detección (o seguimiento de las esquinas del frame anterior), geometría,
+    filtrado temporal, selección del método y visualización opcional.
+    
+    Args:
+        img: Imagen decodificada (BGR o escala de grises)
+        data: Opciones de la petición (tamano_lado, generar_visualizacion, modelo_dispositivo,
+            formato_respuesta)
+        historial: Deque del filtro temporal (por defecto el global del almacén de estado)
+        tiempos: Diccionario donde anotar los ms de cada etapa (opcional)
+        seguimiento: Estado de seguimiento de la sesión; si el perfil lo permite, entre
+            detecciones completas las esquinas se siguen con flujo óptico (opcional)
+    
+    Returns:
+        dict: Resultado de la medición o {"error": mensaje}; si el frame no pasa el
+            filtro de calidad, además 'rechazo_calidad' con el motivo y las medidas
+    """
+    filtro_global = historial is None
+    if filtro_global:
+        historial = obtener_filtro_global()
+    if tiempos is None:
+        tiempos = {}
+    inicio = time.perf_counter()
+    
+    TAMANO_REAL_LADO = float(data.get('tamano_lado', 0.05))  # 0.05 m = 5 cm por defecto
+    modelo_dispositivo = data.get('modelo_dispositivo')  # Para usar intrínsecos calibrados
+    try:
+        # 'ligero' no serializa el área, la escala ni el debug_info (que ni se construye)
+        completo = formato_pedido(data) == 'completo'
+    except ValueError as e:
+        return {"error": str(e)}
+    # Por defecto se genera la visualización solo en 'completo'; en 'ligero' hay que pedirla
+    generar_visualizacion = data.get('generar_visualizacion', completo)
+    
+    # Frames movidos o mal expuestos: se rechazan sin detectar, antes de que
+    # gasten CPU o den esquinas malas que entren en el filtro temporal
+    calidad = None
+    if obtener_configuracion()['FILTRO_CALIDAD']:
+        calidad = evaluar_calidad(img)
+        tiempos['calidad'] = (time.perf_counter() - inicio) * 1000
+        if calidad['motivo'] is not None:
+            return {"error": MENSAJES_RECHAZO[calidad['motivo']], "rechazo_calidad": calidad}
+        inicio = time.perf_counter()
+    
+    # Seguimiento de las esquinas del frame anterior de la sesión, sin detección completa
+    gris_sesion, seguido = None, None
+    if seguimiento is not None and seguimiento_habilitado():
+        gris_sesion = gris_seguimiento(img, calcular_tamano_deteccion(img.shape[1], img.shape[0]))
+        seguido = seguir_esquinas(seguimiento, gris_sesion, img.shape)
+        tiempos['seguimiento'] = (time.perf_counter() - inicio) * 1000
+        if seguido is None:
+            reiniciar_seguimiento(seguimiento)
+    
+    # Detección y geometría (en el pool de visión si está habilitado)
+    resultado_pool = None
+    if seguido is None and pool_habilitado():
+        resultado_pool, tiempos_pool = procesar_en_pool(img, TAMANO_REAL_LADO, modelo_dispositivo)
+    
+    if seguido is not None:
+        # Esquinas seguidas: misma geometría que con las detectadas
+        inicio = time.perf_counter()
+        geometria, error = calcular_geometria_medicion(
+            seguido['corners'], seguido['ids'], TAMANO_REAL_LADO, img.shape, modelo_dispositivo
+        )
+        tiempos['geometria'] = (time.perf_counter() - inicio) * 1000
+    elif resultado_pool is not None:
+        geometria, error = resultado_pool
+        tiempos.update({etapa: ms for etapa, ms in tiempos_pool.items() if etapa in ('deteccion', 'geometria')})
+    else:
         # Usar función mejorada de detección de ArUco
+        inicio = time.perf_counter()
         corners, ids = mejorar_deteccion_aruco(img)
+        tiempos['deteccion'] = (time.perf_counter() - inicio) * 1000
         
         if ids is None or len(ids) < 2:
-            return jsonify({"error": "Se necesitan al menos 2 códigos ArUco para medir. Asegúrate de que ambos marcadores sean completamente visibles y estén bien iluminados."})
-        
-        # Ordenar marcadores por ID para consistencia
-        marker_indices = np.argsort(ids.flatten())
-        corners = [corners[i] for i in marker_indices]
-        ids = ids[marker_indices]
-        
-        # Obtener las esquinas de los dos primeros marcadores
-        marker1_corners = corners[0][0]
-        marker2_corners = corners[1][0]
+            return {"error": "Se necesitan al menos 2 códigos ArUco para medir. Asegúrate de que ambos marcadores sean completamente visibles y estén bien iluminados."}
         
-        # Calcular escala precisa usando el primer marcador
-        metros_por_pixel, lado_px = calcular_escala_precisa(marker1_corners, TAMANO_REAL_LADO)
-        
-        # Calcular distancia usando método multipunto mejorado
-        distancia_multipunto_metros, puntos_medicion, distancia_centros_metros = calcular_distancia_multipunto(
-            marker1_corners, marker2_corners, metros_por_pixel
-        )
-        
-        # Calcular distancia con corrección de perspectiva
-        distancia_perspectiva_metros = calcular_distancia_con_correccion_perspectiva(
-            marker1_corners, marker2_corners, metros_por_pixel, img.shape
-        )
-        
-        # Aplicar filtrado temporal para mayor estabilidad
-        distancia_filtrada, confianza = filtrar_mediciones_temporales(distancia_multipunto_metros)
-        
-        # Calcular también distancia entre bordes externos para comparación
-        distancia_bordes_metros, edge1, edge2 = calcular_distancia_entre_bordes(
-            marker1_corners, marker2_corners, metros_por_pixel
-        )
+        comprobar_cancelacion()
         
-        # Área del cuadrado usando la distancia filtrada
-        area = distancia_filtrada * distancia_filtrada
-        
-        # Información adicional para debugging y análisis
-        debug_info = {
-            "lado_px": float(lado_px),
-            "metros_por_pixel": float(metros_por_pixel),
-            "distancia_centros_metros": float(distancia_centros_metros),
-            "distancia_bordes_metros": float(distancia_bordes_metros),
-            "distancia_multipunto_metros": float(distancia_multipunto_metros),
-            "distancia_perspectiva_metros": float(distancia_perspectiva_metros),
-            "distancia_filtrada_metros": float(distancia_filtrada),
-            "confianza_medicion": float(confianza),
-            "num_mediciones_previas": len(mediciones_previas),
-            "diferencia_centros_bordes": float(distancia_centros_metros - distancia_bordes_metros),
-            "diferencia_multipunto_bordes": float(distancia_multipunto_metros - distancia_bordes_metros),
-            "diferencia_perspectiva_bordes": float(distancia_perspectiva_metros - distancia_bordes_metros),
-            "ids_detectados": ids.flatten().tolist(),
-            "num_puntos_medicion": len(puntos_medicion),
-            "desviacion_estandar": float(np.std([distancia_centros_metros, distancia_bordes_metros, distancia_multipunto_metros, distancia_perspectiva_metros])),
-            "media_distancias": float(np.mean([distancia_centros_metros, distancia_bordes_metros, distancia_multipunto_metros, distancia_perspectiva_metros]))
-        }
+        # Geometría de la medición (escala, distancias por cada método)
+        inicio = time.perf_counter()
+        geometria, error = calcular_geometria_medicion(corners, ids, TAMANO_REAL_LADO, img.shape, modelo_dispositivo)
+        tiempos['geometria'] = (time.perf_counter() - inicio) * 1000
+    
+    if geometria is None:
+        if seguido is not None:
+            reiniciar_seguimiento(seguimiento)
+        return {"error": error}
+    if gris_sesion is not None and seguido is None:
+        # Detección completa: punto de partida de los frames seguidos siguientes
+        iniciar_seguimiento(seguimiento, gris_sesion, img.shape, geometria['corners'], geometria['ids'])
+    
+    # Aplicar filtrado temporal para mayor estabilidad
+    inicio = time.perf_counter()
+    distancia_filtrada, confianza = filtrar_mediciones_temporales(geometria['distancia_referencia'], historial=historial)
+    if filtro_global:
+        guardar_filtro_global(historial)
+    
+    distancia_final, metodo_usado, debug_info = seleccionar_distancia(
+        geometria, distancia_filtrada, confianza, len(historial), incluir_debug=completo
+    )
+    tiempos['filtrado'] = (time.perf_counter() - inicio) * 1000
+    if completo and resultado_pool is not None:
+        debug_info["tiempos_pool_ms"] = {etapa: round(ms, 2) for etapa, ms in tiempos_pool.items()}
+    if completo and calidad is not None:
+        debug_info["calidad"] = calidad
+    marker1_corners = geometria['marker1_corners']
+    marker2_corners = geometria['marker2_corners']
+    puntos_medicion = geometria['puntos_medicion']
+    edge1, edge2 = geometria['edge1'], geometria['edge2']
+    metros_por_pixel = geometria['metros_por_pixel']
+    
+    # Sugerencia de captura para el siguiente frame, en píxeles del frame recibido.
+    # Con intrínsecos calibrados (PnP) el frame debe llegar entero, sin recortar
+    alto_imagen, ancho_imagen = img.shape[:2]
+    escala_deteccion = calcular_tamano_deteccion(ancho_imagen, alto_imagen)[0] / ancho_imagen
+    sugerencia_captura = sugerir_captura(
+        np.vstack([marker1_corners, marker2_corners]) / escala_deteccion,
+        lado_medido_px([marker1_corners, marker2_corners]) / escala_deteccion,
+        (ancho_imagen, alto_imagen),
+        confianza,
+        usar_roi=geometria['distancia_pnp_metros'] is None
+    )
+    if gris_sesion is not None:
+        mantener_encuadre(sugerencia_captura, ancho_imagen, seguido is not None)
+    
+    # Generar visualización del método de medición (solo si se solicita)
+    imagen_base64 = None
+    if generar_visualizacion:
+        comprobar_cancelacion()
+        inicio = time.perf_counter()
+        try:
+            # Pasar los puntos exactos calculados para cada método
+            puntos_visualizacion = None
+            if metodo_usado == 'bordes_externos':
+                puntos_visualizacion = (edge1, edge2)  # Usar los bordes calculados
+            elif metodo_usado in ['multipunto', 'filtrado_temporal']:
+                puntos_visualizacion = puntos_medicion  # Usar los puntos multipunto
+            else:
+                # Para otros métodos, usar los centros
+                centro1 = np.mean(marker1_corners, axis=0)
+                centro2 = np.mean(marker2_corners, axis=0)
+                puntos_visualizacion = [(centro1, centro2)]
+            
+            imagen_base64 = generar_visualizacion_medicion(
+                img, marker1_corners, marker2_corners, puntos_visualizacion,
+                distancia_final, metodo_usado, confianza, debug_info
+            )
+        except Exception as e:
+            print(f"Error generando visualización: {str(e)}")
+            imagen_base64 = None
+        tiempos['visualizacion'] = (time.perf_counter() - inicio) * 1000
+    
+    resultado = {
+        "success": True,
+        "distancia": round(float(distancia_final), 3),
+        "confianza": round(float(confianza), 2),
+        "metodo_usado": metodo_usado,
+        # Área del cuadrado usando la distancia filtrada (en los dos formatos, para que coincidan)
+        "area": round(float(distancia_filtrada * distancia_filtrada), 2),
+        "origen": "detectado" if seguido is None else "seguido",
+        "sugerencia_captura": sugerencia_captura,
+    }
+    if seguido is not None:
+        resultado["error_seguimiento_px"] = round(seguido['error_px'], 3)
+    if generar_visualizacion:
+        resultado["visualizacion"] = imagen_base64
+    if not completo:
+        return resultado
+    
+    # Resultados para el frontend con información mejorada
+    return dict(resultado, **{
+        "distancia_detectada_px": round(float(np.linalg.norm(edge2 - edge1)), 2),
+        "metros_por_pixel": float(metros_por_pixel),
+        "tamano_lado": TAMANO_REAL_LADO,
+        "debug_info": debug_info,
+        "visualizacion": imagen_base64
+    })
+
+def medir_frame_progresivo(img, data, tiempos=None, sesion_id=None, sesion=None):
+    """
+    Medición progresiva: responde enseguida con una estimación preliminar del
+    frame (perfil PERFIL_PRELIMINAR, sin filtro temporal ni visualización) y
+    deja el mismo frame en cola para medirlo con el perfil activo. El resultado
+    refinado se recoge con GET /mediciones/<medicion_id>; en una sesión solo el
+    refinado entra en el filtro temporal y cuenta para la convergencia.
+    
+    Args:
+        img: Imagen decodificada (BGR o escala de grises)
+        data: Opciones de la petición (las mismas que medir_frame)
+        tiempos: Diccionario donde anotar los ms de cada etapa preliminar (opcional)
+        sesion_id: Sesión de medición del frame (opcional)
+        sesion: Datos de esa sesión, con su filtro temporal (opcional)
+    
+    Returns:
+        dict: Resultado preliminar con 'fase' y 'medicion_id' (None si no se refina)
+    """
+    perfil_refinado = obtener_perfil()
+    with usar_perfil(CONFIG_PROGRESIVO['PERFIL_PRELIMINAR']):
+        preliminar = medir_frame(img, dict(data, generar_visualizacion=False, formato_respuesta='ligero'),
+                                 historial=deque(maxlen=1), tiempos=tiempos)
+    # La sugerencia de captura del perfil preliminar reduciría el frame que se refina: llega con el refinado
+    preliminar.pop('sugerencia_captura', None)
+    preliminar['fase'] = 'preliminar'
+    
+    if 'rechazo_calidad' in preliminar:
+        # Frame movido o mal expuesto: el perfil refinado, más estricto, también lo rechazaría
+        preliminar['medicion_id'] = None
+        if sesion is not None:
+            preliminar['sesion'] = registrar_frame(sesion_id, preliminar)
+        return preliminar
+    
+    def refinar():
+        # Sin detección preliminar también se refina: los marcadores pequeños solo aparecen a resolución completa
+        with usar_perfil(perfil_refinado):
+            if sesion is None:
+                return medir_frame(img, data)
+            # Se vuelve a leer: desde la preliminar pudieron entrar frames de otros workers
+            sesion_actual = obtener_sesion(sesion_id)
+            if sesion_actual is None:
+                return {"error": "Sesión no encontrada o expirada. Abre una nueva con POST /sesiones"}
+            resultado = medir_frame(img, data, historial=sesion_actual['historial'])
+            resultado['sesion'] = registrar_frame(sesion_id, resultado, historial=sesion_actual['historial'])
+            return resultado
+    
+    preliminar['medicion_id'] = programar_refinado(refinar)
+    if sesion is not None:
+        preliminar['sesion'] = resumen_sesion(sesion_id)
+    return preliminar
+
+def procesar_frame(img, data, historial=None, tiempos=None):
+    """
+    Procesa un frame según el modo pedido (medición, homografía o contorno).
+    
+    Args:
+        img: Imagen decodificada (BGR o escala de grises)
+        data: Opciones de la petición
+        historial: Deque del filtro temporal para el modo medición (opcional)
+        tiempos: Diccionario donde anotar los ms de cada etapa (opcional)
+    
+    Returns:
+        dict: Resultado listo para serializar
+    """
+    TAMANO_REAL_LADO = float(data.get('tamano_lado', 0.05))  # 0.05 m = 5 cm por defecto
+    
+    # Modo homografía: basta un marcador para medir puntos arbitrarios del suelo
+    if data.get('modo') == 'homografia':
+        return procesar_modo_homografia(img, data, TAMANO_REAL_LADO)
+    
+    # Modo contorno: un marcador en cada esquina de la sala, todo en un solo frame
+    if data.get('modo') == 'contorno':
+        return procesar_modo_contorno(img, data, TAMANO_REAL_LADO)
+    
+    if data.get('progresivo') and progresivo_disponible():
+        return medir_frame_progresivo(img, data, tiempos)
+    return medir_frame(img, data, historial, tiempos)
+
+# --- Ruta para procesar imagen y detectar ArUco con precisión mejorada ---
+@app.route("/detectar_aruco", methods=["POST"])
+def detectar_aruco():
+    inicio = time.perf_counter()
+    data, img, tiempos = None, None, {}
+    try:
+        with medir_memoria() as memoria:
+            # Recibe imagen (JPEG en base64 o gris crudo) y tamaño del lado del ArUco (en metros)
+            data, img, error = leer_frame_peticion()
+            tiempos['decodificacion'] = (time.perf_counter() - inicio) * 1000
+            if error:
+                return responder({"error": error}, request)
+            
+            resultado = procesar_frame(img, data, tiempos=tiempos)
+        adjuntar_memoria(resultado, memoria)
+        grabar_frame_si_procede(img, data, tiempos, resultado, inicio)
+        return responder(resultado, request)
         
-        # Determinar qué distancia usar basado en la confianza y consistencia
-        distancias_disponibles = {
-            "filtrado_temporal": distancia_filtrada,
-            "multipunto": distancia_multipunto_metros,
-            "perspectiva": distancia_perspectiva_metros,
-            "bordes_externos": distancia_bordes_metros,
-            "centros": distancia_centros_metros
+    except PeticionCancelada:
+        return responder({"error": "Petición cancelada: el cliente se desconectó"}, request)
+    except Exception as e:
+        import traceback
+        print(f"Error en detectar_aruco: {str(e)}")
+        print(traceback.format_exc())
+        resultado = {"error": f"Error al procesar imagen: {str(e)}"}
+        grabar_frame_si_procede(img, data, tiempos, dict(resultado, traceback=traceback.format_exc()), inicio)
+        return responder(resultado, request)
+
+# --- Sesiones de medición: el servidor indica cuándo la lectura ha convergido ---
+@app.route("/sesiones", methods=["POST"])
+def crear_sesion_medicion():
+    """
+    Abre una sesión de medición. Cuerpo JSON opcional: tamano_lado (metros) y
+    modelo_dispositivo, que se aplican a todos los frames de la sesión.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        tamano_lado = float(data.get('tamano_lado', 0.05))
+    except (TypeError, ValueError):
+        return jsonify({"error": "tamano_lado debe ser un número en metros"})
+    sesion_id = crear_sesion(tamano_lado, data.get('modelo_dispositivo'))
+    config = obtener_configuracion()
+    return jsonify({
+        "success": True,
+        "sesion_id": sesion_id,
+        "convergencia": {
+            "tolerancia": config['CONVERGENCIA_TOLERANCIA'],
+            "segundos": config['CONVERGENCIA_SEGUNDOS'],
+            "frames_minimos": config['CONVERGENCIA_MIN_FRAMES'],
         }
+    })
+
+@app.route("/sesiones/<sesion_id>/frame", methods=["POST"])
+def medir_frame_sesion(sesion_id):
+    """
+    Mide un frame dentro de una sesión (mismos formatos de entrada que
+    /detectar_aruco). La respuesta incluye 'sesion' con 'convergida'; cuando es
+    true el cliente debe dejar de enviar frames y usar 'resultado_final'.
+    """
+    inicio = time.perf_counter()
+    data, img, tiempos = None, None, {}
+    try:
+        sesion = obtener_sesion(sesion_id)
+        if sesion is None:
+            return responder({"error": "Sesión no encontrada o expirada. Abre una nueva con POST /sesiones"}, request)
         
-        # Calcular consistencia entre métodos
-        desviacion_entre_metodos = debug_info["desviacion_estandar"]
-        media_entre_metodos = debug_info["media_distancias"]
-        consistencia_metodos = 1.0 - (desviacion_entre_metodos / media_entre_metodos) if media_entre_metodos > 0 else 0.5
-        
-        # Selección inteligente del método
-        if confianza > 0.8 and consistencia_metodos > 0.9:
-            # Alta confianza y alta consistencia: usar filtrado temporal
-            distancia_final = distancia_filtrada
-            metodo_usado = "filtrado_temporal"
-        elif confianza > 0.6 and consistencia_metodos > 0.7:
-            # Confianza media y buena consistencia: usar multipunto
-            distancia_final = distancia_multipunto_metros
-            metodo_usado = "multipunto"
-        elif consistencia_metodos > 0.5:
-            # Consistencia aceptable: usar perspectiva
-            distancia_final = distancia_perspectiva_metros
-            metodo_usado = "perspectiva"
-        else:
-            # Baja consistencia: usar bordes externos (más estable)
-            distancia_final = distancia_bordes_metros
-            metodo_usado = "bordes_externos"
+        # Los frames que llegan tras converger no se procesan
+        if sesion['convergida']:
+            return responder({"success": True, "sesion": resumen_sesion(sesion_id)}, request)
         
-        # Generar visualización del método de medición (solo si se solicita)
-        imagen_base64 = None
-        if generar_visualizacion:
-            try:
-                # Pasar los puntos exactos calculados para cada método
-                puntos_visualizacion = None
-                if metodo_usado == 'bordes_externos':
-                    puntos_visualizacion = (edge1, edge2)  # Usar los bordes calculados
-                elif metodo_usado in ['multipunto', 'filtrado_temporal']:
-                    puntos_visualizacion = puntos_medicion  # Usar los puntos multipunto
-                else:
-                    # Para otros métodos, usar los centros
-                    centro1 = np.mean(marker1_corners, axis=0)
-                    centro2 = np.mean(marker2_corners, axis=0)
-                    puntos_visualizacion = [(centro1, centro2)]
-                
-                imagen_base64 = generar_visualizacion_medicion(
-                    img, marker1_corners, marker2_corners, puntos_visualizacion,
-                    distancia_final, metodo_usado, confianza, debug_info
-                )
-            except Exception as e:
-                print(f"Error generando visualización: {str(e)}")
-                imagen_base64 = None
-        
-        # Devuelve los resultados al frontend con información mejorada
-        return jsonify({
-            "success": True,
-            "distancia": round(float(distancia_final), 3),
-            "area": round(float(area), 2),
-            "distancia_detectada_px": round(float(np.linalg.norm(edge2 - edge1)), 2),
-            "metros_por_pixel": float(metros_por_pixel),
-            "tamano_lado": TAMANO_REAL_LADO,
-            "confianza": round(float(confianza), 2),
-            "metodo_usado": metodo_usado,
-            "debug_info": debug_info,
-            "visualizacion": imagen_base64
-        })
+        with medir_memoria() as memoria:
+            data, img, error = leer_frame_peticion()
+            tiempos['decodificacion'] = (time.perf_counter() - inicio) * 1000
+            if error:
+                return responder({"error": error}, request)
+            data.setdefault('tamano_lado', sesion['tamano_lado'])
+            if sesion['modelo_dispositivo']:
+                data.setdefault('modelo_dispositivo', sesion['modelo_dispositivo'])
+            
+            if data.get('progresivo') and progresivo_disponible():
+                resultado = medir_frame_progresivo(img, data, tiempos, sesion_id=sesion_id, sesion=sesion)
+            else:
+                seguimiento = obtener_seguimiento(sesion_id)
+                resultado = medir_frame(img, data, historial=sesion['historial'], tiempos=tiempos,
+                                        seguimiento=seguimiento)
+                resultado["sesion"] = registrar_frame(sesion_id, resultado, historial=sesion['historial'],
+                                                      seguimiento=seguimiento)
+        adjuntar_memoria(resultado, memoria)
+        grabar_frame_si_procede(img, data, tiempos, resultado, inicio)
+        return responder(resultado, request)
         
+    except PeticionCancelada:
+        return responder({"error": "Petición cancelada: el cliente se desconectó"}, request)
     except Exception as e:
         import traceback
-        print(f"Error en detectar_aruco: {str(e)}")
+        print(f"Error en medir_frame_sesion: {str(e)}")
         print(traceback.format_exc())
-        return jsonify({"error": f"Error al procesar imagen: {str(e)}"})
+        resultado = {"error": f"Error al procesar imagen: {str(e)}"}
+        grabar_frame_si_procede(img, data, tiempos, dict(resultado, traceback=traceback.format_exc()), inicio)
+        return responder(resultado, request)
+
+@app.route("/sesiones/<sesion_id>")
+def obtener_sesion_medicion(sesion_id):
+    """
+    Resultado de una sesión: convergencia, frames usados y medición final.
+    """
+    resumen = resumen_sesion(sesion_id)
+    if resumen is None:
+        return jsonify({"error": "Sesión no encontrada o expirada"})
+    return jsonify(dict(resumen, success=True))
+
+@app.route("/mediciones/<medicion_id>")
+def obtener_medicion_refinada(medicion_id):
+    """
+    Resultado refinado de una medición progresiva. Parámetro opcional espera
+    (segundos): si aún está pendiente, espera a que termine como mucho ese
+    tiempo antes de responder con fase 'pendiente'.
+    """
+    try:
+        espera = float(request.args.get('espera', 0))
+    except ValueError:
+        return jsonify({"error": "espera debe ser un número de segundos"})
+    resultado = obtener_medicion(medicion_id, espera)
+    if resultado is None:
+        return jsonify({"error": "Medición no encontrada o expirada"})
+    return responder(resultado, request)
+
+# --- Perfilador bajo demanda (solo administración, cabecera X-Token-Admin) ---
+@app.route("/perfilador", methods=["GET", "POST"])
+def perfilador():
+    """
+    POST empieza a perfilar las próximas peticiones de este worker. Cuerpo JSON
+    opcional: modo ('cprofile' o 'muestreo'), peticiones, segundos y rutas
+    (prefijos separados por comas). GET devuelve el estado y el resumen de las
+    funciones del pipeline.
+    """
+    error = comprobar_token(request.headers.get('X-Token-Admin'))
+    if error:
+        return jsonify({"error": error})
+    if request.method == "GET":
+        return jsonify(estado_perfilado())
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        rutas = [ruta.strip() for ruta in data.get('rutas', '/detectar_aruco,/sesiones').split(',') if ruta.strip()]
+        estado = iniciar_perfilado(
+            app,
+            modo=data.get('modo', 'cprofile'),
+            peticiones=int(data.get('peticiones', 50)),
+            segundos=float(data.get('segundos', 60)),
+            rutas=rutas
+        )
+        return jsonify(dict(estado, success=True))
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": str(e)})
+
+@app.route("/perfilador/detener", methods=["POST"])
+def detener_perfilador():
+    """
+    Termina el perfilado en curso; los resultados se pueden seguir descargando.
+    """
+    error = comprobar_token(request.headers.get('X-Token-Admin'))
+    if error:
+        return jsonify({"error": error})
+    return jsonify(detener_perfilado())
+
+@app.route("/perfilador/descarga")
+def descargar_perfil():
+    """
+    Descarga el último perfil: .pstats (modo cprofile) o pilas plegadas para
+    flamegraph (modo muestreo).
+    """
+    error = comprobar_token(request.headers.get('X-Token-Admin'))
+    if error:
+        return jsonify({"error": error})
+    perfil = exportar_perfil()
+    if perfil is None:
+        return jsonify({"error": "No hay resultados de perfilado en este worker"})
+    contenido, nombre, tipo = perfil
+    respuesta = Response(contenido, mimetype=tipo)
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return respuesta
+
+# --- Diferencias de memoria entre instantáneas, para buscar fugas (administración) ---
+@app.route("/memoria/instantanea", methods=["GET", "POST"])
+def instantanea_memoria():
+    """
+    POST guarda la instantánea base de la memoria de este worker. GET la compara
+    con la memoria actual; parámetros: top (entradas) y agrupar
+    ('lineno', 'filename' o 'traceback').
+    """
+    error = comprobar_token(request.headers.get('X-Token-Admin'))
+    if error:
+        return jsonify({"error": error})
+    try:
+        if request.method == "POST":
+            return jsonify(dict(tomar_instantanea_base(), success=True))
+        return jsonify(diferencias_instantanea(
+            top=int(request.args.get('top', 20)),
+            agrupar=request.args.get('agrupar', 'lineno')
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)})
 
 # --- Ejecuta la app en modo debug ---
 if __name__ == "__main__":
@@ -0,0 +1,157 @@
+# --- Pool de buffers de imagen reutilizables por proceso ---
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from config_optimizacion import CONFIG_BUFFERS
+from memoria_peticiones import anotar_array
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+class JuegoBuffers:
+    """
+    Conjunto de arrays para procesar un frame de una resolución. Se presta a una
+    sola petición a la vez, así que sus arrays pueden usarse como `dst=` de OpenCV.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._arrays = {}
+
+    def obtener(self, nombre, forma, dtype=np.uint8):
+        """
+        Devuelve el array `nombre` con la forma pedida, reservándolo solo la primera vez.
+        El contenido no se inicializa.
+        """
+        clave = (nombre, tuple(forma), np.dtype(dtype).str)
+        array = self._arrays.get(clave)
+        if array is None:
+            array = np.empty(forma, dtype=dtype)
+            self._arrays[clave] = array
+            self._pool._registrar_reserva(array.nbytes)
+        else:
+            self._pool._registrar_reutilizacion()
+        anotar_array(nombre, array)
+        return array
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays.values())
+
+class PoolBuffers:
+    """
+    Juegos de buffers libres agrupados por resolución del frame de entrada.
+    Guarda como mucho MAX_JUEGOS_POR_RESOLUCION juegos de MAX_RESOLUCIONES
+    resoluciones; el resto se libera al devolverse.
+    """
+
+    def __init__(self, config):
+        self.max_resoluciones = config['MAX_RESOLUCIONES']
+        self.max_juegos = config['MAX_JUEGOS_POR_RESOLUCION']
+        self.libres = OrderedDict()  # resolucion -> [JuegoBuffers]
+        self.lock = threading.Lock()
+        self.bytes_reservados = 0
+        self.pico_bytes = 0
+        self.reservas = 0
+        self.reutilizaciones = 0
+        self.prestados = 0
+
+    def _registrar_reserva(self, nbytes):
+        with self.lock:
+            self.reservas += 1
+            self.bytes_reservados += nbytes
+            self.pico_bytes = max(self.pico_bytes, self.bytes_reservados)
+
+    def _registrar_reutilizacion(self):
+        with self.lock:
+            self.reutilizaciones += 1
+
+    def tomar(self, resolucion):
+        with self.lock:
+            self.prestados += 1
+            juegos = self.libres.get(resolucion)
+            if juegos:
+                self.libres.move_to_end(resolucion)
+                return juegos.pop()
+        return JuegoBuffers(self)
+
+    def devolver(self, resolucion, juego):
+        descartados = []
+        with self.lock:
+            self.prestados -= 1
+            juegos = self.libres.setdefault(resolucion, [])
+            self.libres.move_to_end(resolucion)
+            if len(juegos) < self.max_juegos:
+                juegos.append(juego)
+            else:
+                descartados.append(juego)
+            # Olvidar las resoluciones usadas hace más tiempo
+            while len(self.libres) > self.max_resoluciones:
+                _, antiguos = self.libres.popitem(last=False)
+                descartados.extend(antiguos)
+            self.bytes_reservados -= sum(j.nbytes for j in descartados)
+
+    def estado(self):
+        with self.lock:
+            bytes_libres = sum(j.nbytes for juegos in self.libres.values() for j in juegos)
+            return {
+                "resoluciones": [f"{ancho}x{alto}" for alto, ancho in self.libres],
+                "juegos_libres": sum(len(juegos) for juegos in self.libres.values()),
+                "juegos_prestados": self.prestados,
+                "mb_reservados": round(self.bytes_reservados / 1e6, 2),
+                "mb_libres": round(bytes_libres / 1e6, 2),
+                "mb_pico": round(self.pico_bytes / 1e6, 2),
+                "reservas": self.reservas,
+                "reutilizaciones": self.reutilizaciones,
+            }
+
+_pool = PoolBuffers(CONFIG_BUFFERS)
+
+@contextmanager
+def prestar_buffers(forma):
+    """
+    Presta un juego de buffers para procesar un frame de la forma dada.
+    Con el pool desactivado se entrega un juego nuevo en cada llamada.
+
+    Args:
+        forma: Forma del frame de entrada (alto, ancho[, canales])
+
+    Yields:
+        JuegoBuffers: Ningún array del juego debe conservarse tras el bloque `with`
+    """
+    if not CONFIG_BUFFERS['HABILITADO']:
+        yield JuegoBuffers(PoolBuffers(CONFIG_BUFFERS))
+        return
+
+    resolucion = tuple(forma[:2])
+    juego = _pool.tomar(resolucion)
+    try:
+        yield juego
+    finally:
+        _pool.devolver(resolucion, juego)
+
+def _rss_actual_mb():
+    """
+    Memoria residente actual del proceso (solo Linux), o None.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            paginas = int(f.read().split()[1])
+        return round(paginas * resource.getpagesize() / 1e6, 1)
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+def estado_buffers():
+    """
+    Estado del pool de buffers y memoria del proceso: reservas frente a
+    reutilizaciones, memoria estable (mb_reservados) y pico (mb_pico, rss_pico_mb).
+    """
+    estado = _pool.estado()
+    estado["habilitado"] = CONFIG_BUFFERS['HABILITADO']
+    estado["rss_actual_mb"] = _rss_actual_mb()
+    # ru_maxrss está en KB en Linux
+    estado["rss_pico_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3, 1) if resource else None
+    return estado
@@ -1,13 +1,15 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.path import Path
+import hashlib
 import os
 
-def calcular_y_generar_imagen(distancia):
-    # Parámetros
-    LUXES = 500
-    LUMEN = 1600
-    FM = 0.8
+# Parámetros
+LUXES = 500
+LUMEN = 1600
+FM = 0.8
 
+def calcular_y_generar_imagen(distancia):
     # Para un espacio cuadrado, base = altura = distancia
     base = distancia
     altura = distancia
@@ -41,8 +43,8 @@ def calcular_y_generar_imagen(distancia):
     if not os.path.exists("static"):
         os.makedirs("static")
     filename = f"static/luminarias_{int(distancia*100)}cm.png"
-    plt.savefig(filename)
-    plt.close()
+    fig.savefig(filename)  # Sobre la figura propia: varias peticiones pueden dibujar a la vez
+    plt.close(fig)
 
     return {
     "area": round(float(area), 2),
@@ -53,3 +55,67 @@ def calcular_y_generar_imagen(distancia):
     "image_path": filename
     }
 
+
+def calcular_luminarias_poligono(vertices):
+    """
+    Distribuye luminarias en una sala de planta poligonal (rectangular, en L...).
+    La rejilla se calcula sobre el rectángulo que envuelve la sala y se conservan
+    los puntos interiores, densificándola hasta cubrir las luminarias necesarias.
+
+    Args:
+        vertices: Array (N x 2) con los vértices de la sala en metros, en orden
+
+    Returns:
+        dict: Igual que calcular_y_generar_imagen, más los vértices dibujados
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    vertices = vertices - vertices.min(axis=0)
+    base, altura = vertices.max(axis=0)
+    x_v, y_v = vertices[:, 0], vertices[:, 1]
+    area = 0.5 * abs(np.dot(x_v, np.roll(y_v, -1)) - np.dot(y_v, np.roll(x_v, -1)))
+    nl = (LUXES * area) / (LUMEN * FM)
+
+    sala = Path(vertices)
+    necesarias = max(1, int(np.ceil(nl)))
+    nl_caja = nl * (base * altura) / area
+    for _ in range(20):
+        y = max(1, int(np.round(np.sqrt((altura * nl_caja) / base))))
+        x = max(1, int(np.round((base * y) / altura)))
+        x_coords = np.linspace(base/(2*x), base - base/(2*x), x)
+        y_coords = np.linspace(altura/(2*y), altura - altura/(2*y), y)
+        X, Y = np.meshgrid(x_coords, y_coords)
+        puntos = np.column_stack([X.ravel(), Y.ravel()])
+        interiores = puntos[sala.contains_points(puntos)]
+        if len(interiores) >= necesarias:
+            break
+        nl_caja *= 1.15
+
+    # Crear imagen
+    fig, ax = plt.subplots()
+    ax.set_aspect('equal')
+    ax.set_xlim(0, base)
+    ax.set_ylim(0, altura)
+    ax.add_patch(plt.Polygon(vertices, closed=True, fill=False, linewidth=2))
+    ax.plot(interiores[:, 0], interiores[:, 1], 'ro')
+    ax.set_title("Distribución de luminarias en el área")
+    ax.set_xlabel("Distancia (m)")
+    ax.set_ylabel("Distancia (m)")
+    ax.grid(True)
+
+    # Guardar imagen (el nombre depende de la forma de la sala)
+    if not os.path.exists("static"):
+        os.makedirs("static")
+    huella = hashlib.sha1(np.round(vertices, 2).tobytes()).hexdigest()[:10]
+    filename = f"static/luminarias_sala_{huella}.png"
+    fig.savefig(filename)  # Sobre la figura propia: varias peticiones pueden dibujar a la vez
+    plt.close(fig)
+
+    return {
+    "area": round(float(area), 2),
+    "nl": round(float(nl), 2),
+    "x": int(x),
+    "y": int(y),
+    "total": int(len(interiores)),
+    "vertices": np.round(vertices, 3).tolist(),
+    "image_path": filename
+    }
@@ -0,0 +1,336 @@
+# --- Calibración de cámara por modelo de dispositivo ---
+import os
+import re
+import json
+import threading
+import cv2
+import numpy as np
+
+# Directorio donde se guardan las calibraciones (un JSON por modelo)
+DIRECTORIO_CALIBRACIONES = os.environ.get('DIRECTORIO_CALIBRACIONES', 'calibraciones')
+
+# Diferencia relativa de proporción (ancho/alto) que se atribuye al redondeo del
+# redimensionado. Por encima, el frame es un recorte (p. ej. video 16:9 de un
+# sensor 4:3) cuyo desplazamiento no se conoce, y los intrínsecos no son válidos.
+TOLERANCIA_PROPORCION = 0.01
+
+# Caché en memoria: modelo -> calibración cargada y datos precalculados por resolución.
+# Cada entrada guarda la firma (mtime, tamaño) del archivo para recargarla cuando
+# otro worker guarda una calibración nueva.
+_cache_calibraciones = {}
+_cache_lock = threading.Lock()
+
+def normalizar_modelo(modelo):
+    """
+    Convierte el nombre del modelo en un identificador seguro para usar como archivo.
+
+    Args:
+        modelo: Nombre del modelo de dispositivo (ej: 'Pixel 7', 'SM-G991B')
+
+    Returns:
+        str: Identificador normalizado
+    """
+    modelo = (modelo or '').strip().lower()
+    modelo = re.sub(r'[^a-z0-9._-]+', '_', modelo).strip('_')
+    if not modelo:
+        raise ValueError("El modelo de dispositivo no es válido")
+    return modelo
+
+def detectar_tablero(imagen, columnas, filas):
+    """
+    Detecta las esquinas internas de un tablero de ajedrez con precisión subpíxel.
+
+    Args:
+        imagen: Imagen BGR o en escala de grises
+        columnas: Número de esquinas internas por fila
+        filas: Número de esquinas internas por columna
+
+    Returns:
+        esquinas: Esquinas detectadas (N x 1 x 2) o None si no se encontró el tablero
+    """
+    if len(imagen.shape) == 3:
+        gray = cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = imagen
+
+    encontrado, esquinas = cv2.findChessboardCorners(
+        gray, (columnas, filas),
+        cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
+    )
+    if not encontrado:
+        return None
+
+    return cv2.cornerSubPix(
+        gray, esquinas, (11, 11), (-1, -1),
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    )
+
+def calibrar_camara(imagenes, columnas=9, filas=6, tamano_cuadro=0.025):
+    """
+    Estima los parámetros intrínsecos de la cámara a partir de fotos de un tablero.
+
+    Args:
+        imagenes: Lista de imágenes (todas con la misma resolución)
+        columnas: Número de esquinas internas por fila del tablero
+        filas: Número de esquinas internas por columna del tablero
+        tamano_cuadro: Lado real de cada cuadro del tablero en metros
+
+    Returns:
+        dict: Matriz de cámara, coeficientes de distorsión, resolución y error RMS
+    """
+    # Coordenadas 3D del tablero en su propio plano (Z = 0)
+    puntos_tablero = np.zeros((columnas * filas, 3), np.float32)
+    puntos_tablero[:, :2] = np.mgrid[0:columnas, 0:filas].T.reshape(-1, 2) * tamano_cuadro
+
+    puntos_objeto = []
+    puntos_imagen = []
+    tamano_imagen = None
+
+    for imagen in imagenes:
+        alto, ancho = imagen.shape[:2]
+        if tamano_imagen is None:
+            tamano_imagen = (ancho, alto)
+        elif tamano_imagen != (ancho, alto):
+            raise ValueError("Todas las imágenes de calibración deben tener la misma resolución")
+
+        esquinas = detectar_tablero(imagen, columnas, filas)
+        if esquinas is not None:
+            puntos_objeto.append(puntos_tablero)
+            puntos_imagen.append(esquinas)
+
+    if len(puntos_imagen) < 3:
+        raise ValueError(f"Se necesitan al menos 3 imágenes con el tablero visible (válidas: {len(puntos_imagen)})")
+
+    error_rms, matriz_camara, coeficientes, _, _ = cv2.calibrateCamera(
+        puntos_objeto, puntos_imagen, tamano_imagen, None, None
+    )
+
+    return {
+        'matriz_camara': matriz_camara.tolist(),
+        'coeficientes_distorsion': coeficientes.ravel().tolist(),
+        'tamano_imagen': list(tamano_imagen),
+        'error_reproyeccion': float(error_rms),
+        'num_imagenes_validas': len(puntos_imagen),
+    }
+
+def _ruta_calibracion(modelo):
+    return os.path.join(DIRECTORIO_CALIBRACIONES, f"{normalizar_modelo(modelo)}.json")
+
+def guardar_calibracion(modelo, calibracion):
+    """
+    Guarda la calibración de un modelo en disco e invalida su caché.
+
+    Args:
+        modelo: Nombre del modelo de dispositivo
+        calibracion: Diccionario devuelto por calibrar_camara
+    """
+    if not os.path.exists(DIRECTORIO_CALIBRACIONES):
+        os.makedirs(DIRECTORIO_CALIBRACIONES)
+
+    # Escritura atómica: los demás workers nunca leen un archivo a medio escribir
+    ruta = _ruta_calibracion(modelo)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(dict(calibracion, modelo=modelo), f, indent=2)
+    os.replace(temporal, ruta)
+
+    with _cache_lock:
+        _cache_calibraciones.pop(normalizar_modelo(modelo), None)
+
+def cargar_calibracion(modelo):
+    """
+    Carga la calibración de un modelo (desde caché o disco). La caché se descarta
+    si el archivo cambió desde que se leyó, aunque lo guardara otro proceso.
+
+    Args:
+        modelo: Nombre del modelo de dispositivo
+
+    Returns:
+        dict: Calibración con matrices numpy, o None si el modelo no está calibrado
+    """
+    try:
+        clave = normalizar_modelo(modelo)
+    except ValueError:
+        return None
+
+    ruta = _ruta_calibracion(modelo)
+    try:
+        estado_archivo = os.stat(ruta)
+    except FileNotFoundError:
+        with _cache_lock:
+            _cache_calibraciones.pop(clave, None)
+        return None
+    firma = (estado_archivo.st_mtime_ns, estado_archivo.st_size)
+
+    with _cache_lock:
+        calibracion = _cache_calibraciones.get(clave)
+        if calibracion is not None and calibracion['firma'] == firma:
+            return calibracion
+
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+
+    calibracion = {
+        'matriz_camara': np.array(datos['matriz_camara'], dtype=np.float64),
+        'coeficientes_distorsion': np.array(datos['coeficientes_distorsion'], dtype=np.float64),
+        'tamano_imagen': tuple(datos['tamano_imagen']),
+        'error_reproyeccion': datos.get('error_reproyeccion'),
+        'firma': firma,
+        'por_resolucion': {},  # (ancho, alto) -> (matriz, coeficientes) o None si no es compatible
+    }
+
+    with _cache_lock:
+        _cache_calibraciones[clave] = calibracion
+    return calibracion
+
+def _girar_intrinsecos(matriz, coeficientes, tamano, horario):
+    """
+    Adapta los intrínsecos a la imagen girada 90°: se intercambian las focales,
+    el punto principal se mueve con la imagen y los coeficientes tangenciales
+    cambian de eje.
+
+    Args:
+        matriz: Matriz de cámara de la calibración
+        coeficientes: Coeficientes de distorsión de la calibración
+        tamano: (ancho, alto) de la calibración
+        horario: True si la imagen se giró en sentido horario
+
+    Returns:
+        (matriz, coeficientes, tamano) girados, o None si el modelo de distorsión
+        tiene términos (prisma fino, sensor inclinado) que no se pueden girar así
+    """
+    if len(coeficientes) > 8 and np.any(coeficientes[8:]):
+        return None
+
+    ancho, alto = tamano
+    fx, fy = matriz[0, 0], matriz[1, 1]
+    cx, cy = matriz[0, 2], matriz[1, 2]
+    girada = np.eye(3, dtype=np.float64)
+    girada[0, 0], girada[1, 1] = fy, fx
+    coeficientes = coeficientes.copy()
+    p1, p2 = coeficientes[2:4] if len(coeficientes) >= 4 else (0.0, 0.0)
+    if horario:
+        # (x, y) -> (alto - 1 - y, x)
+        girada[0, 2], girada[1, 2] = alto - 1 - cy, cx
+        tangenciales = (p2, -p1)
+    else:
+        # (x, y) -> (y, ancho - 1 - x)
+        girada[0, 2], girada[1, 2] = cy, ancho - 1 - cx
+        tangenciales = (-p2, p1)
+    if len(coeficientes) >= 4:
+        coeficientes[2:4] = tangenciales
+    return girada, coeficientes, (alto, ancho)
+
+def _intrinsecos_para(calibracion, tamano_imagen):
+    """
+    Calcula los intrínsecos de la calibración para una resolución de frame.
+
+    Un frame con la orientación contraria a la calibración se trata como la
+    misma imagen girada 90°. Se supone el giro de la cámara trasera al poner el
+    móvil en vertical: horario de apaisada a vertical, antihorario al revés.
+    Después se escala cada eje por separado, que es exactamente lo que hace el
+    redimensionado. Si las proporciones no coinciden, el frame es un recorte
+    desconocido y no se devuelven intrínsecos.
+
+    Returns:
+        (matriz_camara, coeficientes_distorsion) o None si la resolución no es compatible
+    """
+    matriz = calibracion['matriz_camara']
+    coeficientes = calibracion['coeficientes_distorsion']
+    tamano_cal = calibracion['tamano_imagen']
+
+    vertical_cal = tamano_cal[1] > tamano_cal[0]
+    vertical_frame = tamano_imagen[1] > tamano_imagen[0]
+    if tamano_cal[0] != tamano_cal[1] and tamano_imagen[0] != tamano_imagen[1] and vertical_cal != vertical_frame:
+        girados = _girar_intrinsecos(matriz, coeficientes, tamano_cal, horario=not vertical_cal)
+        if girados is None:
+            return None
+        matriz, coeficientes, tamano_cal = girados
+
+    proporcion_cal = tamano_cal[0] / tamano_cal[1]
+    proporcion_frame = tamano_imagen[0] / tamano_imagen[1]
+    if abs(proporcion_frame - proporcion_cal) > TOLERANCIA_PROPORCION * proporcion_cal:
+        return None
+
+    matriz = matriz.copy()
+    matriz[0, :] *= tamano_imagen[0] / tamano_cal[0]
+    matriz[1, :] *= tamano_imagen[1] / tamano_cal[1]
+    return matriz, coeficientes
+
+def obtener_intrinsecos(modelo, tamano_imagen):
+    """
+    Devuelve la matriz de cámara adaptada a la resolución y orientación del frame
+    y los coeficientes de distorsión. Se calculan una sola vez por modelo y resolución.
+
+    Args:
+        modelo: Nombre del modelo de dispositivo
+        tamano_imagen: (ancho, alto) de la imagen donde se detectaron las esquinas
+
+    Returns:
+        (matriz_camara, coeficientes_distorsion) o (None, None) si no hay calibración
+        o si el frame tiene otra proporción que la calibración (recorte)
+    """
+    calibracion = cargar_calibracion(modelo)
+    if calibracion is None:
+        return None, None
+
+    tamano_imagen = (int(tamano_imagen[0]), int(tamano_imagen[1]))
+    por_resolucion = calibracion['por_resolucion']
+    if tamano_imagen not in por_resolucion:
+        por_resolucion[tamano_imagen] = _intrinsecos_para(calibracion, tamano_imagen)
+        if por_resolucion[tamano_imagen] is None:
+            ancho_cal, alto_cal = calibracion['tamano_imagen']
+            print(f"⚠️ La calibración de {modelo} ({ancho_cal}x{alto_cal}) no es válida para frames de "
+                  f"{tamano_imagen[0]}x{tamano_imagen[1]} (otra proporción); se estima la focal")
+
+    intrinsecos = por_resolucion[tamano_imagen]
+    if intrinsecos is None:
+        return None, None
+    return intrinsecos
+
+def corregir_esquinas(lista_corners, matriz_camara, coeficientes):
+    """
+    Elimina la distorsión de las esquinas de todos los marcadores en una sola llamada.
+
+    Args:
+        lista_corners: Lista de arrays (4 x 2) con las esquinas de cada marcador
+        matriz_camara: Matriz de cámara para la resolución del frame
+        coeficientes: Coeficientes de distorsión
+
+    Returns:
+        list: Esquinas sin distorsión, en píxeles, con la misma forma que la entrada
+    """
+    puntos = np.concatenate([np.asarray(c, dtype=np.float64).reshape(-1, 1, 2) for c in lista_corners])
+    corregidos = cv2.undistortPoints(puntos, matriz_camara, coeficientes, P=matriz_camara).reshape(-1, 4, 2)
+    return [esquinas for esquinas in corregidos]
+
+def estimar_esquinas_3d(corners, tamano_lado, matriz_camara):
+    """
+    Estima la pose de un marcador con solvePnP y devuelve sus esquinas en 3D.
+
+    Args:
+        corners: Esquinas del marcador (4 x 2), ya sin distorsión
+        tamano_lado: Tamaño real del lado en metros
+        matriz_camara: Matriz de cámara para la resolución del frame
+
+    Returns:
+        esquinas_3d: Esquinas (4 x 3) en metros en el sistema de la cámara, o None
+    """
+    mitad = tamano_lado / 2.0
+    # Orden de esquinas de ArUco: sup-izq, sup-der, inf-der, inf-izq
+    puntos_marcador = np.array([
+        [-mitad, mitad, 0],
+        [mitad, mitad, 0],
+        [mitad, -mitad, 0],
+        [-mitad, -mitad, 0],
+    ], dtype=np.float64)
+
+    ok, rvec, tvec = cv2.solvePnP(
+        puntos_marcador, np.asarray(corners, dtype=np.float64), matriz_camara, None,
+        flags=cv2.SOLVEPNP_IPPE_SQUARE
+    )
+    if not ok:
+        return None
+
+    rotacion, _ = cv2.Rodrigues(rvec)
+    return puntos_marcador @ rotacion.T + tvec.reshape(1, 3)
@@ -0,0 +1,121 @@
+# --- Filtro de calidad del frame antes de la detección (nitidez, exposición y contraste) ---
+import time
+import threading
+import cv2
+import numpy as np
+from config_optimizacion import obtener_configuracion
+
+LADO_EVALUACION = 320      # Lado mayor de la copia reducida en la que se mide (los umbrales dependen de él)
+PERCENTIL_EXTREMO = 0.02   # % de píxeles ignorados en cada extremo del histograma (ruido, píxeles calientes)
+PIXELES_BORDE = 20         # Píxeles de borde que tiene en la copia reducida el marcador más pequeño detectable
+
+# Motivos de rechazo y el mensaje para el usuario
+MENSAJES_RECHAZO = {
+    'desenfocado': "Imagen movida o desenfocada: sujeta el teléfono quieto un momento y enfoca los marcadores.",
+    'oscuro': "Imagen demasiado oscura: enciende la luz o acércate a una zona iluminada.",
+    'sobreexpuesto': "Imagen sobreexpuesta: evita apuntar a una luz o a una ventana.",
+    'sin_contraste': "Imagen sin contraste: los marcadores no se distinguen del fondo.",
+}
+
+_estadisticas = {'evaluados': 0, 'suma_ms': 0.0, 'rechazados': {motivo: 0 for motivo in MENSAJES_RECHAZO}}
+_lock = threading.Lock()
+
+def _copia_reducida(img):
+    """
+    Copia en gris con lado mayor LADO_EVALUACION. Se reduce antes de convertir a
+    gris y con interpolación bilineal: INTER_AREA costaría más que la propia medida.
+    """
+    alto, ancho = img.shape[:2]
+    escala = LADO_EVALUACION / max(alto, ancho)
+    if escala < 1:
+        img = cv2.resize(img, (max(1, round(ancho * escala)), max(1, round(alto * escala))))
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+def _percentil_histograma(valores, fraccion):
+    """
+    Percentil de un array uint8 a partir de su histograma (más rápido que np.percentile).
+    """
+    acumulado = cv2.calcHist([valores], [0], None, [256], [0, 256]).ravel().cumsum()
+    return int(np.searchsorted(acumulado, acumulado[-1] * fraccion))
+
+def _nitidez(gris, contraste):
+    """
+    Pendiente de los bordes más marcados del frame respecto a su contraste: el
+    PIXELES_BORDE-ésimo mayor salto entre píxeles vecinos, dividido por la
+    diferencia entre lo más claro y lo más oscuro. Se cuenta un número fijo de
+    píxeles y no un porcentaje para no penalizar un marcador pequeño en una
+    pared lisa. Un borde nítido pasa de
+    negro a blanco en un píxel (1.0); uno desenfocado reparte el salto en varios
+    (~1/ancho del borde). No depende del brillo, apenas del ruido, y al medir
+    cada eje por separado detecta también la trepidación en una sola dirección.
+
+    Returns:
+        float: Nitidez del peor de los dos ejes (0-1)
+    """
+    original = gris.astype(np.int16)
+    peor = 1.0
+    for eje in (0, 1):
+        saltos = np.abs(np.diff(original, axis=eje)).astype(np.uint8)
+        fraccion = max(0.0, 1 - PIXELES_BORDE / saltos.size)
+        peor = min(peor, _percentil_histograma(saltos, fraccion) / max(contraste, 1))
+    return peor
+
+def evaluar_calidad(img):
+    """
+    Mide la calidad del frame en una copia reducida y decide si merece la pena
+    detectar en él con los umbrales del perfil activo. La exposición se juzga
+    por los extremos del histograma, no por el brillo medio: una pared blanca
+    con marcadores pequeños es un frame válido aunque casi todo sea blanco.
+
+    Args:
+        img: Imagen decodificada (BGR o escala de grises)
+
+    Returns:
+        dict: 'motivo' (None si el frame es válido o una clave de MENSAJES_RECHAZO),
+            'nitidez', 'negro', 'blanco', 'contraste' y 'brillo_medio'
+    """
+    inicio = time.perf_counter()
+    config = obtener_configuracion()
+    gris = _copia_reducida(img)
+
+    negro = _percentil_histograma(gris, PERCENTIL_EXTREMO / 100)
+    blanco = _percentil_histograma(gris, 1 - PERCENTIL_EXTREMO / 100)
+    nitidez = _nitidez(gris, blanco - negro)
+
+    motivo = None
+    if blanco < config['CALIDAD_BLANCO_MIN']:
+        motivo = 'oscuro'
+    elif negro > config['CALIDAD_NEGRO_MAX']:
+        motivo = 'sobreexpuesto'
+    elif blanco - negro < config['CALIDAD_CONTRASTE_MIN']:
+        motivo = 'sin_contraste'
+    elif nitidez < config['CALIDAD_NITIDEZ_MIN']:
+        motivo = 'desenfocado'
+
+    with _lock:
+        _estadisticas['evaluados'] += 1
+        _estadisticas['suma_ms'] += (time.perf_counter() - inicio) * 1000
+        if motivo is not None:
+            _estadisticas['rechazados'][motivo] += 1
+    return {
+        "motivo": motivo,
+        "nitidez": round(nitidez, 3),
+        "negro": negro,
+        "blanco": blanco,
+        "contraste": blanco - negro,
+        "brillo_medio": round(float(gris.mean()), 1),
+    }
+
+def estado_calidad():
+    """
+    Frames evaluados en este proceso, rechazados por cada motivo y coste medio del filtro.
+    """
+    config = obtener_configuracion()
+    with _lock:
+        evaluados = _estadisticas['evaluados']
+        return {
+            "habilitado": config['FILTRO_CALIDAD'],
+            "evaluados": evaluados,
+            "rechazados": dict(_estadisticas['rechazados']),
+            "media_ms": round(_estadisticas['suma_ms'] / evaluados, 3) if evaluados else None,
+        }
@@ -0,0 +1,208 @@
+# --- Cascada configurable de estrategias de detección ArUco ---
+import time
+import threading
+import cv2
+from config_optimizacion import obtener_configuracion, obtener_perfil
+from registro_marcadores import crear_detectores, detectar_marcadores
+
+# Estrategias disponibles: preproceso de la imagen gris, parámetros del detector que
+# cambian respecto a la base y coste relativo estimado (1.0 = una detección normal)
+ESTRATEGIAS_DETECCION = {
+    'suavizada': {'preproceso': 'suavizado', 'parametros': {}, 'coste': 1.0},
+    'original': {'preproceso': None, 'parametros': {}, 'coste': 0.9},
+    'clahe': {'preproceso': 'clahe', 'parametros': {}, 'coste': 1.3},  # Contraluz y sombras duras
+    'invertida': {'preproceso': 'invertir', 'parametros': {}, 'coste': 1.0},  # Marcadores blancos sobre negro
+    'ventana_amplia': {
+        'preproceso': 'suavizado',
+        'parametros': {'adaptiveThreshWinSizeMin': 23, 'adaptiveThreshWinSizeMax': 63, 'adaptiveThreshWinSizeStep': 20},
+        'coste': 1.2,  # Marcadores grandes o desenfocados
+    },
+}
+
+MIN_INTENTOS_REORDEN = 20  # Detecciones antes de empezar a reordenar la cascada
+
+_clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+PREPROCESOS = {
+    'suavizado': lambda gray, destino: cv2.GaussianBlur(gray, (3, 3), 0, dst=destino),
+    'clahe': lambda gray, destino: _clahe.apply(gray, dst=destino),
+    'invertir': lambda gray, destino: cv2.bitwise_not(gray, dst=destino),
+}
+
+# Estadísticas por proceso: nombre -> intentos, éxitos y tiempo acumulado
+_estadisticas = {nombre: {'intentos': 0, 'exitos': 0, 'suma_ms': 0.0} for nombre in ESTRATEGIAS_DETECCION}
+_detecciones = 0
+_pasadas = 0
+_lock = threading.Lock()
+_cache_detectores = {}
+
+def crear_parametros_detector(config, cambios=None):
+    """
+    Parámetros base del detector ArUco para un perfil, con cambios opcionales.
+
+    Args:
+        config: Configuración del perfil activo
+        cambios: Diccionario atributo -> valor que sobrescribe la base
+
+    Returns:
+        cv2.aruco.DetectorParameters
+    """
+    aruco_params = cv2.aruco.DetectorParameters()
+
+    # Parámetros optimizados para velocidad y precisión balanceada
+    aruco_params.adaptiveThreshWinSizeMin = 3
+    aruco_params.adaptiveThreshWinSizeMax = 23
+    aruco_params.adaptiveThreshWinSizeStep = 10
+    aruco_params.adaptiveThreshConstant = 7
+    aruco_params.minMarkerPerimeterRate = 0.03
+    aruco_params.maxMarkerPerimeterRate = 4.0
+    aruco_params.polygonalApproxAccuracyRate = config['POLYGONAL_ACCURACY']
+    aruco_params.minCornerDistanceRate = 0.05
+    aruco_params.minDistanceToBorder = 3
+    aruco_params.minOtsuStdDev = 5.0
+    aruco_params.perspectiveRemovePixelPerCell = 4
+    aruco_params.perspectiveRemoveIgnoredMarginPerCell = 0.13
+    aruco_params.maxErroneousBitsInBorderRate = 0.35
+
+    # Configurar refinamiento de esquinas: solo el modo 'detector' refina dentro del
+    # detector; los demás modos refinan después (refinamiento_esquinas.py)
+    if hasattr(aruco_params, 'cornerRefinementMethod'):
+        if config['REFINAMIENTO_ESQUINAS'] == 'detector':
+            aruco_params.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
+        else:
+            aruco_params.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_NONE
+    if hasattr(aruco_params, 'cornerRefinementWinSize'):
+        aruco_params.cornerRefinementWinSize = config['CORNER_REFINEMENT_WIN_SIZE']
+    if hasattr(aruco_params, 'cornerRefinementMaxIterations'):
+        aruco_params.cornerRefinementMaxIterations = config['CORNER_REFINEMENT_MAX_ITER']
+    if hasattr(aruco_params, 'cornerRefinementMinAccuracy'):
+        aruco_params.cornerRefinementMinAccuracy = config['CORNER_REFINEMENT_MIN_ACCURACY']
+
+    for atributo, valor in (cambios or {}).items():
+        setattr(aruco_params, atributo, valor)
+    return aruco_params
+
+def obtener_detector(nombre):
+    """
+    Detectores de una estrategia para el perfil activo, uno por diccionario del
+    despliegue (se crean una vez por proceso).
+    """
+    clave = (nombre, obtener_perfil())
+    detectores = _cache_detectores.get(clave)
+    if detectores is None:
+        parametros = crear_parametros_detector(obtener_configuracion(), ESTRATEGIAS_DETECCION[nombre]['parametros'])
+        detectores = crear_detectores(parametros)
+        _cache_detectores[clave] = detectores
+    return detectores
+
+def _coste_ms(nombre, estadisticas):
+    """
+    Coste esperado en ms: el medido si la estrategia ya se usó, o el estimado
+    escalado con el tiempo por unidad de coste de las estrategias medidas.
+    """
+    propia = estadisticas[nombre]
+    if propia['intentos']:
+        return propia['suma_ms'] / propia['intentos']
+    medidas = [
+        e['suma_ms'] / e['intentos'] / ESTRATEGIAS_DETECCION[n]['coste']
+        for n, e in estadisticas.items() if e['intentos']
+    ]
+    ms_por_unidad = sum(medidas) / len(medidas) if medidas else 1.0
+    return ESTRATEGIAS_DETECCION[nombre]['coste'] * ms_por_unidad
+
+def ordenar_estrategias(nombres):
+    """
+    Ordena las estrategias por probabilidad de éxito por unidad de coste, que
+    minimiza el coste esperado de una búsqueda secuencial. Hasta reunir
+    MIN_INTENTOS_REORDEN detecciones se respeta el orden configurado.
+    """
+    with _lock:
+        if _detecciones < MIN_INTENTOS_REORDEN:
+            return list(nombres)
+        estadisticas = {n: dict(e) for n, e in _estadisticas.items()}
+
+    def prioridad(nombre):
+        e = estadisticas[nombre]
+        tasa_exito = (e['exitos'] + 1) / (e['intentos'] + 2)  # Suavizado de Laplace
+        return tasa_exito / max(_coste_ms(nombre, estadisticas), 1e-3)
+
+    return sorted(nombres, key=prioridad, reverse=True)
+
+def preprocesar(nombre, gray, buffers):
+    """
+    Aplica el preproceso de una estrategia sobre un buffer del juego (o devuelve
+    la misma imagen si la estrategia no preprocesa).
+    """
+    preproceso = ESTRATEGIAS_DETECCION[nombre]['preproceso']
+    if preproceso is None:
+        return gray
+    return PREPROCESOS[preproceso](gray, buffers.obtener(f'cascada_{preproceso}', gray.shape))
+
+def estrategia_principal():
+    """
+    Estrategia que la cascada del perfil activo probaría primero.
+    """
+    return ordenar_estrategias(obtener_configuracion()['CASCADA_DETECCION'])[0]
+
+def ejecutar_cascada(gray, buffers, min_marcadores=2):
+    """
+    Prueba las estrategias de la cascada del perfil activo hasta encontrar
+    suficientes marcadores o agotar el máximo de pasadas.
+
+    Args:
+        gray: Imagen en escala de grises (ya reducida)
+        buffers: JuegoBuffers para las imágenes preprocesadas
+        min_marcadores: Marcadores necesarios para terminar
+
+    Returns:
+        corners: Esquinas detectadas o None
+        ids: IDs detectados o None
+        estrategia: Nombre de la estrategia que tuvo éxito o None
+    """
+    global _detecciones, _pasadas
+    config = obtener_configuracion()
+    orden = ordenar_estrategias(config['CASCADA_DETECCION'])[:config['MAX_PASADAS_DETECCION']]
+
+    resultado = (None, None, None)
+    pasadas = 0
+    for nombre in orden:
+        inicio = time.perf_counter()
+        imagen = preprocesar(nombre, gray, buffers)
+        corners, ids = detectar_marcadores(obtener_detector(nombre), imagen)
+        exito = ids is not None and len(ids) >= min_marcadores
+        pasadas += 1
+
+        with _lock:
+            estadistica = _estadisticas[nombre]
+            estadistica['intentos'] += 1
+            estadistica['exitos'] += int(exito)
+            estadistica['suma_ms'] += (time.perf_counter() - inicio) * 1000
+
+        if exito:
+            resultado = (corners, ids, nombre)
+            break
+
+    with _lock:
+        _detecciones += 1
+        _pasadas += pasadas
+    return resultado
+
+def estado_cascada():
+    """
+    Tasa de éxito y coste medio de cada estrategia, orden actual y pasadas medias por frame.
+    """
+    orden = ordenar_estrategias(obtener_configuracion()['CASCADA_DETECCION'])
+    with _lock:
+        return {
+            "detecciones": _detecciones,
+            "pasadas_medias": round(_pasadas / _detecciones, 2) if _detecciones else 0.0,
+            "orden": orden,
+            "estrategias": {
+                nombre: {
+                    "intentos": e['intentos'],
+                    "tasa_exito": round(e['exitos'] / e['intentos'], 3) if e['intentos'] else None,
+                    "media_ms": round(e['suma_ms'] / e['intentos'], 2) if e['intentos'] else None,
+                }
+                for nombre, e in _estadisticas.items()
+            },
+        }
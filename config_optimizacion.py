@@ -1,4 +1,7 @@
 # --- Configuración de Optimización de Rendimiento ---
+import os
+import threading
+from contextlib import contextmanager
 
 # Configuración para velocidad vs precisión
 CONFIG_VELOCIDAD = {
@@ -14,6 +17,24 @@ CONFIG_VELOCIDAD = {
     'CORNER_REFINEMENT_WIN_SIZE': 3,  # Ventana más pequeña
     'CORNER_REFINEMENT_MAX_ITER': 10,  # Menos iteraciones
     'CORNER_REFINEMENT_MIN_ACCURACY': 0.02,  # Menos precisa
+    'REFINAMIENTO_ESQUINAS': 'lote',  # ninguno, detector, lote o lineas (refinamiento_esquinas.py)
+    'CASCADA_DETECCION': ['suavizada', 'original', 'clahe', 'ventana_amplia'],  # Estrategias (orden inicial)
+    'MAX_PASADAS_DETECCION': 2,  # Estrategias probadas como máximo por frame
+    'MOSAICO_DETECCION': False,  # La imagen ya se reduce, no hace falta mosaico
+    'CONVERGENCIA_TOLERANCIA': 0.01,  # Dispersión relativa máxima de las lecturas estables
+    'CONVERGENCIA_SEGUNDOS': 1.5,  # Tiempo que deben mantenerse estables para dar la medición por buena
+    'CONVERGENCIA_MIN_FRAMES': 3,  # Frames estables mínimos
+    'CAPTURA_LADO_OBJETIVO': 48,  # Lado del marcador (px) que se pide en el siguiente frame
+    'CAPTURA_CALIDAD_MIN': 0.6,  # Calidad JPEG sugerida con confianza máxima
+    'CAPTURA_CALIDAD_MAX': 0.85,  # Calidad JPEG sugerida con confianza mínima
+    'CAPTURA_MARGEN_ROI': 1.5,  # Lados de marcador que se dejan alrededor de la región de interés
+    'SEGUIMIENTO_INTERVALO': 5,  # En sesiones, detección completa cada N frames; entre medias flujo óptico (0 = siempre detectar)
+    'SEGUIMIENTO_ERROR_MAX_PX': 1.0,  # Error ida y vuelta del flujo óptico a partir del cual se vuelve a detectar
+    'FILTRO_CALIDAD': True,  # Rechazar antes de detectar los frames movidos o mal expuestos (calidad_frame.py)
+    'CALIDAD_NITIDEZ_MIN': 0.14,  # Pendiente de los bordes respecto al contraste (~1/ancho del borde en px) mínima
+    'CALIDAD_BLANCO_MIN': 25,  # Nivel de gris de lo más claro del frame por debajo del cual está demasiado oscuro
+    'CALIDAD_NEGRO_MAX': 235,  # Nivel de gris de lo más oscuro del frame por encima del cual está sobreexpuesto
+    'CALIDAD_CONTRASTE_MIN': 12,  # Diferencia mínima entre lo más claro y lo más oscuro
 }
 
 # Configuración para máxima precisión
@@ -30,10 +51,112 @@ CONFIG_PRECISION = {
     'CORNER_REFINEMENT_WIN_SIZE': 5,  # Ventana más grande
     'CORNER_REFINEMENT_MAX_ITER': 30,  # Más iteraciones
     'CORNER_REFINEMENT_MIN_ACCURACY': 0.01,  # Más precisa
+    'REFINAMIENTO_ESQUINAS': 'lineas',  # Ajuste de rectas a los bordes (tolera mejor el desenfoque)
+    'CASCADA_DETECCION': ['suavizada', 'original', 'clahe', 'ventana_amplia', 'invertida'],
+    'MAX_PASADAS_DETECCION': 5,
+    'MOSAICO_DETECCION': True,  # Detectar fotos grandes por mosaicos en paralelo
+    'MOSAICO_MIN_MEGAPIXELES': 6,  # Resolución a partir de la cual se usa el mosaico
+    'MOSAICO_TAMANO': 2048,  # Lado de cada mosaico en píxeles
+    'MOSAICO_LADO_REDUCIDO': 2048,  # Lado mayor de la pasada reducida para marcadores grandes
+    'MOSAICO_FACTOR_SOLAPE': 3,  # Solape = factor x lado mínimo detectable en la pasada reducida
+    'MOSAICO_TRABAJADORES': os.cpu_count() or 1,
+    'CONVERGENCIA_TOLERANCIA': 0.005,
+    'CONVERGENCIA_SEGUNDOS': 2.5,
+    'CONVERGENCIA_MIN_FRAMES': 5,
+    'CAPTURA_LADO_OBJETIVO': 96,
+    'CAPTURA_CALIDAD_MIN': 0.8,
+    'CAPTURA_CALIDAD_MAX': 0.95,
+    'CAPTURA_MARGEN_ROI': 2.0,
+    'SEGUIMIENTO_INTERVALO': 0,  # Cada frame con detección completa
+    'SEGUIMIENTO_ERROR_MAX_PX': 0.5,
+    'FILTRO_CALIDAD': True,
+    'CALIDAD_NITIDEZ_MIN': 0.2,  # Más estricto: el desenfoque desplaza las esquinas aunque se detecten
+    'CALIDAD_BLANCO_MIN': 40,
+    'CALIDAD_NEGRO_MAX': 220,
+    'CALIDAD_CONTRASTE_MIN': 20,
+}
+
+# Pool de procesos para el trabajo de visión (opcional, desactivado por defecto)
+CONFIG_POOL_CV = {
+    'HABILITADO': os.environ.get('POOL_CV', '0') == '1',
+    'TRABAJADORES': int(os.environ.get('POOL_CV_TRABAJADORES', os.cpu_count() or 1)),
+    'PROFUNDIDAD_COLA': int(os.environ.get('POOL_CV_COLA', 8)),  # Ranuras de memoria compartida
+    'TAMANO_RANURA': int(os.environ.get('POOL_CV_RANURA', 1920 * 1080 * 3)),  # Bytes por ranura
+    'TIEMPO_ESPERA': float(os.environ.get('POOL_CV_TIEMPO_ESPERA', 10.0)),  # Segundos
+}
+
+# Pool de buffers de imagen reutilizables (por proceso)
+CONFIG_BUFFERS = {
+    'HABILITADO': os.environ.get('BUFFERS_IMAGEN', '1') == '1',
+    'MAX_RESOLUCIONES': int(os.environ.get('BUFFERS_MAX_RESOLUCIONES', 3)),  # Resoluciones recordadas
+    'MAX_JUEGOS_POR_RESOLUCION': int(os.environ.get('BUFFERS_MAX_JUEGOS', 4)),  # Peticiones simultáneas sin reservar
+}
+
+# Modo de servicio ASGI (servidor_asgi.py): cuerpos leídos sin bloquear y visión en un executor acotado
+CONFIG_ASGI = {
+    'TRABAJADORES_VISION': int(os.environ.get('ASGI_TRABAJADORES_VISION', os.cpu_count() or 1)),
+    'MAX_EN_ESPERA': int(os.environ.get('ASGI_MAX_EN_ESPERA', 16)),  # Frames esperando hilo de visión
+    'TRABAJADORES_GENERAL': int(os.environ.get('ASGI_TRABAJADORES_GENERAL', 4)),  # Resto de rutas
+    'MAX_CUERPO_MB': float(os.environ.get('ASGI_MAX_CUERPO_MB', 64)),  # Tamaño máximo de una petición
+}
+
+# Grabador de frames lentos o fallidos para reproducirlos después (grabador_frames.py)
+CONFIG_GRABADOR = {
+    'HABILITADO': os.environ.get('GRABADOR_FRAMES', '0') == '1',
+    'DIRECTORIO': os.environ.get('GRABADOR_DIRECTORIO', 'grabaciones'),
+    'MAX_GRABACIONES': int(os.environ.get('GRABADOR_MAX', 200)),  # Búfer circular: se borran las más antiguas
+    'UMBRAL_MS': float(os.environ.get('GRABADOR_UMBRAL_MS', 500)),  # Latencia a partir de la cual se graba
+    'GRABAR_FALLOS': os.environ.get('GRABADOR_FALLOS', '1') == '1',  # Grabar también los frames sin medición
+    'TASA_MUESTREO': float(os.environ.get('GRABADOR_TASA', 1.0)),  # Fracción de los frames candidatos que se graba
+}
+
+# Perfilador bajo demanda (perfilador.py): sin token configurado los endpoints están desactivados
+CONFIG_PERFILADOR = {
+    'TOKEN': os.environ.get('PERFILADOR_TOKEN') or None,  # Cabecera X-Token-Admin
+    'MAX_PETICIONES': int(os.environ.get('PERFILADOR_MAX_PETICIONES', 1000)),
+    'MAX_SEGUNDOS': float(os.environ.get('PERFILADOR_MAX_SEGUNDOS', 600)),
+    'INTERVALO_MUESTREO_MS': float(os.environ.get('PERFILADOR_INTERVALO_MS', 5)),  # Modo 'muestreo'
+}
+
+# Memoria por petición (memoria_peticiones.py): tracemalloc encarece las reservas, solo para diagnóstico
+CONFIG_MEMORIA = {
+    'HABILITADO': os.environ.get('MEMORIA_RASTREO', '0') == '1',
+    'MARCOS': int(os.environ.get('MEMORIA_MARCOS', 1)),  # Marcos de pila guardados por reserva
+    'MAX_PETICIONES': int(os.environ.get('MEMORIA_MAX_PETICIONES', 500)),  # Picos guardados para las métricas
+}
+
+# Diccionario de marcadores del despliegue (registro_marcadores.py): familias separadas por ';',
+# cada una 'DICT_...[:ids][@base_id]', p. ej. 'DICT_4X4_50:0-11,20-31' o 'DICT_4X4_50:0-11;DICT_5X5_50:0-3@100'
+CONFIG_DICCIONARIO = {
+    'FAMILIAS': os.environ.get('MARCADORES_DICCIONARIO', 'DICT_4X4_50'),
+}
+
+# Medición progresiva: estimación preliminar inmediata con un perfil rápido y el
+# mismo frame refinado después con el perfil activo (GET /mediciones/<id>)
+CONFIG_PROGRESIVO = {
+    'HABILITADO': os.environ.get('MEDICION_PROGRESIVA', '1') == '1',
+    'PERFIL_PRELIMINAR': os.environ.get('PROGRESIVO_PERFIL_PRELIMINAR', 'velocidad'),
+    'MAX_PENDIENTES': int(os.environ.get('PROGRESIVO_MAX_PENDIENTES', 4)),  # Refinados en cola; se descarta el más antiguo
+    'MAX_GUARDADAS': int(os.environ.get('PROGRESIVO_MAX_GUARDADAS', 64)),  # Resultados refinados esperando a ser recogidos
+    'EXPIRACION': float(os.environ.get('PROGRESIVO_EXPIRACION', 60)),  # Segundos que se guarda un resultado
+    'ESPERA_MAX': float(os.environ.get('PROGRESIVO_ESPERA_MAX', 5)),  # Espera máxima de GET /mediciones/<id>
+}
+
+# Almacén del estado de medición (almacen_estado.py): 'memoria' solo vale con un worker;
+# 'sqlite' (modo WAL) lo comparten todos los workers del host (gunicorn -w N)
+CONFIG_ALMACEN = {
+    'BACKEND': os.environ.get('ALMACEN_ESTADO', 'memoria'),
+    'RUTA': os.environ.get('ALMACEN_RUTA', 'estado_mediciones.db'),
+    'ESPERA_BLOQUEO': float(os.environ.get('ALMACEN_ESPERA_BLOQUEO', 5.0)),  # Segundos esperando a otro worker que escribe
 }
 
 # Configuración actual (por defecto velocidad)
 CONFIG_ACTUAL = CONFIG_VELOCIDAD
+PERFIL_ACTUAL = 'velocidad'
+CONFIGURACIONES = {'velocidad': CONFIG_VELOCIDAD, 'precision': CONFIG_PRECISION}
+
+# Perfil aplicado solo al hilo actual (usar_perfil); si no hay, el global
+_perfil_hilo = threading.local()
 
 def cambiar_configuracion(tipo):
     """
@@ -42,13 +165,30 @@ def cambiar_configuracion(tipo):
     Args:
         tipo: 'velocidad' o 'precision'
     """
-    global CONFIG_ACTUAL
-    if tipo == 'velocidad':
-        CONFIG_ACTUAL = CONFIG_VELOCIDAD
-    elif tipo == 'precision':
-        CONFIG_ACTUAL = CONFIG_PRECISION
-    else:
+    global CONFIG_ACTUAL, PERFIL_ACTUAL
+    if tipo not in CONFIGURACIONES:
         raise ValueError("Tipo debe ser 'velocidad' o 'precision'")
+    CONFIG_ACTUAL = CONFIGURACIONES[tipo]
+    PERFIL_ACTUAL = tipo
+
+@contextmanager
+def usar_perfil(tipo):
+    """
+    Aplica un perfil solo en el hilo actual mientras dura el bloque, sin cambiar
+    el del servidor (fases de la medición progresiva). Los hilos auxiliares que
+    lance el bloque siguen viendo el perfil global.
+    
+    Args:
+        tipo: 'velocidad' o 'precision'
+    """
+    if tipo not in CONFIGURACIONES:
+        raise ValueError("Tipo debe ser 'velocidad' o 'precision'")
+    anterior = getattr(_perfil_hilo, 'perfil', None)
+    _perfil_hilo.perfil = tipo
+    try:
+        yield CONFIGURACIONES[tipo]
+    finally:
+        _perfil_hilo.perfil = anterior
 
 def obtener_configuracion():
     """
@@ -57,4 +197,15 @@ def obtener_configuracion():
     Returns:
         dict: Configuración actual
     """
-    return CONFIG_ACTUAL
+    perfil = getattr(_perfil_hilo, 'perfil', None)
+    return CONFIG_ACTUAL if perfil is None else CONFIGURACIONES[perfil]
+
+def obtener_perfil():
+    """
+    Obtiene el nombre del perfil de configuración actual.
+    
+    Returns:
+        str: 'velocidad' o 'precision'
+    """
+    perfil = getattr(_perfil_hilo, 'perfil', None)
+    return PERFIL_ACTUAL if perfil is None else perfil
@@ -0,0 +1,217 @@
+# --- Contorno de la habitación a partir de marcadores en las esquinas ---
+import cv2
+import numpy as np
+from calibracion_camara import estimar_esquinas_3d
+
+MIN_ESQUINAS = 4
+FOCAL_POR_DEFECTO = 0.8         # Focal (fracción del lado mayor) si no hay calibración ni estimación
+FOCAL_MINIMA, FOCAL_MAXIMA = 0.3, 3.0  # Rango plausible de la focal estimada
+
+def ordenar_vertices(puntos, ids, orden='angular'):
+    """
+    Ordena los vértices del contorno.
+
+    Args:
+        puntos: Array (N x 2) con la posición de cada marcador en el suelo (metros)
+        ids: IDs de los marcadores, en el mismo orden que los puntos
+        orden: 'angular' (alrededor del centroide, vale para salas convexas) o
+            'ids' (marcadores numerados recorriendo el perímetro, necesario en salas en L)
+
+    Returns:
+        indices: Orden de los vértices, siempre en sentido antihorario
+    """
+    if orden == 'ids':
+        indices = np.argsort(ids)
+    elif orden == 'angular':
+        centrados = puntos - puntos.mean(axis=0)
+        indices = np.argsort(np.arctan2(centrados[:, 1], centrados[:, 0]))
+    else:
+        raise ValueError(f"Orden no válido: {orden}. Usa 'angular' o 'ids'")
+
+    if area_con_signo(puntos[indices]) < 0:
+        indices = indices[::-1]
+    return indices
+
+def area_con_signo(vertices):
+    """
+    Área del polígono por la fórmula del lazo (positiva si es antihorario).
+    """
+    x, y = vertices[:, 0], vertices[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def es_poligono_simple(vertices):
+    """
+    Comprueba que ningún par de lados no adyacentes se cruce (todos los pares a la vez).
+    """
+    a = vertices
+    b = np.roll(vertices, -1, axis=0)
+    n = len(vertices)
+
+    def orientacion(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+    # Matrices n x n: lado i contra lado j
+    ai, bi = a[:, None, :], b[:, None, :]
+    aj, bj = a[None, :, :], b[None, :, :]
+    cruzan = (
+        (orientacion(ai, bi, aj) != orientacion(ai, bi, bj)) &
+        (orientacion(aj, bj, ai) != orientacion(aj, bj, bi))
+    )
+    indices = np.arange(n)
+    distancia = np.abs(indices[:, None] - indices[None, :])
+    no_adyacentes = (distancia > 1) & (distancia < n - 1)
+    return not np.any(cruzan & no_adyacentes)
+
+def _homografias_marcadores(esquinas, tamanos, centro_optico):
+    """
+    Homografía cuadrado -> imagen de cada marcador, en píxeles centrados en el centro óptico.
+    """
+    homografias = []
+    for esquinas_marcador, tamano in zip(esquinas, tamanos):
+        cuadrado = np.array([[0, 0], [tamano, 0], [tamano, tamano], [0, tamano]], dtype=np.float32)
+        homografia = cv2.getPerspectiveTransform(cuadrado, (esquinas_marcador - centro_optico).astype(np.float32))
+        homografias.append(homografia / np.linalg.norm(homografia))
+    return np.array(homografias)
+
+def estimar_focal(esquinas, tamanos, tamano_imagen):
+    """
+    Estima la distancia focal (píxeles) sin calibración, suponiendo el centro óptico
+    en el centro de la imagen y píxeles cuadrados. Cada marcador impone que sus dos
+    ejes sean perpendiculares y de igual longitud (como en el método de Zhang con
+    una sola incógnita), y se resuelve por mínimos cuadrados con todos los marcadores.
+
+    Returns:
+        focal: Distancia focal en píxeles, o None si la vista es casi frontal
+            (la focal no es observable) o el resultado no es plausible
+    """
+    ancho, alto = tamano_imagen
+    h = _homografias_marcadores(esquinas, tamanos, np.array([ancho / 2.0, alto / 2.0]))
+    h1, h2 = h[:, :, 0], h[:, :, 1]
+
+    # Ecuaciones lineales en u = 1 / f^2: a * u + b = 0
+    a = np.concatenate([
+        h1[:, 0] * h2[:, 0] + h1[:, 1] * h2[:, 1],
+        h1[:, 0] ** 2 + h1[:, 1] ** 2 - h2[:, 0] ** 2 - h2[:, 1] ** 2,
+    ])
+    b = np.concatenate([
+        h1[:, 2] * h2[:, 2],
+        h1[:, 2] ** 2 - h2[:, 2] ** 2,
+    ])
+    denominador = np.dot(a, a)
+    if denominador < 1e-12:
+        return None
+    u = -np.dot(a, b) / denominador
+    if u <= 0:
+        return None
+    focal = 1.0 / np.sqrt(u)
+    lado_mayor = max(ancho, alto)
+    if not FOCAL_MINIMA * lado_mayor <= focal <= FOCAL_MAXIMA * lado_mayor:
+        return None
+    return float(focal)
+
+def posiciones_en_suelo(esquinas, tamanos, matriz_camara):
+    """
+    Sitúa el centro de cada marcador en el plano del suelo. La pose de cada marcador
+    (solvePnP) da sus esquinas en 3D; con todas ellas se ajusta un único plano y el
+    centro de cada marcador se toma donde su rayo de visión corta ese plano, que es
+    mucho más estable que la profundidad de cada marcador por separado.
+
+    Args:
+        esquinas: Array (N x 4 x 2) de esquinas en píxeles, sin distorsión
+        tamanos: Array (N,) con el lado real de cada marcador en metros
+        matriz_camara: Matriz de cámara para la resolución de las esquinas
+
+    Returns:
+        puntos: Array (N x 2) con la posición de cada centro en el plano (metros), o None
+    """
+    puntos_3d = []
+    for esquinas_marcador, tamano in zip(esquinas, tamanos):
+        esquinas_3d = estimar_esquinas_3d(esquinas_marcador, tamano, matriz_camara)
+        if esquinas_3d is None:
+            return None
+        puntos_3d.append(esquinas_3d)
+    puntos_3d = np.concatenate(puntos_3d)
+
+    # Plano por mínimos cuadrados totales con todas las esquinas
+    centroide = puntos_3d.mean(axis=0)
+    _, _, vt = np.linalg.svd(puntos_3d - centroide)
+    normal = vt[2]
+
+    # Rayos de visión de los centros de los marcadores (N x 3)
+    centros = esquinas.mean(axis=1)
+    rayos = np.hstack([centros, np.ones((len(centros), 1))]) @ np.linalg.inv(matriz_camara).T
+    denominador = rayos @ normal
+    if np.any(np.abs(denominador) < 1e-9):
+        return None
+    centros_3d = rayos * ((centroide @ normal) / denominador)[:, None]
+
+    # Coordenadas 2D dentro del plano
+    eje_u = np.array([1.0, 0.0, 0.0]) - normal[0] * normal
+    eje_u /= np.linalg.norm(eje_u)
+    eje_v = np.cross(normal, eje_u)
+    relativos = centros_3d - centroide
+    return np.column_stack([relativos @ eje_u, relativos @ eje_v])
+
+def calcular_contorno(corners, ids, tamano_lado, obtener_tamano, tamano_imagen,
+                      matriz_camara=None, orden='angular'):
+    """
+    Calcula el contorno de la habitación con un marcador en cada esquina: sitúa el
+    centro de cada marcador en el plano del suelo y mide todos los lados y el área
+    del polígono a la vez.
+
+    Args:
+        corners: Esquinas de los marcadores detectados (ya sin distorsión si hay calibración)
+        ids: IDs de los marcadores detectados
+        tamano_lado: Tamaño en metros de los marcadores sin tamaño registrado
+        obtener_tamano: Función (id, tamano_por_defecto) -> tamaño del marcador en metros
+        tamano_imagen: (ancho, alto) de la imagen donde se detectaron las esquinas
+        matriz_camara: Intrínsecos calibrados; si falta, la focal se estima con los marcadores
+        orden: Criterio para ordenar los vértices ('angular' o 'ids')
+
+    Returns:
+        (contorno, None) o (None, mensaje_error). contorno tiene los vértices en metros,
+        los lados, el perímetro, el área, los IDs en orden de recorrido y la focal usada
+    """
+    ids_planos = np.asarray(ids).flatten()
+    esquinas = np.asarray([np.asarray(c).reshape(4, 2) for c in corners], dtype=np.float64)
+    if len(esquinas) < MIN_ESQUINAS:
+        return None, f"Se necesitan al menos {MIN_ESQUINAS} marcadores (uno en cada esquina); se detectaron {len(esquinas)}."
+    tamanos = np.array([obtener_tamano(marker_id, tamano_lado) for marker_id in ids_planos])
+
+    focal_estimada = matriz_camara is None
+    if focal_estimada:
+        focal = estimar_focal(esquinas, tamanos, tamano_imagen)
+        if focal is None:
+            focal = FOCAL_POR_DEFECTO * max(tamano_imagen)
+        matriz_camara = np.array([
+            [focal, 0, tamano_imagen[0] / 2.0],
+            [0, focal, tamano_imagen[1] / 2.0],
+            [0, 0, 1],
+        ])
+
+    puntos = posiciones_en_suelo(esquinas, tamanos, matriz_camara)
+    if puntos is None:
+        return None, "No se pudo estimar el plano del suelo con los marcadores detectados."
+
+    indices = ordenar_vertices(puntos, ids_planos, orden)
+    vertices = puntos[indices]
+    if not es_poligono_simple(vertices):
+        return None, "Los lados del contorno se cruzan. Numera los marcadores recorriendo el perímetro y usa orden 'ids'."
+
+    # Colocar el primer vértice en el origen con el primer lado sobre el eje X
+    vertices = vertices - vertices[0]
+    primer_lado = vertices[1]
+    angulo = np.arctan2(primer_lado[1], primer_lado[0])
+    rotacion = np.array([[np.cos(angulo), np.sin(angulo)], [-np.sin(angulo), np.cos(angulo)]])
+    vertices = vertices @ rotacion.T
+
+    lados = np.linalg.norm(np.roll(vertices, -1, axis=0) - vertices, axis=1)
+    return {
+        "vertices": vertices,
+        "lados": lados,
+        "perimetro": float(lados.sum()),
+        "area": abs(area_con_signo(vertices)),
+        "ids_orden": ids_planos[indices].tolist(),
+        "focal_px": float(matriz_camara[0, 0]),
+        "focal_estimada": focal_estimada,
+    }, None
@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from registro_marcadores import generar_imagen_marcador
 
 def crear_imagen_prueba():
     """
@@ -9,12 +10,9 @@ def crear_imagen_prueba():
     # Crear imagen de fondo
     img = np.ones((600, 800, 3), dtype=np.uint8) * 255  # Fondo blanco
     
-    # Configurar diccionario ArUco
-    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    
-    # Generar dos códigos ArUco
-    marker1 = cv2.aruco.generateImageMarker(aruco_dict, 0, 100)
-    marker2 = cv2.aruco.generateImageMarker(aruco_dict, 1, 100)
+    # Generar dos códigos ArUco con el diccionario del despliegue
+    marker1 = generar_imagen_marcador(0, 100)
+    marker2 = generar_imagen_marcador(1, 100)
     
     # Agregar bordes blancos
     marker1 = cv2.copyMakeBorder(marker1, 20, 20, 20, 20, cv2.BORDER_CONSTANT, value=(255, 255, 255))
@@ -0,0 +1,157 @@
+# --- Detección por mosaico para fotos de alta resolución (modo precisión) ---
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from config_optimizacion import obtener_configuracion, obtener_perfil
+from registro_marcadores import crear_detectores, detectar_marcadores
+from cascada_deteccion import (ESTRATEGIAS_DETECCION, crear_parametros_detector,
+                               preprocesar, estrategia_principal, ejecutar_cascada)
+
+_executor = None
+_executor_lock = threading.Lock()
+_cache_detectores = {}
+
+def _obtener_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=obtener_configuracion()['MOSAICO_TRABAJADORES'])
+        return _executor
+
+def usar_mosaico(ancho, alto):
+    """
+    Indica si un frame de esta resolución se detecta por mosaico con el perfil activo.
+    Con un solo hilo el mosaico no compensa el trabajo extra de los solapes.
+    """
+    config = obtener_configuracion()
+    return (config['MOSAICO_DETECCION'] and config['MOSAICO_TRABAJADORES'] > 1
+            and ancho * alto >= config['MOSAICO_MIN_MEGAPIXELES'] * 1e6)
+
+def _detector_escalado(nombre, tasa_perimetro):
+    """
+    Detectores de una estrategia con el perímetro mínimo relativo ajustado al
+    tamaño de la imagen sobre la que se ejecutan.
+    """
+    clave = (nombre, obtener_perfil(), round(tasa_perimetro, 5))
+    detectores = _cache_detectores.get(clave)
+    if detectores is None:
+        cambios = dict(ESTRATEGIAS_DETECCION[nombre]['parametros'], minMarkerPerimeterRate=tasa_perimetro)
+        detectores = crear_detectores(crear_parametros_detector(obtener_configuracion(), cambios))
+        _cache_detectores[clave] = detectores
+    return detectores
+
+def _repartir(longitud, tamano_maximo, solape):
+    """
+    Reparte un eje en el menor número de tramos solapados de igual longitud.
+
+    Returns:
+        (origenes, longitud_tramo)
+    """
+    if longitud <= tamano_maximo:
+        return [0], longitud
+    cantidad = int(np.ceil((longitud - solape) / (tamano_maximo - solape)))
+    tramo = int(np.ceil((longitud + (cantidad - 1) * solape) / cantidad))
+    paso = tramo - solape
+    return [min(k * paso, longitud - tramo) for k in range(cantidad)], tramo
+
+def _fusionar(candidatos):
+    """
+    Elimina los marcadores repetidos en las costuras: dos detecciones del mismo ID
+    cuyos centros distan menos de medio lado son el mismo marcador. Se conserva la
+    primera (los mosaicos van antes que la pasada reducida por ser más precisos).
+    """
+    aceptados = []
+    for esquinas, marker_id in candidatos:
+        centro = esquinas.mean(axis=0)
+        lado = np.mean(np.linalg.norm(np.roll(esquinas, -1, axis=0) - esquinas, axis=1))
+        repetido = any(
+            otro_id == marker_id and np.linalg.norm(otras.mean(axis=0) - centro) < lado / 2
+            for otras, otro_id in aceptados
+        )
+        if not repetido:
+            aceptados.append((esquinas, marker_id))
+    return aceptados
+
+def detectar_en_mosaico(gray, buffers, min_marcadores=2):
+    """
+    Detecta marcadores en una imagen grande repartiendo mosaicos solapados entre
+    hilos, más una pasada sobre la imagen reducida para los marcadores grandes.
+
+    Los mosaicos no detectan marcadores más pequeños que la detección sobre la
+    imagen completa: usan su mismo perímetro mínimo en píxeles y solo reparten
+    ese trabajo entre hilos. Lo que la pasada reducida pierde (marcadores por
+    debajo de su lado mínimo) lo recuperan por trabajar a resolución completa.
+    El solape solo garantiza que esos marcadores no queden cortados por una
+    costura: mide varias veces el lado mínimo de la pasada reducida, así que
+    caben enteros en algún mosaico. Los mayores pueden cruzar costuras, pero
+    los encuentra la pasada reducida.
+
+    Args:
+        gray: Imagen en escala de grises a resolución completa
+        buffers: JuegoBuffers para las imágenes intermedias
+        min_marcadores: Marcadores necesarios para considerar la detección válida
+
+    Returns:
+        corners: Esquinas en coordenadas de la imagen completa (mismo formato que detectMarkers) o None
+        ids: IDs de los marcadores (N x 1) o None
+    """
+    config = obtener_configuracion()
+    alto, ancho = gray.shape
+    estrategia = estrategia_principal()
+    imagen = preprocesar(estrategia, gray, buffers)
+    tasa_perimetro = ESTRATEGIAS_DETECCION[estrategia]['parametros'].get('minMarkerPerimeterRate', 0.03)
+
+    # Pasada reducida: marcadores grandes, que pueden cruzar varias costuras
+    escala = config['MOSAICO_LADO_REDUCIDO'] / max(ancho, alto)
+    forma_reducida = (int(alto * escala), int(ancho * escala))
+    reducida = cv2.resize(imagen, forma_reducida[::-1], dst=buffers.obtener('mosaico_reducida', forma_reducida),
+                          interpolation=cv2.INTER_AREA)
+
+    # Lado mínimo detectable en la pasada reducida, llevado a la resolución completa
+    lado_minimo = tasa_perimetro * config['MOSAICO_LADO_REDUCIDO'] / 4 / escala
+    solape = int(np.ceil(config['MOSAICO_FACTOR_SOLAPE'] * lado_minimo))
+    tamano = max(config['MOSAICO_TAMANO'], 2 * solape)  # Lado máximo de cada mosaico
+
+    origenes_x, ancho_mosaico = _repartir(ancho, tamano, solape)
+    origenes_y, alto_mosaico = _repartir(alto, tamano, solape)
+
+    # Mismo perímetro mínimo en píxeles que la imagen completa: el mosaico reparte la
+    # detección a resolución completa, no la hace más sensible a marcadores pequeños
+    detectores_mosaico = _detector_escalado(estrategia, tasa_perimetro * max(ancho, alto) / max(ancho_mosaico, alto_mosaico))
+
+    def detectar_mosaico(origen):
+        x, y = origen
+        corners, ids = detectar_marcadores(detectores_mosaico, imagen[y:y + alto_mosaico, x:x + ancho_mosaico])
+        if ids is None:
+            return []
+        return [(c.reshape(4, 2) + (x, y), int(i)) for c, i in zip(corners, ids.flatten())]
+
+    # Se resuelve aquí y no en el hilo del executor, que no ve el perfil de usar_perfil
+    detectores_reducida = _detector_escalado(estrategia, tasa_perimetro)
+
+    def detectar_reducida():
+        corners, ids = detectar_marcadores(detectores_reducida, reducida)
+        if ids is None:
+            return []
+        return [(c.reshape(4, 2) / escala, int(i)) for c, i in zip(corners, ids.flatten())]
+
+    origenes = [(x, y) for y in origenes_y for x in origenes_x]
+    executor = _obtener_executor()
+    futuro_reducida = executor.submit(detectar_reducida)
+    por_mosaico = list(executor.map(detectar_mosaico, origenes))
+
+    candidatos = [marcador for marcadores in por_mosaico for marcador in marcadores]
+    candidatos.extend(futuro_reducida.result())
+    marcadores = _fusionar(candidatos)
+
+    if len(marcadores) < min_marcadores:
+        # Último recurso: la cascada completa sobre la imagen reducida
+        corners, ids, _ = ejecutar_cascada(reducida, buffers, min_marcadores)
+        if ids is None:
+            return None, None
+        marcadores = [(c.reshape(4, 2) / escala, int(i)) for c, i in zip(corners, ids.flatten())]
+
+    corners = tuple(esquinas.reshape(1, 4, 2).astype(np.float32) for esquinas, _ in marcadores)
+    ids = np.array([[marker_id] for _, marker_id in marcadores], dtype=np.int32)
+    return corners, ids
@@ -0,0 +1,75 @@
+# --- Formatos de respuesta de la medición: ligero o completo, en JSON o MessagePack ---
+import base64
+import numpy as np
+from flask import Response, jsonify
+
+# MessagePack es opcional: solo se anuncia si está instalado
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TIPO_MSGPACK = 'application/msgpack'
+TIPOS_MSGPACK = (TIPO_MSGPACK, 'application/x-msgpack')
+
+# ligero: solo lo que el cliente necesita para mostrar la medición en tiempo real (sin visualización salvo que se pida)
+# completo: además la escala, el debug_info de todos los métodos y la visualización
+FORMATOS_RESPUESTA = ('ligero', 'completo')
+
+def codificaciones_disponibles():
+    """
+    Codificaciones de respuesta que el servidor puede producir.
+    """
+    return ['json', 'msgpack'] if msgpack is not None else ['json']
+
+def formato_pedido(data):
+    """
+    Formato de respuesta pedido en las opciones de la petición ('completo' por
+    defecto, para los clientes que no lo negocian).
+
+    Raises:
+        ValueError: Si el formato no existe
+    """
+    formato = (data or {}).get('formato_respuesta', 'completo')
+    if formato not in FORMATOS_RESPUESTA:
+        raise ValueError(f"formato_respuesta no válido: {formato}. Usa: {', '.join(FORMATOS_RESPUESTA)}")
+    return formato
+
+def quiere_msgpack(peticion):
+    """
+    Indica si el cliente prefiere MessagePack a JSON según su cabecera Accept.
+    Solo cuenta si lo nombra de forma explícita: '*/*' (lo que envían por defecto
+    fetch, curl o requests) y los empates con application/json se quedan en JSON.
+    """
+    if msgpack is None:
+        return False
+    explicitas = {tipo: calidad for tipo, calidad in peticion.accept_mimetypes}
+    calidad_msgpack = max((explicitas.get(tipo, 0) for tipo in TIPOS_MSGPACK), default=0)
+    calidad_json = max(explicitas.get('application/json', 0), explicitas.get('application/*', 0))
+    return calidad_msgpack > calidad_json and calidad_msgpack >= explicitas.get('*/*', 0)
+
+def _convertir_numpy(valor):
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+def responder(resultado, peticion):
+    """
+    Serializa el resultado en la codificación que prefiere el cliente. En
+    MessagePack la visualización viaja como bytes JPEG, sin base64.
+
+    Args:
+        resultado: Diccionario de la respuesta
+        peticion: Petición de Flask (para la cabecera Accept)
+
+    Returns:
+        Response
+    """
+    if not quiere_msgpack(peticion):
+        return jsonify(resultado)
+    if isinstance(resultado.get('visualizacion'), str):
+        resultado = dict(resultado, visualizacion=base64.b64decode(resultado['visualizacion']))
+    contenido = msgpack.packb(resultado, use_bin_type=True, default=_convertir_numpy)
+    return Response(contenido, mimetype=TIPO_MSGPACK)
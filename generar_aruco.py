@@ -1,6 +1,14 @@
 import cv2
 import numpy as np
 import os
+from registro_marcadores import (TABLEROS, TAMANOS_MARCADORES, CONFIG_DICCIONARIO, crear_tablero, ids_tablero,
+                                 ids_disponibles, generar_imagen_marcador, tablero_de_marcador, tableros_disponibles)
+
+def ids_marcadores_estandar(cantidad=10):
+    """
+    Primeros IDs del diccionario del despliegue que no son de calibración ni de tableros.
+    """
+    return [i for i in ids_disponibles() if i not in TAMANOS_MARCADORES and tablero_de_marcador(i) is None][:cantidad]
 
 def generar_codigos_aruco():
     """
@@ -12,14 +20,12 @@ def generar_codigos_aruco():
     if not os.path.exists("static/aruco"):
         os.makedirs("static/aruco")
     
-    # Configurar diccionario ArUco
-    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    
-    # Generar códigos ArUco optimizados
-    for i in range(10):  # Generar 10 códigos diferentes
+    # Generar códigos ArUco optimizados con el diccionario del despliegue
+    ids_estandar = ids_marcadores_estandar()
+    for i in ids_estandar:  # Hasta 10 códigos diferentes
         # Crear imagen del marcador con mayor resolución
         marker_size = 300  # Tamaño en píxeles (aumentado para mejor precisión)
-        marker_img = cv2.aruco.generateImageMarker(aruco_dict, i, marker_size)
+        marker_img = generar_imagen_marcador(i, marker_size)
         
         # Agregar borde blanco más grueso para mejor detección de bordes
         border_size = 80  # Borde más grueso para mejor definición de bordes
@@ -82,8 +88,12 @@ def generar_codigos_aruco():
         cv2.imwrite(filename, marker_with_outer_border)
         print(f"Generado: {filename}")
     
-    # Generar marcadores de calibración especiales
-    generar_marcadores_calibracion()
+    # Generar marcadores de calibración especiales (si están en el diccionario)
+    if all(marker_id in ids_disponibles() for marker_id in TAMANOS_MARCADORES):
+        generar_marcadores_calibracion()
+    
+    # Generar tableros de marcadores para estimar la escala con todos sus marcadores
+    generar_tableros()
     
     # Crear archivo de instrucciones mejorado
     instrucciones = """
@@ -131,27 +141,28 @@ def generar_codigos_aruco():
 - ✅ Verifica que el tamaño ingresado sea exacto
 
 ## 📁 Códigos Disponibles:
-- aruco_0.png - ID: 0 (Marcador estándar)
-- aruco_1.png - ID: 1 (Marcador estándar)
-- aruco_2.png - ID: 2 (Marcador estándar)
-- aruco_3.png - ID: 3 (Marcador estándar)
-- aruco_4.png - ID: 4 (Marcador estándar)
-- aruco_5.png - ID: 5 (Marcador estándar)
-- aruco_6.png - ID: 6 (Marcador estándar)
-- aruco_7.png - ID: 7 (Marcador estándar)
-- aruco_8.png - ID: 8 (Marcador estándar)
-- aruco_9.png - ID: 9 (Marcador estándar)
+LISTA_CODIGOS
 - calibracion_10cm.png - Marcador de calibración 10cm
 - calibracion_20cm.png - Marcador de calibración 20cm
+- tablero_a4.png - Tablero 3x4 (IDs 20-31, marcadores de 4cm, separación 1cm)
+
+## 🧩 Tableros de Marcadores:
+- Imprime el tablero al 100% (sin ajustar a página) para conservar el tamaño real
+- La escala se ajusta con todos los marcadores y tableros visibles a la vez
+- Los marcadores del tablero solo sirven como referencia de escala, no para medir
 
 ## 🔧 Información Técnica:
-- **Diccionario ArUco:** DICT_4X4_50
+- **Diccionario ArUco:** DICCIONARIO
 - **Tamaño de marcador:** 300px (alta resolución)
 - **Borde blanco:** 80px para mejor detección
 - **Marco negro:** 20px para contraste
 - **Precisión estimada:** ±1-2% en condiciones óptimas
 """
     
+    instrucciones = instrucciones.replace("LISTA_CODIGOS", "\n".join(
+        f"- aruco_{i}.png - ID: {i} (Marcador estándar)" for i in ids_estandar
+    )).replace("DICCIONARIO", CONFIG_DICCIONARIO['FAMILIAS'])
+    
     with open("static/aruco/INSTRUCCIONES.txt", "w", encoding="utf-8") as f:
         f.write(instrucciones)
     
@@ -168,11 +179,9 @@ def generar_marcadores_calibracion():
     """
     Genera marcadores de calibración especiales para verificar la precisión.
     """
-    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    
     # Marcador de calibración de 10cm
     marker_size = 400  # Tamaño más grande para calibración
-    marker_img = cv2.aruco.generateImageMarker(aruco_dict, 10, marker_size)
+    marker_img = generar_imagen_marcador(10, marker_size)
     
     # Borde blanco grueso
     border_size = 100
@@ -230,7 +239,7 @@ def generar_marcadores_calibracion():
     print(f"Generado marcador de calibración: {filename}")
     
     # Marcador de calibración de 20cm
-    marker_img_20 = cv2.aruco.generateImageMarker(aruco_dict, 11, marker_size)
+    marker_img_20 = generar_imagen_marcador(11, marker_size)
     marker_with_border_20 = cv2.copyMakeBorder(
         marker_img_20, 
         border_size, border_size, border_size, border_size,
@@ -270,5 +279,32 @@ def generar_marcadores_calibracion():
     cv2.imwrite(filename_20, marker_with_outer_border_20)
     print(f"Generado marcador de calibración: {filename_20}")
 
+def generar_tableros(dpi=300):
+    """
+    Genera las hojas imprimibles de los tableros GridBoard registrados.
+    
+    Args:
+        dpi: Resolución de impresión (puntos por pulgada)
+    """
+    pixeles_por_metro = dpi / 0.0254
+    margen = 0.01  # Margen blanco de 1cm alrededor del tablero
+    
+    for nombre in tableros_disponibles():
+        tablero = TABLEROS[nombre]
+        ancho_m = tablero['marcadores_x'] * tablero['tamano_marcador'] + (tablero['marcadores_x'] - 1) * tablero['separacion']
+        alto_m = tablero['marcadores_y'] * tablero['tamano_marcador'] + (tablero['marcadores_y'] - 1) * tablero['separacion']
+        margen_px = int(round(margen * pixeles_por_metro))
+        tamano_px = (
+            int(round(ancho_m * pixeles_por_metro)) + 2 * margen_px,
+            int(round(alto_m * pixeles_por_metro)) + 2 * margen_px
+        )
+        
+        imagen_tablero = crear_tablero(nombre).generateImage(tamano_px, marginSize=margen_px, borderBits=1)
+        
+        ids = ids_tablero(nombre)
+        filename = f"static/aruco/tablero_{nombre}.png"
+        cv2.imwrite(filename, imagen_tablero)
+        print(f"Generado tablero: {filename} (IDs {ids[0]}-{ids[-1]}, {dpi} DPI)")
+
 if __name__ == "__main__":
     generar_codigos_aruco() 
\ No newline at end of file
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Graba en disco los frames de /detectar_aruco que tardan demasiado o fallan, en un
+búfer circular acotado, para reproducirlos después bajo un perfilador.
+
+Cada grabación son dos archivos con el mismo nombre: <nombre>.bin con el frame tal
+como llegó (imagen codificada o gris crudo comprimido) y <nombre>.json con el
+perfil activo, las opciones, los tiempos por etapa y el resultado.
+
+Uso:
+    GRABADOR_FRAMES=1 gunicorn app:app
+    python grabador_frames.py listar
+    python grabador_frames.py reproducir --salida lentos.pstats
+    python grabador_frames.py reproducir --motivo fallo --repeticiones 3
+"""
+
+import os
+import json
+import time
+import zlib
+import base64
+import random
+import argparse
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from config_optimizacion import CONFIG_GRABADOR, obtener_perfil
+
+_estadisticas = {'grabados': 0, 'omitidos_muestreo': 0, 'errores_escritura': 0}
+_lock = threading.Lock()
+
+def _motivo_grabacion(resultado, ms_total):
+    """
+    'lento', 'fallo' o None si el frame no es candidato a grabarse.
+    """
+    if ms_total >= CONFIG_GRABADOR['UMBRAL_MS']:
+        return 'lento'
+    # Los frames rechazados por el filtro de calidad no se graban: ya se sabe por qué fallaron
+    if CONFIG_GRABADOR['GRABAR_FALLOS'] and 'error' in resultado and 'rechazo_calidad' not in resultado:
+        return 'fallo'
+    return None
+
+def _codificar_frame(img, data):
+    """
+    Bytes del frame para guardarlo: la imagen codificada tal como la envió el
+    cliente o, para el gris crudo, los píxeles comprimidos con zlib.
+    """
+    if data.get('image'):
+        imagen = data['image']
+        if ',' in imagen:
+            imagen = imagen.split(',')[1]
+        return base64.b64decode(imagen), {'formato': 'imagen'}
+    alto, ancho = img.shape[:2]
+    return zlib.compress(np.ascontiguousarray(img).tobytes(), 1), {
+        'formato': 'gris_zlib', 'ancho': ancho, 'alto': alto, 'canales': img.shape[2] if img.ndim == 3 else 1,
+    }
+
+def _podar(directorio):
+    """
+    Borra las grabaciones más antiguas por encima de MAX_GRABACIONES.
+    """
+    nombres = sorted(f[:-5] for f in os.listdir(directorio) if f.endswith('.json'))
+    for nombre in nombres[:max(0, len(nombres) - CONFIG_GRABADOR['MAX_GRABACIONES'])]:
+        for extension in ('.json', '.bin'):
+            try:
+                os.remove(os.path.join(directorio, nombre + extension))
+            except OSError:
+                pass
+
+def grabar_frame_si_procede(img, data, tiempos, resultado, inicio):
+    """
+    Graba el frame si superó el umbral de latencia o no se pudo medir, con la
+    tasa de muestreo configurada. Nunca interrumpe la petición si falla.
+
+    Args:
+        img: Imagen decodificada (None si no se llegó a decodificar)
+        data: Opciones de la petición
+        tiempos: ms de cada etapa anotados durante el procesamiento
+        resultado: Respuesta de la petición
+        inicio: time.perf_counter() al empezar la petición
+
+    Returns:
+        str: Ruta de la grabación, o None si no se grabó
+    """
+    if not CONFIG_GRABADOR['HABILITADO'] or img is None or data is None:
+        return None
+    ms_total = (time.perf_counter() - inicio) * 1000
+    motivo = _motivo_grabacion(resultado, ms_total)
+    if motivo is None:
+        return None
+    if random.random() >= CONFIG_GRABADOR['TASA_MUESTREO']:
+        with _lock:
+            _estadisticas['omitidos_muestreo'] += 1
+        return None
+
+    try:
+        directorio = CONFIG_GRABADOR['DIRECTORIO']
+        os.makedirs(directorio, exist_ok=True)
+        frame, formato = _codificar_frame(img, data)
+        # El nombre empieza por la marca de tiempo para que el orden alfabético sea el cronológico
+        nombre = f"{time.time_ns()}_{os.getpid()}"
+        ruta = os.path.join(directorio, nombre)
+        with open(ruta + '.bin', 'wb') as f:
+            f.write(frame)
+        metadatos = dict(formato, **{
+            'motivo': motivo,
+            'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'perfil': obtener_perfil(),
+            'opciones': {clave: valor for clave, valor in data.items() if clave != 'image'},
+            'ms_total': round(ms_total, 2),
+            'tiempos_ms': {etapa: round(ms, 2) for etapa, ms in tiempos.items()},
+            'resultado': {clave: valor for clave, valor in resultado.items() if clave != 'visualizacion'},
+        })
+        with open(ruta + '.json', 'w', encoding='utf-8') as f:
+            json.dump(metadatos, f, ensure_ascii=False, default=str)
+        _podar(directorio)
+    except Exception as e:
+        print(f"Error grabando frame: {str(e)}")
+        with _lock:
+            _estadisticas['errores_escritura'] += 1
+        return None
+
+    with _lock:
+        _estadisticas['grabados'] += 1
+    return ruta
+
+def estado_grabador():
+    """
+    Configuración del grabador y frames grabados en este proceso.
+    """
+    with _lock:
+        return dict(_estadisticas, habilitado=CONFIG_GRABADOR['HABILITADO'],
+                    umbral_ms=CONFIG_GRABADOR['UMBRAL_MS'], tasa_muestreo=CONFIG_GRABADOR['TASA_MUESTREO'])
+
+def cargar_grabaciones(directorio, motivo=None):
+    """
+    Metadatos de las grabaciones de un directorio, de la más antigua a la más reciente.
+
+    Yields:
+        (ruta_sin_extension, metadatos)
+    """
+    for archivo in sorted(f for f in os.listdir(directorio) if f.endswith('.json')):
+        ruta = os.path.join(directorio, archivo[:-5])
+        with open(ruta + '.json', encoding='utf-8') as f:
+            metadatos = json.load(f)
+        if motivo is None or metadatos['motivo'] == motivo:
+            yield ruta, metadatos
+
+def decodificar_grabacion(ruta, metadatos):
+    """
+    Reconstruye la imagen de una grabación tal como la recibió el servidor.
+    """
+    with open(ruta + '.bin', 'rb') as f:
+        frame = f.read()
+    if metadatos['formato'] == 'imagen':
+        return cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
+    forma = (metadatos['alto'], metadatos['ancho']) + ((metadatos['canales'],) if metadatos['canales'] > 1 else ())
+    return np.frombuffer(zlib.decompress(frame), np.uint8).reshape(forma)
+
+def reproducir(directorio, motivo=None, repeticiones=1, ruta_perfil=None, top=25):
+    """
+    Vuelve a pasar las grabaciones por el pipeline del servidor, con el perfil
+    con el que se grabaron, dentro de cProfile.
+
+    Returns:
+        list: (nombre, ms_grabado, ms_reproducido_medio, resultado_grabado, resultado_actual)
+    """
+    import cProfile
+    import pstats
+    from config_optimizacion import cambiar_configuracion
+    from app import app, procesar_frame
+
+    perfilador = cProfile.Profile()
+    filas = []
+    with app.test_request_context():
+        for ruta, metadatos in cargar_grabaciones(directorio, motivo):
+            cambiar_configuracion(metadatos['perfil'])
+            duraciones = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                perfilador.enable()
+                img = decodificar_grabacion(ruta, metadatos)
+                resultado = procesar_frame(img, dict(metadatos['opciones']), historial=deque(maxlen=10))
+                perfilador.disable()
+                duraciones.append((time.perf_counter() - inicio) * 1000)
+            filas.append((os.path.basename(ruta), metadatos['ms_total'], float(np.mean(duraciones)),
+                          metadatos['resultado'], resultado))
+
+    if filas:
+        if ruta_perfil:
+            perfilador.dump_stats(ruta_perfil)
+        pstats.Stats(perfilador).sort_stats('cumulative').print_stats(top)
+    return filas
+
+def _resumir(resultado):
+    if 'error' in resultado:
+        return f"error: {resultado['error'][:60]}"
+    return f"distancia {resultado.get('distancia', resultado.get('area'))}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Frames lentos o fallidos grabados por el servidor.")
+    parser.add_argument("accion", choices=["listar", "reproducir"])
+    parser.add_argument("--directorio", default=CONFIG_GRABADOR['DIRECTORIO'], help="Directorio de grabaciones")
+    parser.add_argument("--motivo", choices=["lento", "fallo"], help="Solo las grabaciones con este motivo")
+    parser.add_argument("--repeticiones", type=int, default=1, help="Veces que se procesa cada frame")
+    parser.add_argument("--salida", help="Archivo .pstats con el perfil (snakeviz, gprof2dot...)")
+    parser.add_argument("--top", type=int, default=25, help="Funciones mostradas en el resumen del perfil")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directorio):
+        print(f"❌ No existe el directorio de grabaciones: {args.directorio}")
+        return
+
+    if args.accion == "listar":
+        for ruta, metadatos in cargar_grabaciones(args.directorio, args.motivo):
+            etapas = ' '.join(f"{etapa}={ms:.0f}" for etapa, ms in metadatos['tiempos_ms'].items())
+            print(f"{os.path.basename(ruta)}  {metadatos['fecha']}  {metadatos['motivo']:<6} {metadatos['perfil']:<10} "
+                  f"{metadatos['ms_total']:8.1f} ms  [{etapas}]  {_resumir(metadatos['resultado'])}")
+        return
+
+    filas = reproducir(args.directorio, args.motivo, args.repeticiones, args.salida, args.top)
+    for nombre, ms_grabado, ms_reproducido, resultado_grabado, resultado_actual in filas:
+        print(f"{nombre}  grabado {ms_grabado:8.1f} ms  reproducido {ms_reproducido:8.1f} ms  "
+              f"{_resumir(resultado_grabado)}  ->  {_resumir(resultado_actual)}")
+    print(f"✅ {len(filas)} frames reproducidos")
+    if args.salida:
+        print(f"📁 Perfil: {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# --- Generación bajo demanda de marcadores y hojas imprimibles ---
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+from registro_marcadores import ids_disponibles, localizar_marcador, generar_imagen_marcador, obtener_tamano_marcador
+
+# Tamaños de papel en metros (ancho, alto)
+PAPELES = {
+    'a4': (0.210, 0.297),
+    'a3': (0.297, 0.420),
+    'carta': (0.2159, 0.2794),
+}
+
+MARGEN_HOJA = 0.01          # Margen de la hoja en metros
+ZONA_SILENCIO = 0.15        # Borde blanco alrededor de cada marcador (fracción del lado)
+ALTO_ETIQUETA = 0.006       # Alto reservado para la etiqueta bajo cada marcador (metros)
+UMBRAL_PARALELO = 8         # A partir de cuántos marcadores se renderiza en paralelo
+MAX_TRABAJADORES = 4        # Hilos para renderizar hojas grandes
+MAX_IDS_HOJA = 100          # IDs por petición
+MAX_PIXELES_HOJAS = 150_000_000  # Píxeles rasterizados por petición (sumando páginas; una A4 a 1200 DPI)
+MAX_BYTES_CACHE = 64 * 1024 * 1024  # Bytes guardados en la caché LRU
+MAX_BYTES_ENTRADA_CACHE = MAX_BYTES_CACHE // 8  # Hojas más grandes no se guardan en caché
+
+FORMATOS = {
+    'pdf': 'application/pdf',
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+
+_cache = OrderedDict()  # (ids, tamano_lado, dpi, formato, papel) -> (contenido, etag), del menos al más reciente
+_bytes_cache = 0
+_lock_cache = threading.Lock()
+
+def _metros_a_px(metros, dpi):
+    return int(round(metros * dpi / 0.0254))
+
+def validar_ids(ids):
+    """
+    Comprueba que todos los IDs existan en el diccionario del despliegue.
+
+    Args:
+        ids: Secuencia de IDs de marcador
+
+    Raises:
+        ValueError: Si la lista está vacía o algún ID no existe
+    """
+    if not ids:
+        raise ValueError("No se indicó ningún ID de marcador")
+    disponibles = set(ids_disponibles())
+    fuera_de_diccionario = [i for i in ids if i not in disponibles]
+    if fuera_de_diccionario:
+        raise ValueError(f"IDs fuera del diccionario de marcadores: {fuera_de_diccionario}")
+
+def renderizar_marcador(marker_id, tamano_lado, dpi, etiqueta=True):
+    """
+    Renderiza un marcador con su zona de silencio al tamaño físico exacto para un DPI dado.
+
+    Args:
+        marker_id: ID del marcador
+        tamano_lado: Lado real del marcador en metros
+        dpi: Resolución de impresión
+        etiqueta: Si se dibuja el ID y el tamaño debajo del marcador
+
+    Returns:
+        imagen: Array uint8 en escala de grises
+    """
+    lado_px = _metros_a_px(tamano_lado, dpi)
+    borde_px = _metros_a_px(tamano_lado * ZONA_SILENCIO, dpi)
+    etiqueta_px = _metros_a_px(ALTO_ETIQUETA, dpi) if etiqueta else 0
+
+    marcador = generar_imagen_marcador(marker_id, lado_px)
+    celda = cv2.copyMakeBorder(
+        marcador, borde_px, borde_px + etiqueta_px, borde_px, borde_px,
+        cv2.BORDER_CONSTANT, value=255
+    )
+
+    if etiqueta:
+        texto = f"ID {marker_id} - {tamano_lado * 100:g}cm"
+        escala_fuente = etiqueta_px / 40.0
+        grosor = max(1, int(escala_fuente * 2))
+        cv2.putText(celda, texto, (borde_px, celda.shape[0] - etiqueta_px // 3),
+                    cv2.FONT_HERSHEY_SIMPLEX, escala_fuente, 0, grosor)
+    return celda
+
+def _distribuir(ids, tamano_lado, papel):
+    """
+    Calcula la posición (en metros) de cada marcador en las hojas.
+
+    Returns:
+        paginas: Lista de páginas, cada una con tuplas (id, tamaño, x, y)
+    """
+    ancho_papel, alto_papel = PAPELES[papel]
+    paginas = [[]]
+    x = y = MARGEN_HOJA
+    alto_fila = 0.0
+
+    for marker_id in ids:
+        tamano = obtener_tamano_marcador(marker_id, tamano_lado)
+        ancho_celda = tamano * (1 + 2 * ZONA_SILENCIO)
+        alto_celda = ancho_celda + ALTO_ETIQUETA
+        if ancho_celda > ancho_papel - 2 * MARGEN_HOJA or alto_celda > alto_papel - 2 * MARGEN_HOJA:
+            raise ValueError(f"El marcador {marker_id} de {tamano * 100:g}cm no cabe en una hoja {papel}")
+
+        if x + ancho_celda > ancho_papel - MARGEN_HOJA:
+            x = MARGEN_HOJA
+            y += alto_fila
+            alto_fila = 0.0
+        if y + alto_celda > alto_papel - MARGEN_HOJA:
+            paginas.append([])
+            x = y = MARGEN_HOJA
+            alto_fila = 0.0
+
+        paginas[-1].append((marker_id, tamano, x, y))
+        x += ancho_celda
+        alto_fila = max(alto_fila, alto_celda)
+
+    return paginas
+
+def _renderizar_paginas(ids, tamano_lado, dpi, papel):
+    paginas = _distribuir(ids, tamano_lado, papel)
+    ancho_px = _metros_a_px(PAPELES[papel][0], dpi)
+    alto_px = _metros_a_px(PAPELES[papel][1], dpi)
+    if len(paginas) * ancho_px * alto_px > MAX_PIXELES_HOJAS:
+        raise ValueError(f"{len(paginas)} página(s) {papel} a {dpi} DPI superan los píxeles permitidos por petición; "
+                         "baja el DPI o pide menos IDs")
+
+    trabajos = [(marker_id, tamano) for pagina in paginas for marker_id, tamano, _, _ in pagina]
+    if len(trabajos) >= UMBRAL_PARALELO:
+        # OpenCV libera el GIL al generar y escalar, así que los hilos trabajan en paralelo
+        with ThreadPoolExecutor(max_workers=MAX_TRABAJADORES) as executor:
+            celdas = list(executor.map(lambda t: renderizar_marcador(t[0], t[1], dpi), trabajos))
+    else:
+        celdas = [renderizar_marcador(marker_id, tamano, dpi) for marker_id, tamano in trabajos]
+
+    imagenes = []
+    indice = 0
+    for pagina in paginas:
+        hoja = np.full((alto_px, ancho_px), 255, dtype=np.uint8)
+        for _, _, x, y in pagina:
+            celda = celdas[indice]
+            indice += 1
+            x_px, y_px = _metros_a_px(x, dpi), _metros_a_px(y, dpi)
+            alto_celda = min(celda.shape[0], alto_px - y_px)
+            ancho_celda = min(celda.shape[1], ancho_px - x_px)
+            hoja[y_px:y_px + alto_celda, x_px:x_px + ancho_celda] = celda[:alto_celda, :ancho_celda]
+        imagenes.append(hoja)
+    return imagenes
+
+def _exportar_svg(ids, tamano_lado, papel):
+    """
+    Genera una hoja vectorial en milímetros: cada celda del marcador es un rectángulo exacto.
+    """
+    paginas = _distribuir(ids, tamano_lado, papel)
+    if len(paginas) > 1:
+        raise ValueError("Los marcadores no caben en una sola hoja; usa formato pdf")
+
+    ancho_mm, alto_mm = (v * 1000 for v in PAPELES[papel])
+    partes = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{ancho_mm:g}mm" height="{alto_mm:g}mm" '
+        f'viewBox="0 0 {ancho_mm:g} {alto_mm:g}">',
+        f'<rect width="{ancho_mm:g}" height="{alto_mm:g}" fill="white"/>',
+    ]
+
+    for marker_id, tamano, x, y in paginas[0]:
+        diccionario, _ = localizar_marcador(marker_id)
+        celdas_lado = diccionario.markerSize + 2  # Bits internos + borde negro
+        bits = generar_imagen_marcador(marker_id, celdas_lado)
+        celda_mm = tamano * 1000 / celdas_lado
+        origen_x = (x + tamano * ZONA_SILENCIO) * 1000
+        origen_y = (y + tamano * ZONA_SILENCIO) * 1000
+        for fila, columna in zip(*np.nonzero(bits == 0)):
+            partes.append(
+                f'<rect x="{origen_x + columna * celda_mm:.3f}" y="{origen_y + fila * celda_mm:.3f}" '
+                f'width="{celda_mm:.3f}" height="{celda_mm:.3f}" fill="black"/>'
+            )
+        partes.append(
+            f'<text x="{origen_x:.3f}" y="{origen_y + tamano * (1 + ZONA_SILENCIO) * 1000 + ALTO_ETIQUETA * 600:.3f}" '
+            f'font-family="sans-serif" font-size="{ALTO_ETIQUETA * 500:g}">ID {marker_id} - {tamano * 100:g}cm</text>'
+        )
+
+    partes.append('</svg>')
+    return '\n'.join(partes).encode('utf-8')
+
+def _guardar_en_cache(clave, resultado):
+    """
+    Guarda una hoja en la caché LRU, descartando las menos recientes hasta que
+    el total quepa en MAX_BYTES_CACHE. Las hojas grandes no se guardan: cada
+    una desplazaría a muchas pequeñas.
+    """
+    global _bytes_cache
+    tamano = len(resultado[0])
+    if tamano > MAX_BYTES_ENTRADA_CACHE:
+        return
+    with _lock_cache:
+        if clave in _cache:
+            return
+        _cache[clave] = resultado
+        _bytes_cache += tamano
+        while _bytes_cache > MAX_BYTES_CACHE:
+            _, (contenido, _) = _cache.popitem(last=False)
+            _bytes_cache -= len(contenido)
+
+def generar_hoja(ids, tamano_lado, dpi=300, formato='pdf', papel='a4'):
+    """
+    Genera una hoja imprimible con los marcadores pedidos (resultado en una
+    caché LRU limitada en bytes).
+
+    Args:
+        ids: Tupla de IDs de marcador
+        tamano_lado: Lado en metros de los marcadores sin tamaño registrado
+        dpi: Resolución para los formatos rasterizados
+        formato: 'pdf', 'svg' o 'png'
+        papel: Tamaño de papel ('a4', 'a3' o 'carta')
+
+    Returns:
+        (contenido, etag): Bytes del archivo y su ETag
+    """
+    clave = (ids, tamano_lado, dpi, formato, papel)
+    with _lock_cache:
+        resultado = _cache.get(clave)
+        if resultado is not None:
+            _cache.move_to_end(clave)
+            return resultado
+
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato}. Usa: {', '.join(FORMATOS)}")
+    if len(ids) > MAX_IDS_HOJA:
+        raise ValueError(f"Se pidieron demasiados IDs (máximo {MAX_IDS_HOJA})")
+    if papel not in PAPELES:
+        raise ValueError(f"Papel no soportado: {papel}. Usa: {', '.join(PAPELES)}")
+    validar_ids(ids)
+
+    if formato == 'svg':
+        contenido = _exportar_svg(ids, tamano_lado, papel)
+    else:
+        paginas = _renderizar_paginas(ids, tamano_lado, dpi, papel)
+        buffer = io.BytesIO()
+        if formato == 'pdf':
+            # La resolución fija el tamaño físico de cada página en el PDF
+            imagenes = [Image.fromarray(pagina) for pagina in paginas]
+            imagenes[0].save(buffer, format='PDF', resolution=dpi, save_all=True, append_images=imagenes[1:])
+        else:
+            if len(paginas) > 1:
+                raise ValueError("Los marcadores no caben en una sola hoja; usa formato pdf")
+            Image.fromarray(paginas[0]).save(buffer, format='PNG', dpi=(dpi, dpi))
+        contenido = buffer.getvalue()
+
+    resultado = (contenido, hashlib.sha1(contenido).hexdigest())
+    _guardar_en_cache(clave, resultado)
+    return resultado
@@ -0,0 +1,128 @@
+# --- Homografía del plano del suelo por sesión ---
+import time
+import cv2
+import numpy as np
+from almacen_estado import leer, actualizar
+
+# Parámetros de la caché de homografías
+MAX_SESIONES = 256            # Sesiones guardadas como máximo (se descarta la menos reciente)
+EXPIRACION_SESION = 600.0     # Segundos sin frames antes de descartar una sesión
+MAX_FRAMES_PROMEDIO = 20      # Peso mínimo de un frame nuevo = 1 / MAX_FRAMES_PROMEDIO
+TOLERANCIA_MOVIMIENTO = 0.02  # Error de reproyección (fracción del lado) que indica que la cámara se movió
+
+# Espacio del almacén (almacen_estado.py): sesion_id -> {'homografia', 'num_frames', 'tiempo', 'tamano_lado'}
+ESPACIO_HOMOGRAFIAS = 'homografias'
+
+def calcular_homografia_marcador(corners, tamano_lado, escala_imagen=(1.0, 1.0)):
+    """
+    Calcula la homografía que lleva píxeles de la imagen al plano del marcador (metros).
+
+    Args:
+        corners: Esquinas del marcador ArUco (4 x 2) en coordenadas de detección
+        tamano_lado: Tamaño real del lado en metros
+        escala_imagen: (sx, sy) de la imagen original a la imagen de detección
+
+    Returns:
+        homografia: Matriz 3 x 3 para puntos en píxeles de la imagen original
+    """
+    puntos_plano = np.array([
+        [0, 0],
+        [tamano_lado, 0],
+        [tamano_lado, tamano_lado],
+        [0, tamano_lado],
+    ], dtype=np.float64)
+
+    homografia = cv2.getPerspectiveTransform(
+        np.asarray(corners, dtype=np.float32), puntos_plano.astype(np.float32)
+    )
+
+    # Componer con el escalado para aceptar píxeles de la imagen original
+    escala = np.diag([escala_imagen[0], escala_imagen[1], 1.0])
+    homografia = homografia @ escala
+    return homografia / homografia[2, 2]
+
+def proyectar_al_plano(homografia, puntos):
+    """
+    Proyecta puntos en píxeles al plano del suelo con una sola multiplicación matricial.
+
+    Args:
+        homografia: Matriz 3 x 3 píxeles -> metros
+        puntos: Array (N x 2) de puntos en píxeles
+
+    Returns:
+        puntos_plano: Array (N x 2) en metros
+    """
+    puntos = np.asarray(puntos, dtype=np.float64).reshape(-1, 2)
+    homogeneos = np.hstack([puntos, np.ones((len(puntos), 1))]) @ homografia.T
+    return homogeneos[:, :2] / homogeneos[:, 2:3]
+
+def medir_pares(homografia, pares):
+    """
+    Mide la distancia real entre pares de puntos de la imagen.
+
+    Args:
+        homografia: Matriz 3 x 3 píxeles -> metros
+        pares: Lista de pares [[x1, y1], [x2, y2]] en píxeles
+
+    Returns:
+        distancias: Array con la distancia en metros de cada par
+    """
+    pares = np.asarray(pares, dtype=np.float64).reshape(-1, 2, 2)
+    puntos_plano = proyectar_al_plano(homografia, pares.reshape(-1, 2)).reshape(-1, 2, 2)
+    return np.linalg.norm(puntos_plano[:, 1] - puntos_plano[:, 0], axis=1)
+
+def actualizar_homografia_sesion(sesion_id, homografia_nueva, corners_originales, tamano_lado):
+    """
+    Actualiza de forma incremental la homografía de una sesión con un frame nuevo.
+    Si la cámara no se movió, promedia con la homografía previa; si se movió, la reemplaza.
+
+    Args:
+        sesion_id: Identificador de la sesión de medición
+        homografia_nueva: Homografía calculada en el frame actual
+        corners_originales: Esquinas del marcador en píxeles de la imagen original
+        tamano_lado: Tamaño real del lado en metros
+
+    Returns:
+        dict: Estado de la sesión (homografía vigente y número de frames promediados)
+    """
+    tiempo_actual = time.time()
+
+    def aplicar(estado):
+        if estado is not None and estado['tamano_lado'] == tamano_lado:
+            # Comprobar si las esquinas nuevas caen donde predice la homografía vigente
+            predichas = proyectar_al_plano(estado['homografia'], corners_originales)
+            esperadas = proyectar_al_plano(homografia_nueva, corners_originales)
+            error = np.max(np.linalg.norm(predichas - esperadas, axis=1)) / tamano_lado
+
+            if error <= TOLERANCIA_MOVIMIENTO:
+                peso = 1.0 / min(estado['num_frames'] + 1, MAX_FRAMES_PROMEDIO)
+                homografia = (1.0 - peso) * estado['homografia'] + peso * homografia_nueva
+                return {
+                    'homografia': homografia / homografia[2, 2],
+                    'num_frames': estado['num_frames'] + 1,
+                    'tiempo': tiempo_actual,
+                    'tamano_lado': tamano_lado,
+                }
+
+        return {
+            'homografia': homografia_nueva,
+            'num_frames': 1,
+            'tiempo': tiempo_actual,
+            'tamano_lado': tamano_lado,
+        }
+
+    # Lectura y escritura atómicas: dos frames a la vez en distintos workers no se pisan
+    return actualizar(ESPACIO_HOMOGRAFIAS, sesion_id, aplicar, EXPIRACION_SESION, MAX_SESIONES)
+
+def obtener_homografia_sesion(sesion_id):
+    """
+    Devuelve la homografía vigente de una sesión.
+
+    Args:
+        sesion_id: Identificador de la sesión de medición
+
+    Returns:
+        homografia: Matriz 3 x 3 o None si la sesión no existe o expiró
+    """
+    estado = leer(ESPACIO_HOMOGRAFIAS, sesion_id)
+    return None if estado is None else estado['homografia']
@@ -0,0 +1,73 @@
+# --- Ingesta de frames en escala de grises sin comprimir (sin JPEG) ---
+import zlib
+import numpy as np
+
+# LZ4 es opcional: solo se anuncia si está instalado
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+TIPO_CONTENIDO = 'application/octet-stream'
+MAX_PIXELES = 4096 * 4096  # Límite de seguridad para el tamaño declarado
+
+def compresiones_disponibles():
+    """
+    Compresiones que el servidor acepta para los frames crudos.
+    """
+    compresiones = ['ninguna', 'zlib']
+    if lz4_frame is not None:
+        compresiones.append('lz4')
+    return compresiones
+
+def decodificar_gris_crudo(cuerpo, ancho, alto, compresion='ninguna'):
+    """
+    Envuelve un buffer de 8 bits en escala de grises como imagen, sin copiarlo
+    cuando no viene comprimido.
+
+    Args:
+        cuerpo: Bytes del cuerpo de la petición (ancho * alto bytes, fila a fila)
+        ancho: Ancho del frame en píxeles
+        alto: Alto del frame en píxeles
+        compresion: 'ninguna', 'zlib' o 'lz4'
+
+    Returns:
+        img: Array (alto x ancho) uint8 de solo lectura
+
+    Raises:
+        ValueError: Si el tamaño o la compresión no son válidos
+    """
+    if ancho <= 0 or alto <= 0 or ancho * alto > MAX_PIXELES:
+        raise ValueError(f"Dimensiones no válidas: {ancho}x{alto}")
+
+    # Se descomprime como mucho un byte más de lo esperado: unos KB de ceros
+    # comprimidos no llegan a ocupar GB antes de comprobar la longitud
+    limite = ancho * alto + 1
+    if compresion == 'zlib':
+        descompresor = zlib.decompressobj()
+        try:
+            cuerpo = descompresor.decompress(cuerpo, limite)
+        except zlib.error as e:
+            raise ValueError(f"Buffer zlib no válido: {e}")
+        incompleto = not descompresor.eof or descompresor.unconsumed_tail or descompresor.unused_data
+    elif compresion == 'lz4':
+        if lz4_frame is None:
+            raise ValueError("El servidor no tiene soporte para lz4")
+        descompresor = lz4_frame.LZ4FrameDecompressor()
+        try:
+            cuerpo = descompresor.decompress(cuerpo, max_length=limite)
+        except RuntimeError as e:
+            raise ValueError(f"Buffer lz4 no válido: {e}")
+        incompleto = not descompresor.eof or descompresor.unused_data
+    elif compresion != 'ninguna':
+        raise ValueError(f"Compresión no soportada: {compresion}")
+    else:
+        incompleto = False
+
+    if incompleto and len(cuerpo) <= ancho * alto:
+        raise ValueError(f"El buffer comprimido está truncado o tiene datos de más ({compresion})")
+    if len(cuerpo) != ancho * alto:
+        raise ValueError(f"El buffer tiene {len(cuerpo)} bytes; se esperaban {ancho * alto} ({ancho}x{alto})")
+
+    # Vista sin copia sobre los bytes recibidos
+    return np.frombuffer(cuerpo, dtype=np.uint8).reshape(alto, ancho)
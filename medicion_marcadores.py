@@ -0,0 +1,485 @@
+# --- Detección de marcadores, geometría de la medición y filtrado temporal ---
+# Sin Flask: lo usan también los procesos del pool de visión y procesar_video.py
+import time
+from collections import deque
+import cv2
+import numpy as np
+from config_optimizacion import obtener_configuracion
+from calibracion_camara import obtener_intrinsecos, corregir_esquinas, estimar_esquinas_3d
+from registro_marcadores import obtener_tamano_marcador, tablero_de_marcador, estimar_escala_global
+from cascada_deteccion import ejecutar_cascada
+from deteccion_mosaico import usar_mosaico, detectar_en_mosaico
+from refinamiento_esquinas import refinar_esquinas
+from buffers_imagen import prestar_buffers
+
+# --- Variables globales para filtrado temporal ---
+# Filtro de las llamadas sin historial a filtrar_mediciones_temporales; las
+# mediciones sin sesión de la API usan el filtro global del almacén de estado
+mediciones_previas = deque(maxlen=10)  # Almacena las últimas 10 mediciones
+ultima_medicion_tiempo = 0
+
+def calcular_tamano_deteccion(ancho, alto):
+    """
+    Calcula la resolución a la que se ejecuta la detección según la configuración.
+    
+    Args:
+        ancho: Ancho de la imagen original
+        alto: Alto de la imagen original
+    
+    Returns:
+        (ancho, alto): Resolución usada por el detector
+    """
+    config = obtener_configuracion()
+    if config['REDUCIR_IMAGEN'] and (ancho > config['MAX_WIDTH'] or alto > config['MAX_HEIGHT']):
+        scale_factor = min(config['MAX_WIDTH']/ancho, config['MAX_HEIGHT']/alto)
+        return int(ancho * scale_factor), int(alto * scale_factor)
+    return ancho, alto
+
+def calcular_distancia_multipunto(corners1, corners2, metros_por_pixel):
+    """
+    Calcula la distancia usando múltiples puntos de referencia para mayor precisión.
+    
+    Args:
+        corners1: Esquinas del primer marcador ArUco
+        corners2: Esquinas del segundo marcador ArUco
+        metros_por_pixel: Factor de conversión
+    
+    Returns:
+        distancia_promedio: Distancia promedio calculada
+        puntos_medicion: Puntos utilizados para la medición
+    """
+    # Calcular centro de masa de cada marcador
+    centro1 = np.mean(corners1, axis=0)
+    centro2 = np.mean(corners2, axis=0)
+    
+    # Calcular distancia entre centros
+    distancia_centros = np.linalg.norm(centro2 - centro1)
+    
+    # Calcular distancias desde múltiples esquinas
+    distancias_esquinas = []
+    puntos_medicion = []
+    
+    # Vector dirección entre centros
+    direccion = centro2 - centro1
+    direccion_normalizada = direccion / np.linalg.norm(direccion)
+    
+    # Para cada esquina del primer marcador, encontrar la esquina más cercana del segundo
+    for i, esquina1 in enumerate(corners1):
+        # Encontrar la esquina del segundo marcador más alejada en la dirección opuesta
+        distancias_proyeccion = []
+        for esquina2 in corners2:
+            # Proyección de la línea entre esquinas en la dirección de los centros
+            vector_esquinas = esquina2 - esquina1
+            proyeccion = np.dot(vector_esquinas, direccion_normalizada)
+            distancias_proyeccion.append(proyeccion)
+        
+        # Usar la esquina con mayor proyección (más alejada)
+        idx_max = np.argmax(distancias_proyeccion)
+        esquina2_seleccionada = corners2[idx_max]
+        
+        # Calcular distancia entre estas esquinas
+        distancia_esquinas = np.linalg.norm(esquina2_seleccionada - esquina1)
+        distancias_esquinas.append(distancia_esquinas)
+        puntos_medicion.append((esquina1, esquina2_seleccionada))
+    
+    # Calcular distancia promedio ponderada con pesos mejorados
+    distancias_esquinas = np.array(distancias_esquinas)
+    
+    # Usar pesos basados en la estabilidad y consistencia
+    # Dar más peso a las mediciones que están más cerca de la mediana
+    mediana = np.median(distancias_esquinas)
+    desviaciones = np.abs(distancias_esquinas - mediana)
+    
+    # Pesos inversamente proporcionales a la desviación, con suavizado
+    pesos = 1.0 / (1.0 + desviaciones / (mediana * 0.1))  # Factor de suavizado
+    pesos = pesos / np.sum(pesos)
+    
+    distancia_promedio_px = np.sum(distancias_esquinas * pesos)
+    distancia_promedio_metros = distancia_promedio_px * metros_por_pixel
+    
+    return distancia_promedio_metros, puntos_medicion, distancia_centros * metros_por_pixel
+
+def calcular_distancia_con_correccion_perspectiva(corners1, corners2, metros_por_pixel, imagen_shape):
+    """
+    Calcula la distancia con corrección de perspectiva para mayor precisión.
+    
+    Args:
+        corners1: Esquinas del primer marcador ArUco
+        corners2: Esquinas del segundo marcador ArUco
+        metros_por_pixel: Factor de conversión
+        imagen_shape: Forma de la imagen (altura, ancho)
+    
+    Returns:
+        distancia_corregida: Distancia corregida por perspectiva
+    """
+    # Calcular centro de cada marcador
+    centro1 = np.mean(corners1, axis=0)
+    centro2 = np.mean(corners2, axis=0)
+    
+    # Calcular distancia básica
+    distancia_basica = np.linalg.norm(centro2 - centro1)
+    
+    # Corrección de perspectiva basada en la posición en la imagen
+    # Los objetos más cerca del centro de la imagen tienen menos distorsión
+    centro_imagen = np.array([imagen_shape[1] / 2, imagen_shape[0] / 2])
+    
+    # Calcular factor de corrección basado en la distancia al centro
+    distancia_al_centro1 = np.linalg.norm(centro1 - centro_imagen)
+    distancia_al_centro2 = np.linalg.norm(centro2 - centro_imagen)
+    
+    # Factor de corrección (mayor para objetos más alejados del centro)
+    factor_correccion1 = 1.0 + (distancia_al_centro1 / (imagen_shape[0] + imagen_shape[1])) * 0.1
+    factor_correccion2 = 1.0 + (distancia_al_centro2 / (imagen_shape[0] + imagen_shape[1])) * 0.1
+    
+    # Factor de corrección promedio
+    factor_correccion = (factor_correccion1 + factor_correccion2) / 2
+    
+    # Aplicar corrección
+    distancia_corregida = distancia_basica / factor_correccion
+    
+    return distancia_corregida * metros_por_pixel
+
+def calcular_distancia_entre_bordes(corners1, corners2, metros_por_pixel):
+    """
+    Calcula la distancia entre los bordes externos de dos marcadores ArUco.
+    Usa el punto más cercano entre los bordes externos para mayor precisión.
+    """
+    # Obtener los bordes externos de cada marcador
+    # Para cada marcador, los bordes externos son los puntos más alejados
+    # en la dirección de la línea que conecta los centros
+    
+    # Calcular centros de los marcadores
+    center1 = np.mean(corners1, axis=0)
+    center2 = np.mean(corners2, axis=0)
+    
+    # Vector dirección entre centros
+    direction = center2 - center1
+    direction_normalized = direction / np.linalg.norm(direction)
+    
+    # Encontrar los puntos más externos en cada marcador
+    # en la dirección del otro marcador
+    
+    # Para el primer marcador: punto más alejado en dirección al segundo
+    distances1 = [np.dot(corner - center1, direction_normalized) for corner in corners1]
+    edge1_idx = np.argmax(distances1)
+    edge1 = corners1[edge1_idx]
+    
+    # Para el segundo marcador: punto más alejado en dirección al primero
+    distances2 = [np.dot(corner - center2, -direction_normalized) for corner in corners2]
+    edge2_idx = np.argmax(distances2)
+    edge2 = corners2[edge2_idx]
+    
+    # Calcular distancia entre bordes externos
+    distancia_bordes_px = np.linalg.norm(edge2 - edge1)
+    distancia_bordes_metros = distancia_bordes_px * metros_por_pixel
+    
+    return distancia_bordes_metros, edge1, edge2
+
+def calcular_distancia_pnp(corners1, corners2, tamanos_lado, modelo_dispositivo, tamano_deteccion):
+    """
+    Calcula la distancia real entre dos marcadores a partir de su pose 3D (solvePnP),
+    usando los intrínsecos calibrados del dispositivo en lugar de la escala en píxeles.
+    
+    Args:
+        corners1: Esquinas del primer marcador ArUco
+        corners2: Esquinas del segundo marcador ArUco
+        tamanos_lado: (tamaño del primer marcador, tamaño del segundo) en metros
+        modelo_dispositivo: Modelo del dispositivo con calibración guardada
+        tamano_deteccion: (ancho, alto) de la imagen donde se detectaron las esquinas
+    
+    Returns:
+        distancia_metros: Distancia multipunto en 3D, o None si no hay calibración
+    """
+    matriz_camara, coeficientes = obtener_intrinsecos(modelo_dispositivo, tamano_deteccion)
+    if matriz_camara is None:
+        return None
+    
+    # Transformación de puntos sin distorsión (los intrínsecos ya están en caché)
+    corners1, corners2 = corregir_esquinas([corners1, corners2], matriz_camara, coeficientes)
+    
+    esquinas3d_1 = estimar_esquinas_3d(corners1, tamanos_lado[0], matriz_camara)
+    esquinas3d_2 = estimar_esquinas_3d(corners2, tamanos_lado[1], matriz_camara)
+    if esquinas3d_1 is None or esquinas3d_2 is None:
+        return None
+    
+    # Mismo criterio multipunto, pero con las esquinas ya en metros
+    distancia_metros, _, _ = calcular_distancia_multipunto(esquinas3d_1, esquinas3d_2, 1.0)
+    return distancia_metros
+
+def mejorar_deteccion_aruco(imagen, min_marcadores=2):
+    """
+    Mejora la detección de ArUco con múltiples técnicas (optimizada para velocidad).
+    
+    Args:
+        imagen: Imagen de entrada
+        min_marcadores: Número mínimo de marcadores para considerar la detección válida
+    
+    Returns:
+        corners_mejoradas: Esquinas detectadas mejoradas
+        ids: IDs de los marcadores
+    """
+    height, width = imagen.shape[:2]
+    new_width, new_height = calcular_tamano_deteccion(width, height)
+    
+    # Los arrays intermedios salen del pool de buffers del proceso (OpenCV escribe en ellos con dst=)
+    with prestar_buffers(imagen.shape) as buffers:
+        # Convertir a escala de grises
+        gray = buffers.obtener('gris', (height, width))
+        if len(imagen.shape) == 3:
+            cv2.cvtColor(imagen, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            np.copyto(gray, imagen)
+        
+        # Reducir tamaño de imagen para mayor velocidad (si es muy grande)
+        if (new_width, new_height) != (width, height):
+            gray_reducida = buffers.obtener('gris_reducida', (new_height, new_width))
+            gray = cv2.resize(gray, (new_width, new_height), dst=gray_reducida)
+        
+        # Detectar ArUco: por mosaicos en paralelo en fotos grandes, o con la
+        # cascada de estrategias (suavizado, original, CLAHE...)
+        if usar_mosaico(new_width, new_height):
+            corners, ids = detectar_en_mosaico(gray, buffers, min_marcadores)
+        else:
+            corners, ids, _ = ejecutar_cascada(gray, buffers, min_marcadores)
+        
+        if ids is None:
+            return None, None
+        
+        # Refinar esquinas con el modo del perfil (ninguno, detector, lote o lineas)
+        corners_refinadas = refinar_esquinas(gray, corners)
+    
+    return corners_refinadas, ids
+
+def calcular_geometria_medicion(corners, ids, tamano_lado, imagen_shape, modelo_dispositivo=None):
+    """
+    Calcula la escala y las distancias entre los dos marcadores de medición con todos
+    los métodos disponibles (sin filtrado temporal).
+    
+    Args:
+        corners: Esquinas detectadas por mejorar_deteccion_aruco
+        ids: IDs de los marcadores detectados
+        tamano_lado: Tamaño real del lado en metros para marcadores sin tamaño registrado
+        imagen_shape: Forma de la imagen original (altura, ancho, ...)
+        modelo_dispositivo: Modelo con calibración de cámara (opcional)
+    
+    Returns:
+        geometria: Diccionario con escala, esquinas y distancias, o None
+        error: Mensaje de error si no se pudo medir
+    """
+    # Ordenar marcadores por ID para consistencia
+    marker_indices = np.argsort(ids.flatten())
+    corners = [corners[i] for i in marker_indices]
+    ids = ids[marker_indices]
+    
+    # Escala común ajustada con todos los marcadores y tableros detectados
+    metros_por_pixel, lado_px, ids_rechazados = estimar_escala_global(corners, ids, tamano_lado)
+    
+    # Medir entre los dos primeros marcadores sueltos coherentes con la escala
+    indices_medicion = [
+        i for i, marker_id in enumerate(ids.flatten())
+        if marker_id not in ids_rechazados and tablero_de_marcador(marker_id) is None
+    ]
+    if len(indices_medicion) < 2:
+        return None, "Se necesitan al menos 2 códigos ArUco sueltos y coherentes para medir. Los tableros solo sirven como referencia de escala."
+    
+    # Obtener las esquinas de los dos marcadores de medición
+    marker1_corners = corners[indices_medicion[0]][0]
+    marker2_corners = corners[indices_medicion[1]][0]
+    tamano_lado1 = obtener_tamano_marcador(ids.flatten()[indices_medicion[0]], tamano_lado)
+    tamano_lado2 = obtener_tamano_marcador(ids.flatten()[indices_medicion[1]], tamano_lado)
+    
+    # Calcular distancia usando método multipunto mejorado
+    distancia_multipunto_metros, puntos_medicion, distancia_centros_metros = calcular_distancia_multipunto(
+        marker1_corners, marker2_corners, metros_por_pixel
+    )
+    
+    # Calcular distancia con corrección de perspectiva
+    distancia_perspectiva_metros = calcular_distancia_con_correccion_perspectiva(
+        marker1_corners, marker2_corners, metros_por_pixel, imagen_shape
+    )
+    
+    # Medición por pose del marcador si el dispositivo tiene calibración
+    distancia_pnp_metros = None
+    if modelo_dispositivo:
+        tamano_deteccion = calcular_tamano_deteccion(imagen_shape[1], imagen_shape[0])
+        distancia_pnp_metros = calcular_distancia_pnp(
+            marker1_corners, marker2_corners, (tamano_lado1, tamano_lado2), modelo_dispositivo, tamano_deteccion
+        )
+    
+    # Calcular también distancia entre bordes externos para comparación
+    distancia_bordes_metros, edge1, edge2 = calcular_distancia_entre_bordes(
+        marker1_corners, marker2_corners, metros_por_pixel
+    )
+    
+    return {
+        "corners": corners,  # Todas las esquinas, en el orden de ids (punto de partida del seguimiento)
+        "ids": ids,
+        "ids_rechazados": ids_rechazados,
+        "metros_por_pixel": metros_por_pixel,
+        "lado_px": lado_px,
+        "marker1_corners": marker1_corners,
+        "marker2_corners": marker2_corners,
+        "puntos_medicion": puntos_medicion,
+        "edge1": edge1,
+        "edge2": edge2,
+        "distancia_multipunto_metros": distancia_multipunto_metros,
+        "distancia_centros_metros": distancia_centros_metros,
+        "distancia_perspectiva_metros": distancia_perspectiva_metros,
+        "distancia_bordes_metros": distancia_bordes_metros,
+        "distancia_pnp_metros": distancia_pnp_metros,
+        # Valor que alimenta el filtrado temporal
+        "distancia_referencia": distancia_pnp_metros if distancia_pnp_metros is not None else distancia_multipunto_metros,
+    }, None
+
+def filtrar_mediciones_temporales(nueva_medicion, ventana_tiempo=2.0, historial=None, tiempo_actual=None):
+    """
+    Filtra outliers y promedia mediciones temporales con algoritmo mejorado.
+    
+    Args:
+        nueva_medicion: Nueva medición a agregar
+        ventana_tiempo: Ventana de tiempo en segundos para considerar mediciones válidas
+        historial: Deque de mediciones a usar (por defecto el global del servidor)
+        tiempo_actual: Marca de tiempo de la medición (por defecto time.time())
+    
+    Returns:
+        medicion_filtrada: Medición filtrada y promediada
+        confianza: Nivel de confianza de la medición
+    """
+    global mediciones_previas, ultima_medicion_tiempo
+    
+    if historial is None:
+        historial = mediciones_previas
+    if tiempo_actual is None:
+        tiempo_actual = time.time()
+    
+    # Limpiar mediciones muy antiguas
+    while historial and (tiempo_actual - historial[0]['tiempo']) > ventana_tiempo:
+        historial.popleft()
+    
+    # Agregar nueva medición
+    historial.append({
+        'distancia': nueva_medicion,
+        'tiempo': tiempo_actual
+    })
+    
+    if len(historial) < 3:
+        # Si hay pocas mediciones, usar la más reciente
+        return nueva_medicion, 0.5
+    
+    # Extraer distancias y tiempos
+    distancias = [m['distancia'] for m in historial]
+    tiempos = [m['tiempo'] for m in historial]
+    
+    # Calcular estadísticas robustas
+    mediana = np.median(distancias)
+    mad = np.median(np.abs(distancias - mediana))  # Median Absolute Deviation
+    
+    # Usar MAD para detectar outliers (más robusto que desviación estándar)
+    umbral_outlier = 2.5 * mad
+    distancias_filtradas = [d for d in distancias if abs(d - mediana) <= umbral_outlier]
+    
+    if len(distancias_filtradas) == 0:
+        # Si todas son outliers, usar la mediana
+        medicion_filtrada = mediana
+        confianza = 0.3
+    else:
+        # Usar promedio ponderado por tiempo (mediciones más recientes tienen más peso)
+        pesos_tiempo = []
+        for t in tiempos:
+            # Peso basado en qué tan reciente es la medición
+            tiempo_relativo = tiempo_actual - t
+            peso = np.exp(-tiempo_relativo / ventana_tiempo)  # Decaimiento exponencial
+            pesos_tiempo.append(peso)
+        
+        # Normalizar pesos
+        pesos_tiempo = np.array(pesos_tiempo)
+        pesos_tiempo = pesos_tiempo / np.sum(pesos_tiempo)
+        
+        # Calcular promedio ponderado
+        medicion_filtrada = np.sum(np.array(distancias) * pesos_tiempo)
+        
+        # Calcular confianza basada en consistencia y número de mediciones
+        desviacion_filtrada = np.std(distancias_filtradas)
+        consistencia = 1.0 - (desviacion_filtrada / mediana) if mediana > 0 else 0.5
+        factor_muestras = min(1.0, len(distancias_filtradas) / 5.0)  # Más muestras = mayor confianza
+        
+        confianza = consistencia * factor_muestras
+        confianza = max(0.1, min(1.0, confianza))
+    
+    return medicion_filtrada, confianza
+
+def seleccionar_distancia(geometria, distancia_filtrada, confianza, num_mediciones_previas, incluir_debug=True):
+    """
+    Elige la distancia final según la confianza temporal y la consistencia entre métodos.
+    
+    Args:
+        geometria: Resultado de calcular_geometria_medicion
+        distancia_filtrada: Distancia devuelta por el filtrado temporal
+        confianza: Confianza del filtrado temporal
+        num_mediciones_previas: Mediciones en la ventana del filtro
+        incluir_debug: Si False no se construye debug_info (respuesta ligera)
+    
+    Returns:
+        distancia_final: Distancia elegida
+        metodo_usado: Nombre del método elegido
+        debug_info: Información para debugging y análisis, o None
+    """
+    distancia_centros_metros = geometria['distancia_centros_metros']
+    distancia_bordes_metros = geometria['distancia_bordes_metros']
+    distancia_multipunto_metros = geometria['distancia_multipunto_metros']
+    distancia_perspectiva_metros = geometria['distancia_perspectiva_metros']
+    distancia_pnp_metros = geometria['distancia_pnp_metros']
+    
+    # Calcular consistencia entre métodos
+    distancias_metodos = np.array([distancia_centros_metros, distancia_bordes_metros, distancia_multipunto_metros, distancia_perspectiva_metros])
+    desviacion_entre_metodos = float(distancias_metodos.std())
+    media_entre_metodos = float(distancias_metodos.mean())
+    consistencia_metodos = 1.0 - (desviacion_entre_metodos / media_entre_metodos) if media_entre_metodos > 0 else 0.5
+    
+    # Información adicional para debugging y análisis (solo si se pide)
+    debug_info = None
+    if incluir_debug:
+        debug_info = {
+            "lado_px": float(geometria['lado_px']),
+            "metros_por_pixel": float(geometria['metros_por_pixel']),
+            "distancia_centros_metros": float(distancia_centros_metros),
+            "distancia_bordes_metros": float(distancia_bordes_metros),
+            "distancia_multipunto_metros": float(distancia_multipunto_metros),
+            "distancia_perspectiva_metros": float(distancia_perspectiva_metros),
+            "distancia_filtrada_metros": float(distancia_filtrada),
+            "confianza_medicion": float(confianza),
+            "num_mediciones_previas": num_mediciones_previas,
+            "diferencia_centros_bordes": float(distancia_centros_metros - distancia_bordes_metros),
+            "diferencia_multipunto_bordes": float(distancia_multipunto_metros - distancia_bordes_metros),
+            "diferencia_perspectiva_bordes": float(distancia_perspectiva_metros - distancia_bordes_metros),
+            "ids_detectados": geometria['ids'].flatten().tolist(),
+            "ids_rechazados": geometria['ids_rechazados'],
+            "num_puntos_medicion": len(geometria['puntos_medicion']),
+            "desviacion_estandar": desviacion_entre_metodos,
+            "media_distancias": media_entre_metodos,
+            "distancia_pnp_metros": float(distancia_pnp_metros) if distancia_pnp_metros is not None else None
+        }
+    
+    # Selección inteligente del método
+    if distancia_pnp_metros is not None:
+        # Con intrínsecos calibrados la pose 3D no depende de la inclinación del teléfono
+        distancia_final = distancia_filtrada
+        metodo_usado = "pnp"
+    elif confianza > 0.8 and consistencia_metodos > 0.9:
+        # Alta confianza y alta consistencia: usar filtrado temporal
+        distancia_final = distancia_filtrada
+        metodo_usado = "filtrado_temporal"
+    elif confianza > 0.6 and consistencia_metodos > 0.7:
+        # Confianza media y buena consistencia: usar multipunto
+        distancia_final = distancia_multipunto_metros
+        metodo_usado = "multipunto"
+    elif consistencia_metodos > 0.5:
+        # Consistencia aceptable: usar perspectiva
+        distancia_final = distancia_perspectiva_metros
+        metodo_usado = "perspectiva"
+    else:
+        # Baja consistencia: usar bordes externos (más estable)
+        distancia_final = distancia_bordes_metros
+        metodo_usado = "bordes_externos"
+    
+    return distancia_final, metodo_usado, debug_info
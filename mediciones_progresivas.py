@@ -0,0 +1,133 @@
+# --- Medición progresiva: estimación preliminar inmediata y resultado refinado después ---
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config_optimizacion import CONFIG_PROGRESIVO, obtener_perfil
+from almacen_estado import leer, escribir
+
+INTERVALO_CONSULTA = 0.05  # Segundos entre consultas al almacén de un refinado de otro worker
+
+# Espacio del almacén (almacen_estado.py): medicion_id -> respuesta de la fase (pendiente, refinado o
+# descartado), para que la recoja cualquier worker
+ESPACIO_MEDICIONES = 'mediciones'
+
+# medicion_id -> {'evento', 'futuro'} de los refinados en cola o en curso en este proceso
+pendientes = {}
+_lock = threading.Lock()
+_executor = None
+_estadisticas = {'programadas': 0, 'refinadas': 0, 'descartadas': 0, 'suma_ms_cola': 0.0, 'suma_ms_refinado': 0.0}
+
+def progresivo_disponible():
+    """
+    True si la medición progresiva aporta algo con el perfil activo: si el perfil
+    activo es el mismo que el preliminar, la medición normal ya es la rápida.
+    """
+    return CONFIG_PROGRESIVO['HABILITADO'] and obtener_perfil() != CONFIG_PROGRESIVO['PERFIL_PRELIMINAR']
+
+def _obtener_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Un solo hilo: los refinados de una sesión entran en su filtro temporal en orden
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refinado')
+        return _executor
+
+def _guardar(medicion_id, respuesta):
+    escribir(ESPACIO_MEDICIONES, medicion_id, respuesta, CONFIG_PROGRESIVO['EXPIRACION'], CONFIG_PROGRESIVO['MAX_GUARDADAS'])
+
+def _descartar_pendiente_antigua():
+    """
+    Con la cola llena se descarta el refinado pendiente más antiguo que aún no
+    empezó: en tiempo real interesa más el frame nuevo que uno ya superado.
+    """
+    if len(pendientes) < CONFIG_PROGRESIVO['MAX_PENDIENTES']:
+        return None
+    for medicion_id, pendiente in pendientes.items():
+        if pendiente['futuro'].cancel():
+            pendientes.pop(medicion_id)
+            _estadisticas['descartadas'] += 1
+            return medicion_id, pendiente['evento']
+    return None
+
+def _ejecutar(medicion_id, refinar, encolada):
+    inicio = time.perf_counter()
+    try:
+        resultado = refinar()
+    except Exception as e:
+        print(f"Error en el refinado {medicion_id}: {str(e)}")
+        print(traceback.format_exc())
+        resultado = {"error": f"Error al procesar imagen: {str(e)}"}
+    _guardar(medicion_id, dict(resultado, fase="refinado", medicion_id=medicion_id))
+    with _lock:
+        _estadisticas['refinadas'] += 1
+        _estadisticas['suma_ms_cola'] += (inicio - encolada) * 1000
+        _estadisticas['suma_ms_refinado'] += (time.perf_counter() - inicio) * 1000
+        pendientes.pop(medicion_id)['evento'].set()
+
+def programar_refinado(refinar):
+    """
+    Pone en cola el refinado de un frame ya medido en su fase preliminar.
+
+    Args:
+        refinar: Función sin argumentos que mide el frame con el perfil refinado y
+            devuelve el resultado (se ejecuta en el hilo de refinado)
+
+    Returns:
+        medicion_id: Identificador con el que se recoge el resultado refinado
+    """
+    medicion_id = uuid.uuid4().hex
+    executor = _obtener_executor()
+    _guardar(medicion_id, {"success": True, "fase": "pendiente", "medicion_id": medicion_id})
+    with _lock:
+        descartada = _descartar_pendiente_antigua()
+        pendiente = {'evento': threading.Event()}
+        pendientes[medicion_id] = pendiente
+        pendiente['futuro'] = executor.submit(_ejecutar, medicion_id, refinar, time.perf_counter())
+        _estadisticas['programadas'] += 1
+    if descartada is not None:
+        id_descartada, evento = descartada
+        _guardar(id_descartada, {"error": "Refinado descartado: llegaron frames más nuevos",
+                                 "fase": "descartado", "medicion_id": id_descartada})
+        evento.set()
+    return medicion_id
+
+def obtener_medicion(medicion_id, espera=0.0):
+    """
+    Resultado refinado de una medición, esperando como mucho 'espera' segundos
+    (acotados por ESPERA_MAX) si aún está pendiente. Si se refina en otro
+    worker, se consulta el almacén compartido cada INTERVALO_CONSULTA segundos.
+
+    Returns:
+        dict: Resultado refinado, {'fase': 'pendiente'}, un error si se descartó,
+            o None si la medición no existe o expiró
+    """
+    limite = time.monotonic() + max(0.0, min(espera, CONFIG_PROGRESIVO['ESPERA_MAX']))
+    with _lock:
+        pendiente = pendientes.get(medicion_id)
+    if pendiente is not None:
+        pendiente['evento'].wait(max(0.0, limite - time.monotonic()))
+    while True:
+        respuesta = leer(ESPACIO_MEDICIONES, medicion_id)
+        if respuesta is None or respuesta['fase'] != 'pendiente' or time.monotonic() >= limite:
+            return respuesta
+        time.sleep(INTERVALO_CONSULTA)
+
+def estado_progresivas():
+    """
+    Refinados programados, completados y descartados en este proceso, y tiempos
+    medios en cola y de refinado.
+    """
+    with _lock:
+        refinadas = _estadisticas['refinadas']
+        return {
+            "disponible": progresivo_disponible(),
+            "perfil_preliminar": CONFIG_PROGRESIVO['PERFIL_PRELIMINAR'],
+            "programadas": _estadisticas['programadas'],
+            "refinadas": refinadas,
+            "descartadas": _estadisticas['descartadas'],
+            "pendientes": len(pendientes),
+            "media_ms_cola": round(_estadisticas['suma_ms_cola'] / refinadas, 3) if refinadas else None,
+            "media_ms_refinado": round(_estadisticas['suma_ms_refinado'] / refinadas, 3) if refinadas else None,
+        }
@@ -0,0 +1,173 @@
+# --- Memoria por petición: pico con tracemalloc y tamaño de los arrays intermedios ---
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+from config_optimizacion import CONFIG_MEMORIA
+
+TOP_DIFERENCIAS = 20
+# Reservas que no son de la aplicación (el propio rastreo e importaciones)
+FILTROS_INSTANTANEA = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+_local = threading.local()
+_lock = threading.Lock()
+_activas = []  # Mediciones en curso en este proceso
+_picos_kb = deque(maxlen=CONFIG_MEMORIA['MAX_PETICIONES'])
+_arrays_kb = {}  # nombre -> [suma, máximo, veces]
+_estadisticas = {'peticiones': 0, 'concurrentes': 0}
+_instantanea_base = None
+
+if CONFIG_MEMORIA['HABILITADO'] and not tracemalloc.is_tracing():
+    # numpy y OpenCV (vía el asignador de numpy) informan a tracemalloc de sus buffers
+    tracemalloc.start(CONFIG_MEMORIA['MARCOS'])
+
+def anotar_array(nombre, valor):
+    """
+    Anota el tamaño de un array o buffer de la petición en curso. Sin medición
+    activa no hace nada.
+
+    Args:
+        nombre: Nombre de la copia ('base64', 'jpeg', 'imagen', 'gris'...)
+        valor: Array de numpy, bytes o str
+    """
+    memoria = getattr(_local, 'memoria', None)
+    if memoria is None or valor is None:
+        return
+    nbytes = valor.nbytes if isinstance(valor, np.ndarray) else len(valor)
+    # Un mismo nombre pedido dos veces es el mismo buffer: se guarda el mayor
+    memoria['arrays'][nombre] = max(memoria['arrays'].get(nombre, 0), nbytes)
+
+@contextmanager
+def medir_memoria():
+    """
+    Mide la memoria de la petición del bloque `with`: el pico de memoria de
+    Python (incluidos los arrays de numpy y OpenCV) sobre la de partida, la
+    memoria que sigue reservada al salir y los arrays anotados con anotar_array.
+
+    El pico de tracemalloc es del proceso: si otra petición se solapa, la
+    medición se marca como 'concurrente' y su pico incluye a las dos.
+
+    Yields:
+        dict: Se completa al salir del bloque, o None si el rastreo está desactivado
+    """
+    if not tracemalloc.is_tracing():
+        yield None
+        return
+
+    memoria = {'arrays': {}, 'concurrente': False}
+    with _lock:
+        if _activas:
+            for otra in _activas:
+                otra['concurrente'] = True
+            memoria['concurrente'] = True
+        else:
+            tracemalloc.reset_peak()
+        _activas.append(memoria)
+        base = tracemalloc.get_traced_memory()[0]
+    _local.memoria = memoria
+    try:
+        yield memoria
+    finally:
+        _local.memoria = None
+        actual, pico = tracemalloc.get_traced_memory()
+        with _lock:
+            _activas.remove(memoria)
+            pico_kb = (pico - base) / 1024
+            memoria['pico_kb'] = round(pico_kb, 1)
+            memoria['retenido_kb'] = round((actual - base) / 1024, 1)
+            memoria['arrays_kb'] = {nombre: round(nbytes / 1024, 1) for nombre, nbytes in memoria.pop('arrays').items()}
+            memoria['arrays_total_kb'] = round(sum(memoria['arrays_kb'].values()), 1)
+
+            _estadisticas['peticiones'] += 1
+            if memoria['concurrente']:
+                _estadisticas['concurrentes'] += 1
+            else:
+                # Solo los picos aislados sirven para dimensionar por petición
+                _picos_kb.append(pico_kb)
+            for nombre, kb in memoria['arrays_kb'].items():
+                acumulado = _arrays_kb.setdefault(nombre, [0.0, 0.0, 0])
+                acumulado[0] += kb
+                acumulado[1] = max(acumulado[1], kb)
+                acumulado[2] += 1
+
+def adjuntar_memoria(resultado, memoria):
+    """
+    Añade la medición de memoria al debug_info del resultado (si hubo medición).
+    """
+    if memoria is not None and 'pico_kb' in memoria:
+        resultado.setdefault('debug_info', {})['memoria'] = memoria
+    return resultado
+
+def estado_memoria():
+    """
+    Picos de memoria por petición (media, p95 y máximo de las peticiones no
+    solapadas), tamaño medio y máximo de cada array y memoria rastreada del proceso.
+    """
+    if not tracemalloc.is_tracing():
+        return {"habilitado": False}
+    with _lock:
+        picos = np.array(_picos_kb) if _picos_kb else None
+        arrays = {
+            nombre: {"medio_kb": round(suma / veces, 1), "max_kb": round(maximo, 1)}
+            for nombre, (suma, maximo, veces) in sorted(_arrays_kb.items(), key=lambda e: -e[1][1])
+        }
+        estadisticas = dict(_estadisticas)
+    actual, pico = tracemalloc.get_traced_memory()
+    return dict(estadisticas, **{
+        "habilitado": True,
+        "pico_kb_medio": round(float(picos.mean()), 1) if picos is not None else None,
+        "pico_kb_p95": round(float(np.percentile(picos, 95)), 1) if picos is not None else None,
+        "pico_kb_max": round(float(picos.max()), 1) if picos is not None else None,
+        "arrays": arrays,
+        "rastreado_mb": round(actual / 1e6, 2),
+        "coste_rastreo_mb": round(tracemalloc.get_tracemalloc_memory() / 1e6, 2),
+    })
+
+def tomar_instantanea_base():
+    """
+    Guarda una instantánea de la memoria del proceso como referencia para
+    diferencias_instantanea. ValueError si el rastreo está desactivado.
+    """
+    global _instantanea_base
+    if not tracemalloc.is_tracing():
+        raise ValueError("El rastreo de memoria está desactivado. Arranca el servidor con MEMORIA_RASTREO=1.")
+    _instantanea_base = tracemalloc.take_snapshot().filter_traces(FILTROS_INSTANTANEA)
+    return {"rastreado_mb": round(sum(t.size for t in _instantanea_base.traces) / 1e6, 2)}
+
+def diferencias_instantanea(top=TOP_DIFERENCIAS, agrupar='lineno'):
+    """
+    Compara la memoria actual con la instantánea base: las líneas que más
+    memoria han ganado desde entonces son las candidatas a fuga.
+
+    Args:
+        top: Número de entradas devueltas
+        agrupar: 'lineno', 'filename' o 'traceback'
+
+    Returns:
+        dict: Crecimiento total y las entradas con más crecimiento
+    """
+    if _instantanea_base is None:
+        raise ValueError("No hay instantánea base. Tómala antes con POST /memoria/instantanea.")
+    if agrupar not in ('lineno', 'filename', 'traceback'):
+        raise ValueError("agrupar debe ser 'lineno', 'filename' o 'traceback'")
+    actual = tracemalloc.take_snapshot().filter_traces(FILTROS_INSTANTANEA)
+    diferencias = actual.compare_to(_instantanea_base, agrupar)
+    return {
+        "crecimiento_kb": round(sum(d.size_diff for d in diferencias) / 1024, 1),
+        "bloques_nuevos": sum(d.count_diff for d in diferencias),
+        "top": [
+            {
+                "origen": [f"{marco.filename.rsplit('/', 1)[-1]}:{marco.lineno}" for marco in d.traceback],
+                "crecimiento_kb": round(d.size_diff / 1024, 1),
+                "total_kb": round(d.size / 1024, 1),
+                "bloques_nuevos": d.count_diff,
+            }
+            for d in diferencias[:top]
+        ],
+    }
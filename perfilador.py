@@ -0,0 +1,293 @@
+# --- Perfilador bajo demanda para workers en producción ---
+import hmac
+import sys
+import time
+import marshal
+import threading
+import cProfile
+import pstats
+from collections import Counter
+from config_optimizacion import CONFIG_PERFILADOR
+
+# cprofile: todas las llamadas de Python (coste alto, tiempos exactos)
+# muestreo: pilas de los hilos perfilados cada INTERVALO_MUESTREO_MS (coste bajo, salida para flamegraph)
+MODOS_PERFILADOR = ('cprofile', 'muestreo')
+
+# Funciones del pipeline que siempre aparecen en el resumen
+FUNCIONES_CLAVE = (
+    'mejorar_deteccion_aruco', 'detectar_esquinas_subpixel', 'refinar_esquinas',
+    'filtrar_mediciones_temporales', 'generar_visualizacion_medicion_optimizada',
+)
+PREFIJOS_CLAVE = ('calcular_',)
+TOP_FUNCIONES = 20
+
+class SesionPerfilado:
+    """
+    Perfilado de las próximas `max_peticiones` peticiones o de los próximos
+    `segundos`, lo que ocurra antes.
+    """
+
+    def __init__(self, modo, max_peticiones, segundos, rutas):
+        self.modo = modo
+        self.max_peticiones = max_peticiones
+        self.segundos = segundos
+        self.rutas = rutas
+        self.inicio = time.time()
+        self.fin = None
+        self.perfiladas = 0
+        self.omitidas = 0  # Otro perfilador activo en el proceso (cprofile)
+        self.estadisticas = None  # pstats.Stats acumulado (cprofile)
+        self.pilas = Counter()  # "a;b;c" -> muestras (muestreo)
+        self.muestras = 0
+        self.hilos = set()  # Hilos con una petición perfilada en curso
+        self.lock = threading.Lock()
+
+    @property
+    def activa(self):
+        return self.fin is None
+
+    def reservar(self):
+        """
+        Reserva una de las peticiones de la sesión; False si ya no quedan.
+        """
+        with self.lock:
+            if not self.activa or self.perfiladas >= self.max_peticiones:
+                return False
+            self.perfiladas += 1
+            return True
+
+_sesion = None  # Sesión activa o la última terminada (para descargar sus resultados)
+_lock = threading.Lock()
+_app = None
+_wsgi_original = None  # app.wsgi_app sin el middleware mientras hay una sesión activa
+
+def comprobar_token(token):
+    """
+    Mensaje de error si el token de administración no es válido, o None.
+    """
+    esperado = CONFIG_PERFILADOR['TOKEN']
+    if esperado is None:
+        return "Las rutas de administración están desactivadas. Define PERFILADOR_TOKEN para usarlas."
+    if not token or not hmac.compare_digest(token.encode(), esperado.encode()):
+        return "Token de administración no válido"
+    return None
+
+def _perfilar_cprofile(sesion, wsgi_app, environ, start_response):
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Otro perfilador ya está activo en este hilo o proceso
+        with sesion.lock:
+            sesion.omitidas += 1
+        return wsgi_app(environ, start_response)
+    try:
+        return wsgi_app(environ, start_response)
+    finally:
+        perfil.disable()
+        with sesion.lock:
+            if sesion.estadisticas is None:
+                sesion.estadisticas = pstats.Stats(perfil)
+            else:
+                sesion.estadisticas.add(perfil)
+
+def _perfilar_muestreo(sesion, wsgi_app, environ, start_response):
+    hilo = threading.get_ident()
+    with sesion.lock:
+        sesion.hilos.add(hilo)
+    try:
+        return wsgi_app(environ, start_response)
+    finally:
+        with sesion.lock:
+            sesion.hilos.discard(hilo)
+
+def _middleware(wsgi_app, sesion):
+    """
+    Envuelve la aplicación WSGI mientras dura la sesión; fuera de ella no se
+    instala, así que el perfilador apagado no añade ningún coste.
+    """
+    perfilar = _perfilar_cprofile if sesion.modo == 'cprofile' else _perfilar_muestreo
+
+    def aplicacion(environ, start_response):
+        ruta = environ.get('PATH_INFO', '')
+        if ruta.startswith('/perfilador') or not ruta.startswith(sesion.rutas) or not sesion.reservar():
+            return wsgi_app(environ, start_response)
+        try:
+            return perfilar(sesion, wsgi_app, environ, start_response)
+        finally:
+            if sesion.perfiladas >= sesion.max_peticiones:
+                _detener(sesion)
+
+    return aplicacion
+
+def _pila(frame):
+    partes = []
+    while frame is not None:
+        codigo = frame.f_code
+        partes.append(f"{codigo.co_filename.rsplit('/', 1)[-1]}:{codigo.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(partes))
+
+def _bucle_muestreo(sesion):
+    intervalo = CONFIG_PERFILADOR['INTERVALO_MUESTREO_MS'] / 1000
+    while sesion.activa:
+        time.sleep(intervalo)
+        with sesion.lock:
+            hilos = list(sesion.hilos)
+        if not hilos:
+            continue
+        frames = sys._current_frames()
+        pilas = [_pila(frames[hilo]) for hilo in hilos if hilo in frames]
+        with sesion.lock:
+            sesion.pilas.update(pilas)
+            sesion.muestras += len(pilas)
+
+def _detener(sesion):
+    global _wsgi_original
+    with _lock:
+        if not sesion.activa:
+            return
+        sesion.fin = time.time()
+        if _sesion is sesion and _wsgi_original is not None:
+            _app.wsgi_app = _wsgi_original
+            _wsgi_original = None
+
+def iniciar_perfilado(app, modo='cprofile', peticiones=50, segundos=60, rutas=('/detectar_aruco', '/sesiones')):
+    """
+    Empieza a perfilar las próximas peticiones de este worker.
+
+    Args:
+        app: Aplicación Flask
+        modo: Uno de MODOS_PERFILADOR
+        peticiones: Peticiones a perfilar como máximo
+        segundos: Duración máxima de la sesión
+        rutas: Prefijos de las rutas que se perfilan
+
+    Returns:
+        dict: Estado de la sesión (ValueError si ya hay una activa o los parámetros no son válidos)
+    """
+    global _sesion, _wsgi_original, _app
+    if modo not in MODOS_PERFILADOR:
+        raise ValueError(f"Modo no válido: {modo}. Usa: {', '.join(MODOS_PERFILADOR)}")
+    if not 0 < peticiones <= CONFIG_PERFILADOR['MAX_PETICIONES']:
+        raise ValueError(f"peticiones debe estar entre 1 y {CONFIG_PERFILADOR['MAX_PETICIONES']}")
+    if not 0 < segundos <= CONFIG_PERFILADOR['MAX_SEGUNDOS']:
+        raise ValueError(f"segundos debe estar entre 0 y {CONFIG_PERFILADOR['MAX_SEGUNDOS']:g}")
+
+    with _lock:
+        if _sesion is not None and _sesion.activa:
+            raise ValueError("Ya hay una sesión de perfilado activa en este worker")
+        sesion = SesionPerfilado(modo, int(peticiones), float(segundos), tuple(rutas))
+        _sesion = sesion
+        _app = app
+        _wsgi_original = app.wsgi_app
+        app.wsgi_app = _middleware(_wsgi_original, sesion)
+
+    temporizador = threading.Timer(sesion.segundos, _detener, args=(sesion,))
+    temporizador.daemon = True
+    temporizador.start()
+    if modo == 'muestreo':
+        threading.Thread(target=_bucle_muestreo, args=(sesion,), daemon=True).start()
+    return estado_perfilado()
+
+def detener_perfilado():
+    """
+    Termina la sesión activa (sus resultados siguen disponibles).
+    """
+    if _sesion is not None:
+        _detener(_sesion)
+    return estado_perfilado()
+
+def _es_clave(funcion):
+    return funcion in FUNCIONES_CLAVE or funcion.startswith(PREFIJOS_CLAVE)
+
+def _resumen_cprofile(sesion):
+    if sesion.estadisticas is None:
+        return {"funciones_clave": {}, "top": []}
+    entradas = sesion.estadisticas.stats  # (archivo, línea, función) -> (cc, nc, tt, ct, llamadores)
+    peticiones = max(sesion.perfiladas - sesion.omitidas, 1)
+    clave = {}
+    for (archivo, linea, funcion), (_, llamadas, propio, acumulado, _) in entradas.items():
+        if _es_clave(funcion):
+            clave[funcion] = {
+                "llamadas": llamadas,
+                "ms_propio": round(propio * 1000, 2),
+                "ms_acumulado": round(acumulado * 1000, 2),
+                "ms_por_peticion": round(acumulado * 1000 / peticiones, 2),
+            }
+    top = sorted(entradas.items(), key=lambda e: e[1][3], reverse=True)[:TOP_FUNCIONES]
+    return {
+        "funciones_clave": clave,
+        "top": [
+            {"funcion": f"{archivo.rsplit('/', 1)[-1]}:{linea}({funcion})", "llamadas": datos[1],
+             "ms_propio": round(datos[2] * 1000, 2), "ms_acumulado": round(datos[3] * 1000, 2)}
+            for (archivo, linea, funcion), datos in top
+        ],
+    }
+
+def _resumen_muestreo(sesion):
+    intervalo = CONFIG_PERFILADOR['INTERVALO_MUESTREO_MS']
+    inclusivas = Counter()
+    propias = Counter()
+    for pila, muestras in sesion.pilas.items():
+        funciones = pila.split(';')
+        propias[funciones[-1]] += muestras
+        for funcion in set(funciones):
+            inclusivas[funcion] += muestras
+    total = max(sesion.muestras, 1)
+    return {
+        "muestras": sesion.muestras,
+        "funciones_clave": {
+            funcion.split(':', 1)[1]: {
+                "fraccion": round(muestras / total, 3),
+                "ms_estimados": round(muestras * intervalo, 1),
+            }
+            for funcion, muestras in inclusivas.items() if _es_clave(funcion.split(':', 1)[1])
+        },
+        "top": [
+            {"funcion": funcion, "fraccion_propia": round(muestras / total, 3)}
+            for funcion, muestras in propias.most_common(TOP_FUNCIONES)
+        ],
+    }
+
+def estado_perfilado():
+    """
+    Estado de la sesión de perfilado de este worker y resumen de sus resultados.
+    """
+    sesion = _sesion
+    if sesion is None:
+        return {"activa": False, "sesion": None}
+    with sesion.lock:
+        resumen = _resumen_cprofile(sesion) if sesion.modo == 'cprofile' else _resumen_muestreo(sesion)
+    return dict(resumen, **{
+        "activa": sesion.activa,
+        "modo": sesion.modo,
+        "rutas": list(sesion.rutas),
+        "peticiones_perfiladas": sesion.perfiladas,
+        "peticiones_omitidas": sesion.omitidas,
+        "max_peticiones": sesion.max_peticiones,
+        "segundos": round((sesion.fin or time.time()) - sesion.inicio, 1),
+    })
+
+def exportar_perfil():
+    """
+    Resultados de la última sesión para descargar.
+
+    Returns:
+        (contenido, nombre_archivo, tipo_mime) o None si no hay resultados. cprofile
+        produce un .pstats (pstats, snakeviz, gprof2dot); muestreo, pilas plegadas
+        (flamegraph.pl, speedscope, inferno)
+    """
+    sesion = _sesion
+    if sesion is None:
+        return None
+    with sesion.lock:
+        if sesion.modo == 'cprofile':
+            if sesion.estadisticas is None:
+                return None
+            # Mismo formato que pstats.Stats.dump_stats
+            return marshal.dumps(sesion.estadisticas.stats), 'perfil.pstats', 'application/octet-stream'
+        if not sesion.pilas:
+            return None
+        lineas = [f"{pila} {muestras}" for pila, muestras in sesion.pilas.most_common()]
+    return ("\n".join(lineas) + "\n").encode('utf-8'), 'perfil.folded', 'text/plain'
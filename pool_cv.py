@@ -0,0 +1,321 @@
+# --- Pool de procesos de visión con entrega de frames por memoria compartida ---
+import atexit
+import itertools
+import queue
+import threading
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from config_optimizacion import CONFIG_POOL_CV, obtener_perfil
+
+# Etapas de las que se guardan tiempos
+ETAPAS = ('espera_ranura', 'copia', 'cola', 'deteccion', 'geometria', 'total')
+
+INTERVALO_VIGILANCIA = 1.0  # Segundos sin resultados tras los que se comprueba si algún trabajador murió
+
+# Estado del pool en el proceso web (se crea de forma perezosa)
+_pool = None
+_pool_lock = threading.Lock()
+
+def _adjuntar_ranura(nombre):
+    """
+    Abre una ranura del proceso web sin registrarla en el resource_tracker.
+    SharedMemory la registra también al adjuntarse: el tracker avisaría de
+    fugas y podría borrarla al salir el trabajador mientras el proceso web la
+    sigue usando. Tampoco vale anular el registro después (unregister), porque
+    con 'spawn' el tracker es el del proceso web y se borraría su propio
+    registro. El trabajador arranca con un solo hilo, así que el cambio
+    temporal de register no afecta a nadie más.
+    """
+    registrar = resource_tracker.register
+    resource_tracker.register = lambda nombre_recurso, tipo: None
+    try:
+        return shared_memory.SharedMemory(name=nombre)
+    finally:
+        resource_tracker.register = registrar
+
+def _bucle_trabajador(nombres_ranuras, cola_tareas, cola_resultados):
+    """
+    Proceso de visión: lee el frame de la ranura compartida, detecta y calcula
+    la geometría, y devuelve solo el resultado compacto.
+    """
+    from config_optimizacion import cambiar_configuracion
+    from medicion_marcadores import mejorar_deteccion_aruco, calcular_geometria_medicion
+
+    ranuras = [_adjuntar_ranura(nombre) for nombre in nombres_ranuras]
+    perfil_actual = None
+
+    while True:
+        tarea = cola_tareas.get()
+        if tarea is None:
+            break
+
+        id_tarea, indice_ranura, forma, dtype, tamano_lado, modelo_dispositivo, perfil, encolada = tarea
+        tiempos = {'cola': (time.time() - encolada) * 1000}
+        try:
+            if perfil != perfil_actual:
+                cambiar_configuracion(perfil)
+                perfil_actual = perfil
+
+            # Vista sin copia sobre la memoria compartida
+            img = np.ndarray(forma, dtype=dtype, buffer=ranuras[indice_ranura].buf)
+
+            inicio = time.perf_counter()
+            corners, ids = mejorar_deteccion_aruco(img)
+            tiempos['deteccion'] = (time.perf_counter() - inicio) * 1000
+            del img
+
+            if ids is None or len(ids) < 2:
+                resultado = (None, "Se necesitan al menos 2 códigos ArUco para medir. Asegúrate de que ambos marcadores sean completamente visibles y estén bien iluminados.")
+            else:
+                inicio = time.perf_counter()
+                resultado = calcular_geometria_medicion(corners, ids, tamano_lado, forma, modelo_dispositivo)
+                tiempos['geometria'] = (time.perf_counter() - inicio) * 1000
+        except Exception as e:
+            resultado = (None, f"Error al procesar imagen: {str(e)}")
+
+        cola_resultados.put((id_tarea, resultado, tiempos))
+
+    for ranura in ranuras:
+        ranura.close()
+
+class _PoolCV:
+    """
+    Pool de trabajadores con ranuras de memoria compartida reutilizadas.
+    La cantidad de ranuras limita los frames en vuelo (profundidad de cola).
+    Cada trabajador tiene su propia cola de tareas: así se sabe qué tareas
+    (y qué ranuras) tenía un trabajador que muere, para recuperarlas y
+    sustituirlo por otro.
+    """
+
+    def __init__(self, config):
+        self.contexto = mp.get_context('spawn')
+        self.tamano_ranura = config['TAMANO_RANURA']
+        self.tiempo_espera = config['TIEMPO_ESPERA']
+
+        self.ranuras = [
+            shared_memory.SharedMemory(create=True, size=self.tamano_ranura)
+            for _ in range(config['PROFUNDIDAD_COLA'])
+        ]
+        self.ranuras_libres = queue.Queue()
+        for indice in range(len(self.ranuras)):
+            self.ranuras_libres.put(indice)
+
+        self.cola_resultados = self.contexto.Queue()
+        self.pendientes = {}  # id_tarea -> [evento, resultado, tiempos] de las peticiones que esperan
+        self.en_curso = {}  # id_tarea -> (indice_trabajador, indice_ranura) hasta que llega su resultado
+        self.contador = itertools.count()
+        self.lock = threading.Lock()
+        self.metricas = {etapa: {'cantidad': 0, 'suma_ms': 0.0, 'max_ms': 0.0} for etapa in ETAPAS}
+        self.completadas = 0
+        self.expiradas = 0
+        self.reiniciados = 0
+        self.cerrando = False
+
+        self.trabajadores = [None] * config['TRABAJADORES']
+        self.colas_tareas = [None] * config['TRABAJADORES']
+        for indice in range(config['TRABAJADORES']):
+            self._arrancar_trabajador(indice)
+
+        self.hilo_resultados = threading.Thread(target=self._recoger_resultados, daemon=True)
+        self.hilo_resultados.start()
+
+    def _arrancar_trabajador(self, indice):
+        # Cola nueva: la del trabajador anterior puede haber quedado a medio leer
+        cola_tareas = self.contexto.Queue()
+        trabajador = self.contexto.Process(
+            target=_bucle_trabajador, args=([r.name for r in self.ranuras], cola_tareas, self.cola_resultados),
+            daemon=True
+        )
+        trabajador.start()
+        self.trabajadores[indice], self.colas_tareas[indice] = trabajador, cola_tareas
+
+    def _entregar(self, id_tarea, resultado, tiempos):
+        """
+        Entrega el resultado de una tarea a la petición que lo espera (si no
+        expiró) y devuelve su ranura al pool: el trabajador ya no la usa.
+        """
+        # Bajo el lock: procesar decide con él si una tarea expiró o llegó a tiempo
+        with self.lock:
+            _, indice_ranura = self.en_curso.pop(id_tarea, (None, None))
+            pendiente = self.pendientes.get(id_tarea)
+            if pendiente is not None:
+                pendiente[1] = resultado
+                pendiente[2] = tiempos
+                pendiente[0].set()
+        if indice_ranura is not None:
+            self.ranuras_libres.put(indice_ranura)
+
+    def _vigilar_trabajadores(self):
+        """
+        Sustituye a los trabajadores que murieron (p. ej. por falta de memoria o
+        un fallo de OpenCV) y da por fallidas sus tareas, liberando sus ranuras.
+        """
+        for indice, trabajador in enumerate(self.trabajadores):
+            if self.cerrando or trabajador.is_alive():
+                continue
+            with self.lock:
+                perdidas = [id_tarea for id_tarea, (asignado, _) in self.en_curso.items() if asignado == indice]
+                self.reiniciados += 1
+                self._arrancar_trabajador(indice)
+            print(f"Trabajador de visión {indice} terminado (código {trabajador.exitcode}); "
+                  f"reiniciado con {len(perdidas)} tareas perdidas")
+            for id_tarea in perdidas:
+                self._entregar(id_tarea, (None, "El proceso de visión terminó inesperadamente, intenta de nuevo."), {})
+
+    def _recoger_resultados(self):
+        while True:
+            try:
+                mensaje = self.cola_resultados.get(timeout=INTERVALO_VIGILANCIA)
+            except queue.Empty:
+                self._vigilar_trabajadores()
+                continue
+            except (OSError, EOFError):
+                if self.cerrando:
+                    break  # Cola cerrada al salir el intérprete
+                raise
+            if mensaje is None:
+                break
+            self._entregar(*mensaje)
+
+    def _registrar(self, tiempos):
+        with self.lock:
+            self.completadas += 1
+            for etapa, ms in tiempos.items():
+                metrica = self.metricas[etapa]
+                metrica['cantidad'] += 1
+                metrica['suma_ms'] += ms
+                metrica['max_ms'] = max(metrica['max_ms'], ms)
+
+    def procesar(self, img, tamano_lado, modelo_dispositivo=None):
+        inicio_total = time.perf_counter()
+
+        # Esperar una ranura libre (contrapresión cuando la cola está llena)
+        try:
+            indice_ranura = self.ranuras_libres.get(timeout=self.tiempo_espera)
+        except queue.Empty:
+            return (None, "El servidor está ocupado, intenta de nuevo."), {}
+        tiempos = {'espera_ranura': (time.perf_counter() - inicio_total) * 1000}
+
+        id_tarea = next(self.contador)
+        pendiente = [threading.Event(), None, None]
+        try:
+            inicio = time.perf_counter()
+            destino = np.ndarray(img.shape, dtype=img.dtype, buffer=self.ranuras[indice_ranura].buf)
+            np.copyto(destino, img)
+            del destino
+            tiempos['copia'] = (time.perf_counter() - inicio) * 1000
+        except Exception:
+            self.ranuras_libres.put(indice_ranura)
+            raise
+
+        with self.lock:
+            # Al trabajador con menos tareas en curso
+            carga = [0] * len(self.trabajadores)
+            for asignado, _ in self.en_curso.values():
+                carga[asignado] += 1
+            indice_trabajador = carga.index(min(carga))
+            self.pendientes[id_tarea] = pendiente
+            self.en_curso[id_tarea] = (indice_trabajador, indice_ranura)
+            self.colas_tareas[indice_trabajador].put((
+                id_tarea, indice_ranura, img.shape, img.dtype.str, tamano_lado,
+                modelo_dispositivo, obtener_perfil(), time.time()
+            ))
+
+        try:
+            if not pendiente[0].wait(self.tiempo_espera):
+                with self.lock:
+                    # Se comprueba de nuevo bajo el lock por si el resultado llegó justo tras la espera
+                    if not pendiente[0].is_set():
+                        # La ranura sigue en uso por el trabajador: _entregar la devuelve
+                        # al pool cuando llegue el resultado tardío o muera el trabajador
+                        self.expiradas += 1
+                        return (None, "Tiempo de espera agotado procesando la imagen."), tiempos
+            tiempos.update(pendiente[2])
+        finally:
+            with self.lock:
+                self.pendientes.pop(id_tarea, None)
+
+        tiempos['total'] = (time.perf_counter() - inicio_total) * 1000
+        self._registrar(tiempos)
+        return pendiente[1], tiempos
+
+    def estado(self):
+        with self.lock:
+            return {
+                "trabajadores": len(self.trabajadores),
+                "trabajadores_vivos": sum(t.is_alive() for t in self.trabajadores),
+                "trabajadores_reiniciados": self.reiniciados,
+                "profundidad_cola": len(self.ranuras),
+                "ranuras_libres": self.ranuras_libres.qsize(),
+                "tareas_en_curso": len(self.en_curso),
+                "tamano_ranura": self.tamano_ranura,
+                "completadas": self.completadas,
+                "expiradas": self.expiradas,
+                "etapas": {
+                    etapa: {
+                        "cantidad": m['cantidad'],
+                        "media_ms": round(m['suma_ms'] / m['cantidad'], 2) if m['cantidad'] else 0.0,
+                        "max_ms": round(m['max_ms'], 2),
+                    }
+                    for etapa, m in self.metricas.items()
+                },
+            }
+
+    def cerrar(self):
+        self.cerrando = True
+        for cola_tareas in self.colas_tareas:
+            cola_tareas.put(None)
+        for trabajador in self.trabajadores:
+            trabajador.join(timeout=2)
+            if trabajador.is_alive():
+                trabajador.terminate()
+        self.cola_resultados.put(None)
+        self.hilo_resultados.join(timeout=2)
+        for ranura in self.ranuras:
+            ranura.close()
+            ranura.unlink()
+
+def pool_habilitado():
+    """
+    Indica si el trabajo de visión debe enviarse al pool de procesos.
+    """
+    return CONFIG_POOL_CV['HABILITADO']
+
+def obtener_pool():
+    """
+    Devuelve el pool del proceso actual, creándolo la primera vez.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _PoolCV(CONFIG_POOL_CV)
+            atexit.register(_pool.cerrar)
+        return _pool
+
+def procesar_en_pool(img, tamano_lado, modelo_dispositivo=None):
+    """
+    Ejecuta detección y geometría en el pool de visión. El frame se copia a una
+    ranura de memoria compartida y solo viajan los metadatos (no se serializa).
+
+    Args:
+        img: Imagen decodificada (array numpy)
+        tamano_lado: Tamaño real del lado en metros
+        modelo_dispositivo: Modelo con calibración de cámara (opcional)
+
+    Returns:
+        (geometria, error): Igual que calcular_geometria_medicion, o None si el
+        frame no cabe en una ranura (el llamador debe procesarlo localmente)
+        tiempos: Milisegundos por etapa
+    """
+    pool = obtener_pool()
+    if img.nbytes > pool.tamano_ranura:
+        return None, {}
+    return pool.procesar(img, tamano_lado, modelo_dispositivo)
+
+def estado_pool():
+    """
+    Métricas del pool de visión (None si no se ha iniciado).
+    """
+    return _pool.estado() if _pool is not None else None
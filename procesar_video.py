@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Procesa videos grabados (o carpetas de imágenes) sin pasar por el servidor web.
+
+Pipeline por generadores:
+    lectura -> decodificación -> mejorar_deteccion_aruco -> geometría -> filtrado temporal -> CSV/JSONL
+
+La detección y la geometría se ejecutan por bloques en un pool de procesos; los
+resultados se consumen en orden para que el filtrado temporal vea los frames en secuencia.
+
+Uso:
+    python procesar_video.py recorrido.mp4 -o resultados.csv
+    python procesar_video.py carpeta_fotos/ -o resultados.jsonl --perfil precision --fps 2
+"""
+
+import os
+import csv
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+
+EXTENSIONES_IMAGEN = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+CAMPOS_SALIDA = [
+    'frame', 'tiempo_s', 'exito', 'error', 'distancia', 'distancia_filtrada', 'confianza',
+    'metodo_usado', 'metros_por_pixel', 'ids_detectados',
+    'ms_decodificacion', 'ms_deteccion', 'ms_geometria', 'ms_filtrado',
+]
+
+def leer_frames(ruta, fps_imagenes=1.0, salto=1):
+    """
+    Genera los frames de un video o las rutas de una carpeta de imágenes.
+
+    Args:
+        ruta: Archivo de video o carpeta con imágenes
+        fps_imagenes: Frecuencia asumida para asignar tiempos a una carpeta de imágenes
+        salto: Procesar solo uno de cada `salto` frames
+
+    Yields:
+        (indice, tiempo_s, frame, ms_decodificacion): frame es una imagen BGR
+        (video) o la ruta del archivo (carpeta, se decodifica en el trabajador)
+    """
+    if os.path.isdir(ruta):
+        archivos = sorted(
+            f for f in os.listdir(ruta) if f.lower().endswith(EXTENSIONES_IMAGEN)
+        )
+        for indice, nombre in enumerate(archivos):
+            if indice % salto == 0:
+                yield indice, indice / fps_imagenes, os.path.join(ruta, nombre), 0.0
+        return
+
+    captura = cv2.VideoCapture(ruta)
+    if not captura.isOpened():
+        raise ValueError(f"No se pudo abrir el video: {ruta}")
+    fps = captura.get(cv2.CAP_PROP_FPS) or 30.0
+
+    indice = 0
+    try:
+        while True:
+            inicio = time.perf_counter()
+            if indice % salto == 0:
+                ok, frame = captura.read()
+            else:
+                # grab() avanza sin decodificar el frame
+                ok, frame = captura.grab(), None
+            ms_decodificacion = (time.perf_counter() - inicio) * 1000
+            if not ok:
+                break
+            if frame is not None:
+                yield indice, indice / fps, frame, ms_decodificacion
+            indice += 1
+    finally:
+        captura.release()
+
+def agrupar_en_bloques(frames, tamano_bloque):
+    """
+    Agrupa los frames en listas de `tamano_bloque` elementos.
+    """
+    bloque = []
+    for frame in frames:
+        bloque.append(frame)
+        if len(bloque) == tamano_bloque:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+def inicializar_trabajador(perfil):
+    """
+    Aplica el perfil de configuración en cada proceso del pool.
+    """
+    from config_optimizacion import cambiar_configuracion
+    cambiar_configuracion(perfil)
+
+def procesar_bloque(bloque, tamano_lado, modelo_dispositivo=None):
+    """
+    Decodifica (si hace falta), detecta y calcula la geometría de un bloque de frames.
+
+    Args:
+        bloque: Lista de tuplas (indice, tiempo_s, frame_o_ruta, ms_decodificacion)
+        tamano_lado: Tamaño real del lado del marcador en metros
+        modelo_dispositivo: Modelo con calibración de cámara (opcional)
+
+    Returns:
+        list: Un diccionario por frame, sin imágenes (solo datos serializables)
+    """
+    from medicion_marcadores import mejorar_deteccion_aruco, calcular_geometria_medicion
+
+    resultados = []
+    for indice, tiempo_s, frame, ms_decodificacion in bloque:
+        resultado = {'frame': indice, 'tiempo_s': round(tiempo_s, 3), 'ms_decodificacion': round(ms_decodificacion, 2)}
+
+        if isinstance(frame, str):
+            inicio = time.perf_counter()
+            frame = cv2.imread(frame, cv2.IMREAD_COLOR)
+            resultado['ms_decodificacion'] = round((time.perf_counter() - inicio) * 1000, 2)
+            if frame is None:
+                resultado['error'] = "No se pudo decodificar la imagen"
+                resultados.append(resultado)
+                continue
+
+        inicio = time.perf_counter()
+        corners, ids = mejorar_deteccion_aruco(frame)
+        resultado['ms_deteccion'] = round((time.perf_counter() - inicio) * 1000, 2)
+
+        if ids is None:
+            resultado['error'] = "Se necesitan al menos 2 códigos ArUco para medir"
+            resultados.append(resultado)
+            continue
+
+        inicio = time.perf_counter()
+        geometria, error = calcular_geometria_medicion(corners, ids, tamano_lado, frame.shape, modelo_dispositivo)
+        resultado['ms_geometria'] = round((time.perf_counter() - inicio) * 1000, 2)
+
+        if geometria is None:
+            resultado['error'] = error
+        else:
+            resultado['geometria'] = geometria
+        resultados.append(resultado)
+
+    return resultados
+
+def procesar_en_paralelo(frames, tamano_lado, perfil, trabajadores, tamano_bloque, modelo_dispositivo=None):
+    """
+    Envía bloques al pool de procesos y devuelve los resultados en el orden original,
+    con un número acotado de bloques en vuelo para no acumular frames en memoria.
+
+    Yields:
+        dict: Resultado de cada frame, en orden
+    """
+    en_vuelo = deque()
+    max_en_vuelo = trabajadores * 2
+
+    with ProcessPoolExecutor(max_workers=trabajadores, initializer=inicializar_trabajador,
+                             initargs=(perfil,)) as executor:
+        for bloque in agrupar_en_bloques(frames, tamano_bloque):
+            en_vuelo.append(executor.submit(procesar_bloque, bloque, tamano_lado, modelo_dispositivo))
+            if len(en_vuelo) >= max_en_vuelo:
+                yield from en_vuelo.popleft().result()
+        while en_vuelo:
+            yield from en_vuelo.popleft().result()
+
+def aplicar_filtrado(resultados, ventana_tiempo=2.0):
+    """
+    Aplica el filtrado temporal y la selección de método usando el tiempo del video.
+
+    Yields:
+        dict: Fila lista para escribir
+    """
+    from medicion_marcadores import filtrar_mediciones_temporales, seleccionar_distancia
+
+    historial = deque(maxlen=10)
+    for resultado in resultados:
+        fila = {campo: resultado.get(campo) for campo in CAMPOS_SALIDA}
+        geometria = resultado.get('geometria')
+        fila['exito'] = geometria is not None
+
+        if geometria is not None:
+            inicio = time.perf_counter()
+            distancia_filtrada, confianza = filtrar_mediciones_temporales(
+                geometria['distancia_referencia'], ventana_tiempo,
+                historial=historial, tiempo_actual=resultado['tiempo_s']
+            )
+            distancia_final, metodo_usado, debug_info = seleccionar_distancia(
+                geometria, distancia_filtrada, confianza, len(historial)
+            )
+            fila.update({
+                'distancia': round(float(distancia_final), 4),
+                'distancia_filtrada': round(float(distancia_filtrada), 4),
+                'confianza': round(float(confianza), 3),
+                'metodo_usado': metodo_usado,
+                'metros_por_pixel': debug_info['metros_por_pixel'],
+                'ids_detectados': debug_info['ids_detectados'],
+                'ms_filtrado': round((time.perf_counter() - inicio) * 1000, 2),
+            })
+        yield fila
+
+def escribir_resultados(filas, ruta_salida, formato):
+    """
+    Escribe las filas a medida que llegan en CSV o JSONL.
+
+    Returns:
+        (total, exitos): Frames escritos y frames con medición
+    """
+    total = exitos = 0
+    with open(ruta_salida, "w", encoding="utf-8", newline="") as f:
+        escritor = csv.DictWriter(f, fieldnames=CAMPOS_SALIDA) if formato == 'csv' else None
+        if escritor:
+            escritor.writeheader()
+        for fila in filas:
+            total += 1
+            exitos += int(fila['exito'])
+            if escritor:
+                fila = dict(fila, ids_detectados=' '.join(map(str, fila['ids_detectados'] or [])))
+                escritor.writerow(fila)
+            else:
+                f.write(json.dumps(fila, ensure_ascii=False) + "\n")
+    return total, exitos
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide distancias ArUco en videos o carpetas de imágenes.")
+    parser.add_argument("entrada", help="Archivo de video o carpeta de imágenes")
+    parser.add_argument("-o", "--salida", required=True, help="Archivo de salida (.csv o .jsonl)")
+    parser.add_argument("--formato", choices=["csv", "jsonl"], help="Formato de salida (por defecto según la extensión)")
+    parser.add_argument("--tamano-lado", type=float, default=0.05, help="Lado del marcador en metros (0.05)")
+    parser.add_argument("--perfil", choices=["velocidad", "precision"], default="velocidad")
+    parser.add_argument("--modelo-dispositivo", help="Modelo con calibración de cámara guardada")
+    parser.add_argument("--trabajadores", type=int, default=os.cpu_count() or 1, help="Procesos del pool")
+    parser.add_argument("--tamano-bloque", type=int, default=16, help="Frames por bloque enviado al pool")
+    parser.add_argument("--salto", type=int, default=1, help="Procesar uno de cada N frames")
+    parser.add_argument("--fps", type=float, default=1.0, help="Frames por segundo asumidos para carpetas de imágenes")
+    args = parser.parse_args()
+
+    formato = args.formato or ('jsonl' if args.salida.endswith('.jsonl') else 'csv')
+
+    inicio = time.perf_counter()
+    frames = leer_frames(args.entrada, args.fps, args.salto)
+    resultados = procesar_en_paralelo(
+        frames, args.tamano_lado, args.perfil, args.trabajadores, args.tamano_bloque, args.modelo_dispositivo
+    )
+    total, exitos = escribir_resultados(aplicar_filtrado(resultados), args.salida, formato)
+    duracion = time.perf_counter() - inicio
+
+    print(f"✅ {total} frames procesados ({exitos} con medición) en {duracion:.1f} s "
+          f"({total / duracion if duracion > 0 else 0:.1f} frames/s)")
+    print(f"📁 Resultados: {args.salida}")
+
+if __name__ == "__main__":
+    main()
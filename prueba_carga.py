@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de /detectar_aruco y /generar con frames sintéticos (el
+generador de test_precision_aruco.py) o grabados por grabador_frames.py.
+
+Mide el rendimiento (peticiones por segundo), la distribución de latencias,
+los errores (HTTP, de conexión y de la aplicación) y la CPU y memoria del
+servidor, todo en una sola máquina y sin red externa, para comparar
+configuraciones de servicio antes de cada versión.
+
+Con --tasa la carga es abierta: las peticiones se programan a intervalos fijos y
+la latencia se cuenta desde el instante programado, así que la cola que se forma
+cuando el servidor no da abasto también se mide.
+
+Uso:
+    python prueba_carga.py --arrancar "gunicorn -w 2 -b 127.0.0.1:8000 app:app" --concurrencia 8 --duracion 30
+    python prueba_carga.py --url http://127.0.0.1:8000 --pid-servidor 1234 --tasa 20
+    python prueba_carga.py --local --grabaciones grabaciones --concurrencia 4
+    python prueba_carga.py --local --mezcla detectar=0.8,generar=0.2 --salida carga.json
+"""
+
+import os
+import json
+import time
+import shlex
+import base64
+import random
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, urlencode
+from collections import Counter, defaultdict
+import cv2
+import numpy as np
+
+DISTANCIAS_GENERAR = (3.0, 4.5, 6.0, 8.0, 10.0)
+INTERVALO_MUESTREO_SERVIDOR = 0.5  # Segundos entre lecturas de la memoria del servidor
+PERCENTILES = (50, 90, 95, 99)
+
+# --- Frames y peticiones ---
+
+def frames_sinteticos(variantes=8, ancho=None, semilla=0):
+    """
+    Variantes del frame sintético de test_precision_aruco.py (desplazamiento,
+    ruido y calidad JPEG distintos), para que el servidor no procese siempre los
+    mismos bytes.
+
+    Returns:
+        list: Frames BGR
+    """
+    from test_precision_aruco import crear_imagen_prueba_con_aruco
+    generador = np.random.default_rng(semilla)
+    base = crear_imagen_prueba_con_aruco()
+    frames = []
+    for _ in range(variantes):
+        dx, dy = generador.integers(-40, 41, size=2)
+        matriz = np.float32([[1, 0, dx], [0, 1, dy]])
+        frame = cv2.warpAffine(base, matriz, (base.shape[1], base.shape[0]), borderValue=(255, 255, 255))
+        ruido = generador.normal(0, 4, frame.shape)
+        frame = np.clip(frame + ruido, 0, 255).astype(np.uint8)
+        if ancho and ancho != frame.shape[1]:
+            frame = cv2.resize(frame, (ancho, round(frame.shape[0] * ancho / frame.shape[1])), interpolation=cv2.INTER_AREA)
+        frames.append(frame)
+    return frames
+
+def peticiones_detectar_sinteticas(frames, tamano_lado=0.05, visualizacion=False, formato_respuesta='completo'):
+    """
+    Cuerpos JSON de /detectar_aruco ya codificados (la codificación no cuenta
+    en la latencia medida).
+
+    Returns:
+        list: (metodo, ruta, cuerpo, cabeceras)
+    """
+    peticiones = []
+    for indice, frame in enumerate(frames):
+        calidad = 70 + (indice * 7) % 25
+        _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, calidad])
+        cuerpo = json.dumps({
+            "image": "data:image/jpeg;base64," + base64.b64encode(jpeg).decode('ascii'),
+            "tamano_lado": tamano_lado,
+            "generar_visualizacion": visualizacion,
+            "formato_respuesta": formato_respuesta,
+        }).encode('utf-8')
+        peticiones.append(('POST', '/detectar_aruco', cuerpo, {'Content-Type': 'application/json'}))
+    return peticiones
+
+def peticiones_detectar_grabadas(directorio, motivo=None):
+    """
+    Peticiones de /detectar_aruco con los frames de grabador_frames.py, en el
+    mismo formato en que llegaron (JPEG en base64 o gris crudo comprimido).
+
+    Returns:
+        list: (metodo, ruta, cuerpo, cabeceras)
+    """
+    from grabador_frames import cargar_grabaciones
+    peticiones = []
+    for ruta, metadatos in cargar_grabaciones(directorio, motivo):
+        with open(ruta + '.bin', 'rb') as f:
+            frame = f.read()
+        opciones = metadatos['opciones']
+        if metadatos['formato'] == 'imagen':
+            cuerpo = json.dumps(dict(opciones, image="data:image/jpeg;base64," + base64.b64encode(frame).decode('ascii')))
+            peticiones.append(('POST', '/detectar_aruco', cuerpo.encode('utf-8'), {'Content-Type': 'application/json'}))
+        elif metadatos['canales'] == 1:
+            cabeceras = {
+                'Content-Type': 'application/octet-stream',
+                'X-Ancho': str(metadatos['ancho']),
+                'X-Alto': str(metadatos['alto']),
+                'X-Compresion': 'zlib',
+            }
+            consulta = urlencode({clave: valor for clave, valor in opciones.items() if valor is not None})
+            peticiones.append(('POST', f'/detectar_aruco?{consulta}', frame, cabeceras))
+    return peticiones
+
+def peticiones_generar():
+    return [('GET', f'/generar?distancia={distancia}', None, {}) for distancia in DISTANCIAS_GENERAR]
+
+def interpretar_mezcla(texto):
+    """
+    'detectar=0.8,generar=0.2' -> {'detectar': 0.8, 'generar': 0.2}
+    """
+    mezcla = {}
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        if nombre.strip() not in ('detectar', 'generar'):
+            raise ValueError(f"Endpoint desconocido en la mezcla: {nombre}")
+        mezcla[nombre.strip()] = float(peso or 1)
+    return mezcla
+
+# --- Clientes ---
+
+def crear_enviador_http(url, timeout):
+    """
+    Envía peticiones a un servidor HTTP con una conexión persistente por hilo,
+    como un teléfono que mide en tiempo real.
+
+    Returns:
+        función (metodo, ruta, cuerpo, cabeceras) -> (estado_http, cuerpo_respuesta)
+    """
+    partes = urlsplit(url)
+    local = threading.local()
+
+    def enviar(metodo, ruta, cuerpo, cabeceras):
+        conexion = getattr(local, 'conexion', None)
+        if conexion is None:
+            conexion = local.conexion = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=timeout)
+        try:
+            conexion.request(metodo, partes.path.rstrip('/') + ruta, body=cuerpo, headers=cabeceras)
+            respuesta = conexion.getresponse()
+            return respuesta.status, respuesta.read()
+        except Exception:
+            conexion.close()
+            local.conexion = None
+            raise
+
+    return enviar
+
+def crear_enviador_local():
+    """
+    Envía peticiones a la aplicación Flask en este mismo proceso, sin servidor
+    HTTP (un cliente de pruebas por hilo).
+    """
+    from app import app
+    local = threading.local()
+
+    def enviar(metodo, ruta, cuerpo, cabeceras):
+        cliente = getattr(local, 'cliente', None)
+        if cliente is None:
+            cliente = local.cliente = app.test_client()
+        respuesta = cliente.open(ruta, method=metodo, data=cuerpo, headers=cabeceras)
+        return respuesta.status_code, respuesta.get_data()
+
+    return enviar
+
+# --- CPU y memoria del servidor (Linux, /proc) ---
+
+def _procesos_arbol(pid):
+    """
+    pid y todos sus descendientes (los workers de gunicorn o uvicorn).
+    """
+    hijos = defaultdict(list)
+    for entrada in os.listdir('/proc'):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entrada}/stat') as f:
+                campos = f.read().rsplit(')', 1)[1].split()
+            hijos[int(campos[1])].append(int(entrada))
+        except (OSError, IndexError):
+            continue
+    arbol, pendientes = [], [pid]
+    while pendientes:
+        actual = pendientes.pop()
+        arbol.append(actual)
+        pendientes.extend(hijos.get(actual, []))
+    return arbol
+
+def _leer_proceso(pid):
+    """
+    (segundos de CPU, bytes residentes) de un proceso, o (0, 0) si ya terminó.
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            campos = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            paginas = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0.0, 0
+    cpu = (int(campos[11]) + int(campos[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu, paginas * os.sysconf('SC_PAGE_SIZE')
+
+class MonitorServidor:
+    """
+    Muestrea la CPU y la memoria residente del árbol de procesos del servidor
+    mientras dura la prueba.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.rss = []
+        self.cpu_inicio = None
+        self.cpu_fin = None
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+
+    def _medir(self):
+        lecturas = [_leer_proceso(pid) for pid in _procesos_arbol(self.pid)]
+        return sum(cpu for cpu, _ in lecturas), sum(rss for _, rss in lecturas)
+
+    def _bucle(self):
+        while not self._parar.wait(INTERVALO_MUESTREO_SERVIDOR):
+            self.rss.append(self._medir()[1])
+
+    def iniciar(self):
+        self.cpu_inicio = (self._medir()[0], time.perf_counter())
+        self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        self._hilo.join()
+        cpu, rss = self._medir()
+        self.rss.append(rss)
+        self.cpu_fin = (cpu, time.perf_counter())
+
+    def resumen(self):
+        segundos_cpu = self.cpu_fin[0] - self.cpu_inicio[0]
+        segundos = self.cpu_fin[1] - self.cpu_inicio[1]
+        return {
+            "pid": self.pid,
+            "procesos": len(_procesos_arbol(self.pid)),
+            "cpu_porcentaje": round(100 * segundos_cpu / segundos, 1) if segundos > 0 else None,
+            "nucleos": os.cpu_count(),
+            "rss_medio_mb": round(float(np.mean(self.rss)) / 1e6, 1),
+            "rss_pico_mb": round(max(self.rss) / 1e6, 1),
+        }
+
+# --- Generador de carga ---
+
+def _clasificar(estado, cuerpo):
+    """
+    None si la respuesta es correcta; si no, (tipo, mensaje). La aplicación
+    devuelve los errores con estado 200 y {"error": ...}.
+    """
+    if estado != 200:
+        return f'http_{estado}', cuerpo[:120].decode('utf-8', 'replace')
+    try:
+        datos = json.loads(cuerpo)
+    except ValueError:
+        return 'respuesta_no_json', cuerpo[:120].decode('utf-8', 'replace')
+    if isinstance(datos, dict) and 'error' in datos:
+        return 'aplicacion', str(datos['error'])[:120]
+    return None
+
+def ejecutar_carga(enviar, peticiones, mezcla, concurrencia, duracion, tasa=None, max_peticiones=None,
+                   calentamiento=0.0, monitor=None, semilla=0):
+    """
+    Lanza `concurrencia` hilos que envían peticiones durante `duracion` segundos
+    (o hasta `max_peticiones`). Sin tasa, cada hilo envía la siguiente petición
+    al recibir la respuesta (carga cerrada); con tasa, las peticiones salen a
+    intervalos fijos de 1/tasa segundos (carga abierta).
+
+    Args:
+        enviar: Función devuelta por crear_enviador_http o crear_enviador_local
+        peticiones: {'detectar': [...], 'generar': [...]} con (metodo, ruta, cuerpo, cabeceras)
+        mezcla: Peso de cada endpoint
+        concurrencia: Hilos cliente
+        duracion: Segundos de medición (sin contar el calentamiento)
+        tasa: Peticiones por segundo (opcional)
+        max_peticiones: Límite de peticiones medidas (opcional)
+        calentamiento: Segundos iniciales que no se miden
+        monitor: MonitorServidor (opcional), se inicia al acabar el calentamiento
+
+    Returns:
+        dict: Resultados por endpoint y totales
+    """
+    nombres = [nombre for nombre in mezcla if peticiones.get(nombre)]
+    pesos = [mezcla[nombre] for nombre in nombres]
+
+    lock = threading.Lock()
+    siguiente = [0]
+    medidas = [0]
+    latencias = defaultdict(list)
+    errores = defaultdict(Counter)
+    inicio = time.perf_counter()
+    inicio_medicion = inicio + calentamiento
+    fin = inicio_medicion + duracion
+    monitor_iniciado = threading.Event()
+
+    def trabajador(numero):
+        aleatorio = random.Random(semilla * 1000 + numero)
+        while True:
+            with lock:
+                indice = siguiente[0]
+                siguiente[0] += 1
+            if tasa:
+                programada = inicio + indice / tasa
+                espera = programada - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+            else:
+                programada = time.perf_counter()
+            if programada >= fin:
+                return
+
+            nombre = aleatorio.choices(nombres, weights=pesos)[0]
+            metodo, ruta, cuerpo, cabeceras = aleatorio.choice(peticiones[nombre])
+            try:
+                estado, respuesta = enviar(metodo, ruta, cuerpo, cabeceras)
+                error = _clasificar(estado, respuesta)
+            except Exception as e:
+                error = ('conexion', f"{type(e).__name__}: {e}"[:120])
+            terminada = time.perf_counter()
+
+            if programada < inicio_medicion:
+                continue
+            if monitor is not None and not monitor_iniciado.is_set():
+                with lock:
+                    if not monitor_iniciado.is_set():
+                        monitor.iniciar()
+                        monitor_iniciado.set()
+            with lock:
+                if max_peticiones and medidas[0] >= max_peticiones:
+                    return
+                medidas[0] += 1
+                latencias[nombre].append(((terminada - programada) * 1000, error is None))
+                if error is not None:
+                    errores[nombre][error] += 1
+
+    hilos = [threading.Thread(target=trabajador, args=(numero,), daemon=True) for numero in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    segundos = time.perf_counter() - inicio_medicion
+    if monitor is not None and monitor_iniciado.is_set():
+        monitor.detener()
+
+    return _resumir(latencias, errores, segundos)
+
+def _estadisticas_latencia(muestras, segundos):
+    ms = np.array([latencia for latencia, _ in muestras])
+    correctas = sum(1 for _, ok in muestras if ok)
+    resumen = {
+        "peticiones": len(muestras),
+        "correctas": correctas,
+        "tasa_error": round(1 - correctas / len(muestras), 4),
+        "rendimiento_rps": round(len(muestras) / segundos, 2),
+        "rendimiento_correctas_rps": round(correctas / segundos, 2),
+        "media_ms": round(float(ms.mean()), 1),
+        "max_ms": round(float(ms.max()), 1),
+    }
+    for percentil in PERCENTILES:
+        resumen[f"p{percentil}_ms"] = round(float(np.percentile(ms, percentil)), 1)
+    return resumen
+
+def _resumir(latencias, errores, segundos):
+    endpoints = {
+        nombre: dict(_estadisticas_latencia(muestras, segundos), errores=[
+            {"tipo": tipo, "mensaje": mensaje, "veces": veces}
+            for (tipo, mensaje), veces in errores[nombre].most_common(5)
+        ])
+        for nombre, muestras in latencias.items() if muestras
+    }
+    todas = [muestra for muestras in latencias.values() for muestra in muestras]
+    return {
+        "segundos": round(segundos, 2),
+        "total": _estadisticas_latencia(todas, segundos) if todas else None,
+        "endpoints": endpoints,
+    }
+
+# --- Servidor local ---
+
+def arrancar_servidor(comando, url, timeout=60):
+    """
+    Arranca el servidor (p. ej. gunicorn) y espera a que responda en /capacidades.
+
+    Returns:
+        subprocess.Popen
+    """
+    proceso = subprocess.Popen(shlex.split(comando), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    partes = urlsplit(url)
+    limite = time.time() + timeout
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El servidor terminó al arrancar (código {proceso.returncode})")
+        try:
+            conexion = http.client.HTTPConnection(partes.hostname, partes.port or 80, timeout=2)
+            conexion.request('GET', '/capacidades')
+            if conexion.getresponse().status == 200:
+                return proceso
+        except OSError:
+            time.sleep(0.25)
+    proceso.terminate()
+    raise RuntimeError(f"El servidor no respondió en {timeout} s")
+
+def _imprimir(resultado, servidor):
+    print(f"\n{'endpoint':<16}{'peticiones':>11}{'error %':>9}{'req/s':>9}"
+          f"{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    filas = list(resultado['endpoints'].items())
+    if resultado['total'] and len(filas) > 1:
+        filas.append(('total', resultado['total']))
+    for nombre, datos in filas:
+        print(f"{nombre:<16}{datos['peticiones']:>11}{100 * datos['tasa_error']:>9.1f}{datos['rendimiento_rps']:>9.2f}"
+              f"{datos['p50_ms']:>9.1f}{datos['p90_ms']:>9.1f}{datos['p95_ms']:>9.1f}{datos['p99_ms']:>9.1f}{datos['max_ms']:>9.1f}")
+    for nombre, datos in resultado['endpoints'].items():
+        for error in datos['errores']:
+            print(f"⚠️  {nombre}: {error['veces']} × {error['tipo']}: {error['mensaje']}")
+    if servidor:
+        print(f"\n🖥️  Servidor (pid {servidor['pid']}, {servidor['procesos']} procesos): "
+              f"CPU {servidor['cpu_porcentaje']}% de {servidor['nucleos'] * 100}%, "
+              f"RSS medio {servidor['rss_medio_mb']} MB, pico {servidor['rss_pico_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /detectar_aruco y /generar.")
+    destino = parser.add_mutually_exclusive_group(required=True)
+    destino.add_argument("--url", help="Servidor ya arrancado (p. ej. http://127.0.0.1:8000)")
+    destino.add_argument("--local", action="store_true", help="Aplicación Flask en este proceso, sin HTTP")
+    parser.add_argument("--arrancar", help="Comando que arranca el servidor de --url y se detiene al terminar")
+    parser.add_argument("--pid-servidor", type=int, help="PID del servidor de --url para medir su CPU y memoria")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Clientes simultáneos")
+    parser.add_argument("--tasa", type=float, help="Peticiones por segundo (carga abierta); sin ella, carga cerrada")
+    parser.add_argument("--duracion", type=float, default=20, help="Segundos de medición")
+    parser.add_argument("--peticiones", type=int, help="Parar tras este número de peticiones medidas")
+    parser.add_argument("--calentamiento", type=float, default=2, help="Segundos iniciales que no se miden")
+    parser.add_argument("--mezcla", default="detectar=1", help="Peso de cada endpoint: detectar=0.9,generar=0.1")
+    parser.add_argument("--grabaciones", help="Directorio de grabador_frames.py en lugar de frames sintéticos")
+    parser.add_argument("--variantes", type=int, default=8, help="Frames sintéticos distintos")
+    parser.add_argument("--ancho", type=int, default=640, help="Ancho de los frames sintéticos (0 = original)")
+    parser.add_argument("--visualizacion", action="store_true", help="Pedir la imagen de visualización")
+    parser.add_argument("--formato-respuesta", choices=["ligero", "completo"], default="completo",
+                        help="Formato de respuesta de los frames sintéticos")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout de cada petición HTTP")
+    parser.add_argument("--salida", help="Guardar los resultados en JSON para comparar configuraciones")
+    args = parser.parse_args()
+
+    if args.arrancar and not args.url:
+        parser.error("--arrancar necesita --url")
+
+    mezcla = interpretar_mezcla(args.mezcla)
+    peticiones = {'generar': peticiones_generar()}
+    if args.grabaciones:
+        peticiones['detectar'] = peticiones_detectar_grabadas(args.grabaciones)
+    else:
+        frames = frames_sinteticos(args.variantes, args.ancho or None)
+        peticiones['detectar'] = peticiones_detectar_sinteticas(
+            frames, visualizacion=args.visualizacion, formato_respuesta=args.formato_respuesta)
+    if 'detectar' in mezcla and not peticiones['detectar']:
+        print("❌ No hay frames para /detectar_aruco")
+        return
+
+    proceso = None
+    try:
+        if args.local:
+            enviar = crear_enviador_local()
+            pid = os.getpid()  # Incluye el propio generador de carga
+        else:
+            if args.arrancar:
+                proceso = arrancar_servidor(args.arrancar, args.url)
+            enviar = crear_enviador_http(args.url, args.timeout)
+            pid = proceso.pid if proceso else args.pid_servidor
+        monitor = MonitorServidor(pid) if pid and os.path.isdir('/proc') else None
+
+        modo = f"{args.tasa:g} req/s" if args.tasa else "cerrada"
+        print(f"🚀 {args.url or 'aplicación local'} | concurrencia {args.concurrencia} | carga {modo} | "
+              f"{args.duracion:g} s (+{args.calentamiento:g} s de calentamiento) | mezcla {mezcla}")
+        resultado = ejecutar_carga(
+            enviar, peticiones, mezcla, args.concurrencia, args.duracion, tasa=args.tasa,
+            max_peticiones=args.peticiones, calentamiento=args.calentamiento, monitor=monitor
+        )
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=10)
+
+    if not resultado['total']:
+        print("❌ No se midió ninguna petición (¿duración demasiado corta?)")
+        return
+    servidor = monitor.resumen() if monitor is not None and monitor.cpu_fin else None
+    _imprimir(resultado, servidor)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({
+                "configuracion": {clave: valor for clave, valor in vars(args).items()},
+                "resultado": resultado,
+                "servidor": servidor,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"📁 Resultados: {args.salida}")
+
+if __name__ == "__main__":
+    main()
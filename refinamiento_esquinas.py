@@ -0,0 +1,225 @@
+# --- Motor de refinamiento de esquinas de los marcadores ---
+import time
+import threading
+import cv2
+import numpy as np
+from config_optimizacion import obtener_configuracion
+
+# ninguno: esquinas tal cual las da el detector
+# detector: refinamiento subpíxel interno del detector (CORNER_REFINE_SUBPIX)
+# lote: un único cornerSubPix con las esquinas de todos los marcadores
+# lineas: ajuste de una recta a cada borde del marcador e intersección de rectas vecinas
+MODOS_REFINAMIENTO = ('ninguno', 'detector', 'lote', 'lineas')
+
+MUESTRAS_POR_BORDE = 24       # Puntos muestreados a lo largo de cada borde
+MARGEN_BORDE = 0.15           # Fracción del borde que se ignora junto a cada esquina
+RADIO_BUSQUEDA_LINEAS = 3.0   # Píxeles a cada lado del borde en los que se busca el salto de intensidad
+PASO_BUSQUEDA_LINEAS = 0.5    # Resolución del perfil perpendicular en píxeles
+
+_estadisticas = {modo: {'llamadas': 0, 'suma_ms': 0.0, 'suma_desplazamiento': 0.0,
+                        'suma_residuo': 0.0, 'esquinas': 0} for modo in MODOS_REFINAMIENTO}
+_lock = threading.Lock()
+
+def refinar_lote(imagen, corners, ventana=None, zona_muerta=(-1, -1)):
+    """
+    Refina las esquinas de todos los marcadores con una sola llamada a cornerSubPix.
+
+    Args:
+        imagen: Imagen en escala de grises
+        corners: Esquinas detectadas por ArUco
+        ventana: Tamaño de la ventana de búsqueda
+        zona_muerta: Zona muerta para el refinamiento
+
+    Returns:
+        corners_refinadas: Lista con las esquinas (1 x 4 x 2) de cada marcador
+    """
+    config = obtener_configuracion()
+    if ventana is None:
+        ventana = config['VENTANA_SUBPIXEL']
+
+    puntos = np.ascontiguousarray(np.asarray(corners, dtype=np.float32).reshape(-1, 1, 2))
+    cv2.cornerSubPix(
+        imagen, puntos, ventana, zona_muerta,
+        criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+                  config['ITERACIONES_SUBPIXEL'],
+                  config['PRECISION_SUBPIXEL'])
+    )
+    return list(puntos.reshape(-1, 1, 4, 2))
+
+def _interpolar(imagen, x, y):
+    """
+    Interpolación bilineal de la imagen en coordenadas reales (sin redondear a uint8).
+    """
+    alto, ancho = imagen.shape
+    x = np.clip(x, 0, ancho - 1.001)
+    y = np.clip(y, 0, alto - 1.001)
+    x0 = x.astype(np.int32)
+    y0 = y.astype(np.int32)
+    fx = x - x0
+    fy = y - y0
+    arriba = imagen[y0, x0] * (1 - fx) + imagen[y0, x0 + 1] * fx
+    abajo = imagen[y0 + 1, x0] * (1 - fx) + imagen[y0 + 1, x0 + 1] * fx
+    return arriba * (1 - fy) + abajo * fy
+
+def _perfilar_bordes(imagen, esquinas):
+    """
+    Busca el salto de intensidad en perfiles perpendiculares a cada borde del
+    cuadrilátero formado por las esquinas.
+
+    Args:
+        imagen: Imagen en escala de grises
+        esquinas: Array (N, 4, 2) con las esquinas de cada marcador
+
+    Returns:
+        puntos: Puntos de borde encontrados (N, 4, S, 2)
+        posicion: Distancia con signo (px) de cada punto a la recta entre las esquinas (N, 4, S)
+        fuerza: Gradiente en cada punto, usado como peso (N, 4, S)
+    """
+    inicio_borde = esquinas
+    fin_borde = np.roll(esquinas, -1, axis=1)  # El borde j va de la esquina j a la j+1
+    direccion = fin_borde - inicio_borde
+    longitud = np.linalg.norm(direccion, axis=2, keepdims=True)
+    direccion = direccion / np.maximum(longitud, 1e-9)
+    normal = np.stack([-direccion[..., 1], direccion[..., 0]], axis=-1)
+
+    # Puntos a lo largo de cada borde y perfiles perpendiculares en cada uno (N, 4, S, D, 2)
+    t = np.linspace(MARGEN_BORDE, 1 - MARGEN_BORDE, MUESTRAS_POR_BORDE)
+    desplazamientos = np.arange(-RADIO_BUSQUEDA_LINEAS, RADIO_BUSQUEDA_LINEAS + 1e-9, PASO_BUSQUEDA_LINEAS)
+    puntos_borde = inicio_borde[:, :, None, :] + t[None, None, :, None] * (fin_borde - inicio_borde)[:, :, None, :]
+    muestras = puntos_borde[:, :, :, None, :] + desplazamientos[None, None, None, :, None] * normal[:, :, None, None, :]
+
+    perfiles = _interpolar(imagen.astype(np.float32, copy=False), muestras[..., 0], muestras[..., 1])
+    gradiente = np.abs(np.diff(perfiles, axis=-1))  # (N, 4, S, D-1)
+
+    # Máximo del gradiente con interpolación parabólica subpíxel
+    k = np.clip(np.argmax(gradiente, axis=-1), 1, gradiente.shape[-1] - 2)
+    g0 = np.take_along_axis(gradiente, (k - 1)[..., None], axis=-1)[..., 0]
+    g1 = np.take_along_axis(gradiente, k[..., None], axis=-1)[..., 0]
+    g2 = np.take_along_axis(gradiente, (k + 1)[..., None], axis=-1)[..., 0]
+    denominador = g0 - 2 * g1 + g2
+    delta = np.where(np.abs(denominador) > 1e-9, 0.5 * (g0 - g2) / np.where(denominador == 0, 1, denominador), 0.0)
+    posicion = desplazamientos[0] + (k + 0.5 + np.clip(delta, -0.5, 0.5)) * PASO_BUSQUEDA_LINEAS
+    puntos = puntos_borde + posicion[..., None] * normal[:, :, None, :]
+    return puntos, posicion, g1
+
+def residuo_esquinas(imagen, corners):
+    """
+    Distancia RMS (px) de los puntos de borde del marcador a las rectas que unen
+    sus esquinas, ponderada por la fuerza del borde. Vale para las esquinas de
+    cualquier modo, así que permite comparar modos entre sí.
+
+    Args:
+        imagen: Imagen en escala de grises
+        corners: Esquinas (finales) de los marcadores
+
+    Returns:
+        float: Residuo en píxeles (0.0 si no hay marcadores)
+    """
+    esquinas = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+    if not len(esquinas):
+        return 0.0
+    _, posicion, fuerza = _perfilar_bordes(imagen, esquinas)
+    suma_pesos = float(fuerza.sum())
+    if suma_pesos <= 1e-9:
+        return float(np.sqrt(np.mean(posicion ** 2)))
+    return float(np.sqrt((fuerza * posicion ** 2).sum() / suma_pesos))
+
+def refinar_lineas(imagen, corners):
+    """
+    Ajusta una recta a cada borde del marcador con el punto de máximo gradiente a lo
+    largo de perfiles perpendiculares, y toma como esquina la intersección de los
+    dos bordes que la forman. Usa todo el borde, no solo la vecindad de la esquina,
+    por lo que tolera mejor el desenfoque y el ruido.
+
+    Args:
+        imagen: Imagen en escala de grises
+        corners: Esquinas detectadas por ArUco
+
+    Returns:
+        corners_refinadas: Lista con las esquinas (1 x 4 x 2) de cada marcador
+    """
+    esquinas = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+    puntos, _, g1 = _perfilar_bordes(imagen, esquinas)  # (N, 4, S, 2)
+
+    # Ajuste por mínimos cuadrados totales ponderado por la fuerza del borde
+    pesos = g1 / np.maximum(g1.sum(axis=-1, keepdims=True), 1e-9)
+    centro = np.einsum('nes,nesc->nec', pesos, puntos)
+    centrados = puntos - centro[:, :, None, :]
+    covarianza = np.einsum('nes,nesi,nesj->neij', pesos, centrados, centrados)
+    _, vectores = np.linalg.eigh(covarianza)
+    direccion_recta = vectores[..., :, 1]  # Autovector del mayor autovalor
+
+    # La esquina j es la intersección del borde j-1 con el borde j
+    p1, d1 = np.roll(centro, 1, axis=1), np.roll(direccion_recta, 1, axis=1)
+    p2, d2 = centro, direccion_recta
+    cruz = d1[..., 0] * d2[..., 1] - d1[..., 1] * d2[..., 0]
+    diferencia = p2 - p1
+    a = (diferencia[..., 0] * d2[..., 1] - diferencia[..., 1] * d2[..., 0]) / np.where(np.abs(cruz) < 1e-6, 1, cruz)
+    refinadas = p1 + a[..., None] * d1
+
+    # Bordes casi paralelos o saltos grandes: conservar la esquina del detector
+    validas = (np.abs(cruz) >= 1e-6) & (np.linalg.norm(refinadas - esquinas, axis=-1) <= 2 * RADIO_BUSQUEDA_LINEAS)
+    refinadas = np.where(validas[..., None], refinadas, esquinas)
+
+    return list(refinadas.astype(np.float32).reshape(-1, 1, 4, 2))
+
+def refinar_esquinas(imagen, corners, modo=None):
+    """
+    Refina las esquinas con el modo configurado y registra su coste y residuos.
+
+    Args:
+        imagen: Imagen en escala de grises sobre la que se detectaron los marcadores
+        corners: Esquinas detectadas por ArUco
+        modo: Uno de MODOS_REFINAMIENTO (por defecto REFINAMIENTO_ESQUINAS del perfil)
+
+    Returns:
+        corners_refinadas: Lista con las esquinas (1 x 4 x 2) de cada marcador
+    """
+    if modo is None:
+        modo = obtener_configuracion()['REFINAMIENTO_ESQUINAS']
+    if modo not in MODOS_REFINAMIENTO:
+        raise ValueError(f"Modo de refinamiento no válido: {modo}. Usa: {', '.join(MODOS_REFINAMIENTO)}")
+
+    inicio = time.perf_counter()
+    if modo == 'lote':
+        corners_refinadas = refinar_lote(imagen, corners)
+    elif modo == 'lineas':
+        corners_refinadas = refinar_lineas(imagen, corners)
+    else:
+        # 'ninguno' y 'detector' no hacen trabajo adicional
+        corners_refinadas = list(corners)
+    ms = (time.perf_counter() - inicio) * 1000
+
+    # Mismo residuo para todos los modos, fuera del tiempo medido del refinamiento
+    residuo = residuo_esquinas(imagen, corners_refinadas)
+
+    originales = np.asarray(corners, dtype=np.float64).reshape(-1, 2)
+    desplazamiento = np.linalg.norm(np.asarray(corners_refinadas, dtype=np.float64).reshape(-1, 2) - originales, axis=1)
+    with _lock:
+        estadistica = _estadisticas[modo]
+        estadistica['llamadas'] += 1
+        estadistica['suma_ms'] += ms
+        estadistica['suma_desplazamiento'] += float(desplazamiento.sum())
+        estadistica['suma_residuo'] += residuo
+        estadistica['esquinas'] += len(originales)
+
+    return corners_refinadas
+
+def estado_refinamiento():
+    """
+    Coste medio por frame, desplazamiento medio de las esquinas y residuo medio
+    de los bordes respecto a las esquinas finales de cada modo usado en este proceso.
+    """
+    with _lock:
+        return {
+            "modo_actual": obtener_configuracion()['REFINAMIENTO_ESQUINAS'],
+            "modos": {
+                modo: {
+                    "llamadas": e['llamadas'],
+                    "media_ms": round(e['suma_ms'] / e['llamadas'], 3),
+                    "desplazamiento_medio_px": round(e['suma_desplazamiento'] / e['esquinas'], 4) if e['esquinas'] else 0.0,
+                    "residuo_medio_px": round(e['suma_residuo'] / e['llamadas'], 4),
+                }
+                for modo, e in _estadisticas.items() if e['llamadas']
+            },
+        }
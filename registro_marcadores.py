@@ -0,0 +1,357 @@
+# --- Registro de marcadores y tableros ArUco ---
+import cv2
+import numpy as np
+from config_optimizacion import CONFIG_DICCIONARIO
+
+# Tamaño real (metros) de los marcadores con tamaño fijo conocido.
+# Los IDs que no aparecen aquí usan el tamaño indicado por el usuario.
+TAMANOS_MARCADORES = {
+    10: 0.10,  # Marcador de calibración de 10 cm
+    11: 0.20,  # Marcador de calibración de 20 cm
+}
+
+# Tableros GridBoard imprimibles (los IDs no deben solaparse con los marcadores sueltos)
+TABLEROS = {
+    'a4': {
+        'marcadores_x': 3,
+        'marcadores_y': 4,
+        'tamano_marcador': 0.04,  # Lado de cada marcador en metros
+        'separacion': 0.01,       # Separación entre marcadores en metros
+        'primer_id': 20,
+    },
+}
+
+# Desviación relativa máxima de la escala de un marcador respecto a la escala común
+TOLERANCIA_ESCALA = 0.08
+
+_cache_tableros = {}
+
+def interpretar_ids(texto, maximo=None):
+    """
+    Convierte una lista de IDs como '0,1,5-9' en una tupla de enteros.
+
+    Args:
+        texto: IDs y rangos separados por comas
+        maximo: Número máximo de IDs; se comprueba antes de expandir cada rango
+
+    Raises:
+        ValueError: Si un rango está invertido o la lista supera el máximo
+    """
+    ids = []
+    for parte in texto.split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if '-' in parte:
+            inicio, fin = (int(v) for v in parte.split('-', 1))
+            if fin < inicio:
+                raise ValueError(f"Rango de IDs no válido: {parte}")
+        else:
+            inicio = fin = int(parte)
+        # Se cuenta antes de expandir: un rango enorme no llega a reservarse
+        if maximo is not None and len(ids) + fin - inicio + 1 > maximo:
+            raise ValueError(f"Se pidieron demasiados IDs (máximo {maximo})")
+        ids.extend(range(inicio, fin + 1))
+    return tuple(ids)
+
+def interpretar_familias(texto):
+    """
+    Interpreta la configuración del diccionario del despliegue.
+
+    Args:
+        texto: Familias separadas por ';', cada una 'DICT_...[:ids][@base_id]'.
+            Sin ids se usa la familia completa; base_id desplaza sus IDs para
+            que dos familias no compartan ID
+
+    Returns:
+        list: {'familia', 'ids' (IDs dentro de la familia), 'base_id'}
+
+    Raises:
+        ValueError: Si una familia no existe o un ID está fuera de ella
+    """
+    familias = []
+    for parte in texto.split(';'):
+        parte = parte.strip()
+        if not parte:
+            continue
+        cuerpo, _, base_texto = parte.partition('@')
+        nombre, _, ids_texto = cuerpo.partition(':')
+        nombre = nombre.strip().upper()
+        if not nombre.startswith('DICT_') or not hasattr(cv2.aruco, nombre):
+            raise ValueError(f"Familia de marcadores desconocida: {nombre}")
+        total = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, nombre)).bytesList.shape[0]
+        ids = interpretar_ids(ids_texto) if ids_texto.strip() else tuple(range(total))
+        fuera_de_rango = [i for i in ids if i < 0 or i >= total]
+        if fuera_de_rango:
+            raise ValueError(f"IDs fuera de {nombre} (0-{total - 1}): {fuera_de_rango}")
+        familias.append({'familia': nombre, 'ids': tuple(sorted(set(ids))), 'base_id': int(base_texto or 0)})
+    if not familias:
+        raise ValueError("No hay ninguna familia de marcadores configurada")
+    return familias
+
+def construir_diccionarios(familias):
+    """
+    Construye los diccionarios de detección del despliegue: solo las palabras
+    código de los IDs configurados (menos candidatos que comparar y menos falsos
+    positivos) y uno por número de bits, porque OpenCV no mezcla tamaños en un
+    mismo diccionario.
+
+    Returns:
+        list: {'diccionario', 'ids' (ID global de cada índice local), 'bits'}
+
+    Raises:
+        ValueError: Si dos familias producen el mismo ID global o la misma palabra código
+    """
+    grupos = {}  # bits -> {'filas', 'ids', 'correccion'}
+    vistos = {}
+    palabras = {}  # Rotaciones de cada palabra código -> ID global
+    for familia in familias:
+        predefinido = cv2.aruco.getPredefinedDictionary(getattr(cv2.aruco, familia['familia']))
+        grupo = grupos.setdefault(predefinido.markerSize, {'filas': [], 'ids': [], 'correccion': []})
+        for marker_id in familia['ids']:
+            global_id = familia['base_id'] + marker_id
+            if global_id in vistos:
+                raise ValueError(f"El ID {global_id} está en {vistos[global_id]} y en {familia['familia']}; usa @base_id")
+            vistos[global_id] = familia['familia']
+            fila = predefinido.bytesList[marker_id]
+            # Cada fila guarda las cuatro rotaciones: dos IDs con la misma serían indistinguibles
+            rotaciones = (fila.shape[0], tuple(sorted(fila[:, k].tobytes() for k in range(fila.shape[1]))))
+            if rotaciones in palabras:
+                raise ValueError(f"Los IDs {palabras[rotaciones]} y {global_id} son el mismo marcador")
+            palabras[rotaciones] = global_id
+            grupo['filas'].append(fila)
+            grupo['ids'].append(global_id)
+        grupo['correccion'].append(predefinido.maxCorrectionBits)
+
+    diccionarios = []
+    for bits, grupo in sorted(grupos.items()):
+        # El de menor corrección de errores de las familias del grupo (el más estricto)
+        diccionario = cv2.aruco.Dictionary(np.array(grupo['filas'], dtype=np.uint8), bits, min(grupo['correccion']))
+        diccionarios.append({'diccionario': diccionario, 'ids': np.array(grupo['ids'], dtype=np.int32), 'bits': bits})
+    return diccionarios
+
+# Diccionarios comunes a detección, generación de marcadores y tableros
+FAMILIAS_MARCADORES = interpretar_familias(CONFIG_DICCIONARIO['FAMILIAS'])
+DICCIONARIOS = construir_diccionarios(FAMILIAS_MARCADORES)
+# ID global -> (posición en DICCIONARIOS, índice local en su diccionario)
+_indice_ids = {
+    int(global_id): (posicion, local)
+    for posicion, entrada in enumerate(DICCIONARIOS)
+    for local, global_id in enumerate(entrada['ids'])
+}
+
+def ids_disponibles():
+    """
+    IDs globales de todos los marcadores del despliegue, ordenados.
+    """
+    return sorted(_indice_ids)
+
+def localizar_marcador(marker_id):
+    """
+    Diccionario que contiene un marcador y su índice dentro de él.
+
+    Returns:
+        (cv2.aruco.Dictionary, indice_local)
+
+    Raises:
+        ValueError: Si el ID no está en el diccionario del despliegue
+    """
+    if int(marker_id) not in _indice_ids:
+        raise ValueError(f"El ID {marker_id} no está en el diccionario de marcadores ({CONFIG_DICCIONARIO['FAMILIAS']})")
+    posicion, local = _indice_ids[int(marker_id)]
+    return DICCIONARIOS[posicion]['diccionario'], local
+
+def generar_imagen_marcador(marker_id, lado_px):
+    """
+    Imagen de un marcador (sin zona de silencio) con el diccionario del despliegue.
+    """
+    diccionario, local = localizar_marcador(marker_id)
+    return cv2.aruco.generateImageMarker(diccionario, local, lado_px)
+
+def crear_detectores(parametros):
+    """
+    Un detector por diccionario del despliegue, con los parámetros dados.
+
+    Returns:
+        list: (cv2.aruco.ArucoDetector, ids globales por índice local)
+    """
+    return [(cv2.aruco.ArucoDetector(entrada['diccionario'], parametros), entrada['ids']) for entrada in DICCIONARIOS]
+
+def detectar_marcadores(detectores, imagen):
+    """
+    Detecta los marcadores con los detectores de crear_detectores y traduce los
+    índices locales a IDs globales.
+
+    Returns:
+        corners: Tupla de esquinas (como detectMarkers)
+        ids: Array (N x 1) de IDs globales, o None si no se detectó nada
+    """
+    todas_esquinas, todos_ids = [], []
+    for detector, ids_globales in detectores:
+        corners, ids, _ = detector.detectMarkers(imagen)
+        if ids is not None:
+            todas_esquinas.extend(corners)
+            todos_ids.append(ids_globales[ids.ravel()])
+    if not todos_ids:
+        return (), None
+    return tuple(todas_esquinas), np.concatenate(todos_ids).reshape(-1, 1).astype(np.int32)
+
+def describir_diccionario():
+    """
+    Familias e IDs del despliegue, para que el cliente y las hojas imprimibles
+    usen los mismos marcadores que el detector.
+    """
+    return {
+        "familias": [
+            {"familia": f['familia'], "ids": len(f['ids']), "base_id": f['base_id']} for f in FAMILIAS_MARCADORES
+        ],
+        "ids": ids_disponibles(),
+        "palabras_codigo": len(_indice_ids),
+    }
+
+def ids_tablero(nombre):
+    """
+    Devuelve los IDs de los marcadores de un tablero.
+    """
+    tablero = TABLEROS[nombre]
+    cantidad = tablero['marcadores_x'] * tablero['marcadores_y']
+    return list(range(tablero['primer_id'], tablero['primer_id'] + cantidad))
+
+def crear_tablero(nombre):
+    """
+    Crea (o recupera de caché) el GridBoard de OpenCV de un tablero registrado.
+
+    Args:
+        nombre: Nombre del tablero en TABLEROS
+
+    Returns:
+        cv2.aruco.GridBoard
+    """
+    if nombre not in _cache_tableros:
+        tablero = TABLEROS[nombre]
+        # El tablero usa los índices locales del diccionario que contiene sus marcadores
+        localizados = [localizar_marcador(marker_id) for marker_id in ids_tablero(nombre)]
+        diccionarios = {id(diccionario) for diccionario, _ in localizados}
+        if len(diccionarios) > 1:
+            raise ValueError(f"Los marcadores del tablero {nombre} deben tener el mismo número de bits")
+        _cache_tableros[nombre] = cv2.aruco.GridBoard(
+            (tablero['marcadores_x'], tablero['marcadores_y']),
+            tablero['tamano_marcador'],
+            tablero['separacion'],
+            localizados[0][0],
+            np.array([local for _, local in localizados], dtype=np.int32)
+        )
+    return _cache_tableros[nombre]
+
+def tableros_disponibles():
+    """
+    Tableros cuyos marcadores están todos en el diccionario del despliegue.
+    """
+    return [nombre for nombre in TABLEROS if all(marker_id in _indice_ids for marker_id in ids_tablero(nombre))]
+
+def tablero_de_marcador(marker_id):
+    """
+    Devuelve el nombre del tablero al que pertenece un marcador, o None si es suelto.
+    """
+    for nombre in TABLEROS:
+        if marker_id in ids_tablero(nombre):
+            return nombre
+    return None
+
+def obtener_tamano_marcador(marker_id, tamano_por_defecto):
+    """
+    Devuelve el tamaño real del lado de un marcador según el registro.
+
+    Args:
+        marker_id: ID del marcador
+        tamano_por_defecto: Tamaño en metros para marcadores sin tamaño registrado
+
+    Returns:
+        float: Tamaño del lado en metros
+    """
+    marker_id = int(marker_id)
+    if marker_id in TAMANOS_MARCADORES:
+        return TAMANOS_MARCADORES[marker_id]
+    nombre = tablero_de_marcador(marker_id)
+    if nombre is not None:
+        return TABLEROS[nombre]['tamano_marcador']
+    return tamano_por_defecto
+
+def _segmentos_tablero(nombre, corners, ids):
+    """
+    Segmentos largos (píxeles vs metros) entre esquinas de distintos marcadores de un tablero.
+    """
+    ids_locales = np.array([[localizar_marcador(marker_id)[1]] for marker_id in np.ravel(ids)], dtype=np.int32)
+    puntos_objeto, puntos_imagen = crear_tablero(nombre).matchImagePoints(corners, ids_locales)
+    if puntos_objeto is None or len(puntos_objeto) < 8:
+        return np.empty(0), np.empty(0)
+
+    puntos_objeto = puntos_objeto.reshape(-1, 3)[:, :2]
+    puntos_imagen = puntos_imagen.reshape(-1, 2)
+    # Unir cada punto con el punto de la mitad opuesta de la lista (otro marcador)
+    opuestos = np.roll(np.arange(len(puntos_objeto)), len(puntos_objeto) // 2)
+    longitudes_px = np.linalg.norm(puntos_imagen[opuestos] - puntos_imagen, axis=1)
+    longitudes_m = np.linalg.norm(puntos_objeto[opuestos] - puntos_objeto, axis=1)
+    return longitudes_px, longitudes_m
+
+def estimar_escala_global(corners, ids, tamano_por_defecto):
+    """
+    Ajusta por mínimos cuadrados una única escala metros/píxel con los lados de todos
+    los marcadores detectados y las distancias conocidas de los tableros, descartando
+    los marcadores que no son coherentes con el ajuste.
+
+    Args:
+        corners: Esquinas de los marcadores detectados (como devuelve el detector)
+        ids: IDs de los marcadores detectados
+        tamano_por_defecto: Tamaño en metros de los marcadores sin tamaño registrado
+
+    Returns:
+        metros_por_pixel: Factor de conversión ajustado
+        lado_px: Lado equivalente en píxeles de un marcador de tamaño por defecto
+        ids_rechazados: IDs descartados por ser inconsistentes con el ajuste
+    """
+    ids_planos = np.asarray(ids).flatten()
+    esquinas = np.asarray([np.asarray(c).reshape(4, 2) for c in corners], dtype=np.float64)
+
+    # Lados de cada marcador en píxeles y su tamaño real
+    lados_px = np.linalg.norm(np.roll(esquinas, -1, axis=1) - esquinas, axis=2)  # (N, 4)
+    tamanos = np.array([obtener_tamano_marcador(i, tamano_por_defecto) for i in ids_planos])
+
+    # Escala individual de cada marcador para detectar inconsistencias
+    escalas = tamanos / np.mean(lados_px, axis=1)
+    mediana = np.median(escalas)
+    validos = np.abs(escalas / mediana - 1.0) <= TOLERANCIA_ESCALA
+    if not np.any(validos):
+        validos[:] = True
+
+    # Observaciones: lados de los marcadores válidos + segmentos de tableros
+    longitudes_px = [lados_px[validos].ravel()]
+    longitudes_m = [np.repeat(tamanos[validos], 4)]
+    for nombre in tableros_disponibles():
+        en_tablero = [k for k, marker_id in enumerate(ids_planos) if validos[k] and tablero_de_marcador(marker_id) == nombre]
+        if len(en_tablero) >= 2:
+            seg_px, seg_m = _segmentos_tablero(
+                nombre, [corners[k] for k in en_tablero], ids_planos[en_tablero].reshape(-1, 1)
+            )
+            longitudes_px.append(seg_px)
+            longitudes_m.append(seg_m)
+
+    longitudes_px = np.concatenate(longitudes_px)
+    longitudes_m = np.concatenate(longitudes_m)
+
+    # Mínimos cuadrados de longitudes_px * k = longitudes_m
+    metros_por_pixel = np.dot(longitudes_px, longitudes_m) / np.dot(longitudes_px, longitudes_px)
+    lado_px = tamano_por_defecto / metros_por_pixel
+    ids_rechazados = ids_planos[~validos].tolist()
+
+    return metros_por_pixel, lado_px, ids_rechazados
+
+def _avisar_ids_fuera_del_diccionario():
+    fuera = sorted(marker_id for marker_id in TAMANOS_MARCADORES if marker_id not in _indice_ids)
+    if fuera:
+        print(f"⚠️ Marcadores con tamaño registrado fuera del diccionario del despliegue: {fuera}")
+    for nombre in TABLEROS:
+        if nombre not in tableros_disponibles():
+            print(f"⚠️ El tablero '{nombre}' no está completo en el diccionario del despliegue y no se usará")
+
+_avisar_ids_fuera_del_diccionario()
@@ -0,0 +1,156 @@
+# --- Seguimiento de esquinas con flujo óptico entre detecciones completas ---
+import time
+import threading
+import cv2
+import numpy as np
+from config_optimizacion import obtener_configuracion
+from refinamiento_esquinas import refinar_esquinas
+
+VENTANA_FLUJO = (21, 21)      # Ventana de Lucas-Kanade en píxeles de detección
+NIVELES_PIRAMIDE = 3          # Niveles de la pirámide (movimientos de hasta ~8 veces la ventana)
+CRITERIO_FLUJO = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+VARIACION_LADO_MAXIMA = 0.15  # Cambio relativo del lado de un marcador entre frames a partir del cual se redetecta
+TOLERANCIA_ANCHO_ENCUADRE = 0.1  # Diferencia relativa de ancho sugerido que se ignora para no perder el seguimiento
+
+# Motivos por los que un frame de la sesión vuelve a la detección completa
+MOTIVOS_DETECCION = ('sin_esquinas', 'intervalo', 'encuadre', 'perdidas', 'error')
+
+_estadisticas = {
+    'detectados': 0,
+    'seguidos': 0,
+    'suma_ms_seguimiento': 0.0,
+    'suma_error_px': 0.0,
+    'motivos_deteccion': {motivo: 0 for motivo in MOTIVOS_DETECCION},
+}
+_lock = threading.Lock()
+
+def seguimiento_habilitado():
+    """
+    True si el perfil activo sigue las esquinas entre detecciones (SEGUIMIENTO_INTERVALO > 0).
+    """
+    return obtener_configuracion().get('SEGUIMIENTO_INTERVALO', 0) > 0
+
+def gris_seguimiento(img, tamano_deteccion):
+    """
+    Frame en escala de grises a la resolución de detección, la misma en la que
+    están expresadas las esquinas.
+    """
+    gris = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    if (gris.shape[1], gris.shape[0]) != tuple(tamano_deteccion):
+        # Misma interpolación que mejorar_deteccion_aruco: las esquinas guardadas son de esa imagen
+        gris = cv2.resize(gris, tuple(tamano_deteccion))
+    elif gris is img:
+        gris = gris.copy()  # Se guarda para el frame siguiente: no puede compartir memoria con la petición
+    return gris
+
+def _contar_deteccion(motivo):
+    with _lock:
+        _estadisticas['detectados'] += 1
+        _estadisticas['motivos_deteccion'][motivo] += 1
+    return None
+
+def _lados(puntos):
+    """
+    Lado medio de cada marcador (puntos N x 4 x 2).
+    """
+    return np.linalg.norm(puntos - np.roll(puntos, 1, axis=1), axis=2).mean(axis=1)
+
+def seguir_esquinas(estado, gris, forma_frame):
+    """
+    Sigue las esquinas del frame anterior de la sesión con Lucas-Kanade piramidal.
+    Cada punto se sigue hacia delante y de vuelta: la distancia entre el punto
+    de partida y el de vuelta estima el error del seguimiento.
+
+    Args:
+        estado: Estado de seguimiento de la sesión (se actualiza si el seguimiento es válido)
+        gris: Frame actual de gris_seguimiento
+        forma_frame: Forma del frame recibido (otra forma es otro recorte o resolución)
+
+    Returns:
+        dict: 'corners', 'ids' y 'error_px' (máximo error ida y vuelta, en píxeles de
+            detección), o None si hay que ejecutar la detección completa
+    """
+    anterior = estado.get('gris')
+    if anterior is None:
+        return _contar_deteccion('sin_esquinas')
+    if estado['frames_seguidos'] + 1 >= obtener_configuracion()['SEGUIMIENTO_INTERVALO']:
+        return _contar_deteccion('intervalo')
+    if estado['forma_frame'] != tuple(forma_frame[:2]) or anterior.shape != gris.shape:
+        # El cliente cambió el recorte o la resolución: las coordenadas ya no corresponden
+        return _contar_deteccion('encuadre')
+
+    inicio = time.perf_counter()
+    previas = np.concatenate([np.asarray(c, dtype=np.float32).reshape(-1, 2) for c in estado['corners']])
+    previas = previas.reshape(-1, 1, 2)
+    parametros = dict(winSize=VENTANA_FLUJO, maxLevel=NIVELES_PIRAMIDE, criteria=CRITERIO_FLUJO)
+    siguientes, valido_ida, _ = cv2.calcOpticalFlowPyrLK(anterior, gris, previas, None, **parametros)
+    vuelta, valido_vuelta, _ = cv2.calcOpticalFlowPyrLK(gris, anterior, siguientes, None, **parametros)
+
+    alto, ancho = gris.shape[:2]
+    puntos = siguientes.reshape(-1, 2)
+    dentro = (puntos[:, 0] >= 0) & (puntos[:, 0] < ancho) & (puntos[:, 1] >= 0) & (puntos[:, 1] < alto)
+    if not (valido_ida.all() and valido_vuelta.all() and dentro.all()):
+        return _contar_deteccion('perdidas')
+
+    error_px = float(np.linalg.norm((vuelta - previas).reshape(-1, 2), axis=1).max())
+    variacion = np.abs(_lados(puntos.reshape(-1, 4, 2)) / _lados(previas.reshape(-1, 4, 2)) - 1.0)
+    if error_px > obtener_configuracion()['SEGUIMIENTO_ERROR_MAX_PX'] or variacion.max() > VARIACION_LADO_MAXIMA:
+        return _contar_deteccion('error')
+
+    # Mismo refinamiento que tras la detección, para que las esquinas seguidas no se desvíen
+    corners = refinar_esquinas(gris, list(siguientes.reshape(-1, 1, 4, 2)))
+    estado.update(gris=gris, corners=corners, frames_seguidos=estado['frames_seguidos'] + 1)
+
+    with _lock:
+        _estadisticas['seguidos'] += 1
+        _estadisticas['suma_ms_seguimiento'] += (time.perf_counter() - inicio) * 1000
+        _estadisticas['suma_error_px'] += error_px
+    return {'corners': corners, 'ids': estado['ids'], 'error_px': error_px}
+
+def iniciar_seguimiento(estado, gris, forma_frame, corners, ids):
+    """
+    Guarda las esquinas de una detección completa como punto de partida del seguimiento.
+    """
+    estado.update(gris=gris, forma_frame=tuple(forma_frame[:2]), corners=list(corners), ids=ids, frames_seguidos=0)
+
+def mantener_encuadre(sugerencia, ancho_imagen, seguido):
+    """
+    Ajusta la sugerencia de captura para que el siguiente frame llegue con el
+    mismo recorte y ancho: con otro encuadre las esquinas guardadas no valen y
+    habría que detectar de nuevo. Tras un frame seguido el encuadre se mantiene
+    siempre; tras una detección, solo si la sugerencia no pide recortar y su
+    ancho apenas difiere (el cliente ya envía la región de los marcadores).
+
+    Args:
+        sugerencia: Resultado de sugerir_captura (se modifica)
+        ancho_imagen: Ancho del frame recibido
+        seguido: True si el frame se midió con las esquinas seguidas
+    """
+    if seguido or (sugerencia['roi'] is None
+                   and abs(sugerencia['ancho'] - ancho_imagen) <= TOLERANCIA_ANCHO_ENCUADRE * ancho_imagen):
+        sugerencia.update(ancho=ancho_imagen, roi=None)
+    return sugerencia
+
+def reiniciar_seguimiento(estado):
+    """
+    Descarta las esquinas guardadas: el siguiente frame se detecta completo.
+    """
+    estado.clear()
+
+def estado_seguimiento():
+    """
+    Frames detectados y seguidos en este proceso, motivos de la detección
+    completa, coste medio del seguimiento y error medio estimado.
+    """
+    config = obtener_configuracion()
+    with _lock:
+        seguidos = _estadisticas['seguidos']
+        return {
+            "intervalo_deteccion": config.get('SEGUIMIENTO_INTERVALO', 0),
+            "error_max_px": config.get('SEGUIMIENTO_ERROR_MAX_PX'),
+            "detectados": _estadisticas['detectados'],
+            "seguidos": seguidos,
+            "motivos_deteccion": dict(_estadisticas['motivos_deteccion']),
+            "media_ms_seguimiento": round(_estadisticas['suma_ms_seguimiento'] / seguidos, 3) if seguidos else None,
+            "error_medio_px": round(_estadisticas['suma_error_px'] / seguidos, 3) if seguidos else None,
+        }
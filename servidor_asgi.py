@@ -0,0 +1,213 @@
+# --- Modo de servicio ASGI: cuerpos leídos sin bloquear y visión en un executor acotado ---
+# Uso: uvicorn servidor_asgi:app --workers 2
+#  o:  gunicorn -k uvicorn.workers.UvicornWorker servidor_asgi:app
+import asyncio
+import io
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config_optimizacion import CONFIG_ASGI
+from app import app as app_flask
+
+# Rutas con trabajo de visión: van al executor acotado y se cancelan si el cliente se va
+RUTAS_VISION = re.compile(r'^/(detectar_aruco|medir_puntos|calibracion|sesiones/[^/]+/frame)$')
+MENSAJE_OCUPADO = "El servidor está ocupado, intenta de nuevo."
+
+_executor_vision = ThreadPoolExecutor(max_workers=CONFIG_ASGI['TRABAJADORES_VISION'], thread_name_prefix='vision')
+_executor_general = ThreadPoolExecutor(max_workers=CONFIG_ASGI['TRABAJADORES_GENERAL'], thread_name_prefix='general')
+
+_estadisticas = {
+    'peticiones': 0,
+    'en_espera': 0,               # Peticiones de visión encoladas sin hilo todavía
+    'en_curso': 0,                # Peticiones de visión ejecutándose
+    'rechazadas': 0,              # Cola de visión llena
+    'desconexiones_subida': 0,    # El cliente se fue mientras enviaba el cuerpo
+    'canceladas_en_cola': 0,      # El cliente se fue antes de empezar a procesar
+    'canceladas_en_curso': 0,     # El cliente se fue durante el procesamiento
+}
+_lock = threading.Lock()
+
+class ClienteDesconectado(Exception):
+    pass
+
+class CuerpoDemasiadoGrande(Exception):
+    pass
+
+def _contar(clave, incremento=1):
+    with _lock:
+        _estadisticas[clave] += incremento
+
+async def _leer_cuerpo(receive):
+    """
+    Lee el cuerpo completo de la petición sin ocupar ningún hilo mientras llega.
+    """
+    limite = CONFIG_ASGI['MAX_CUERPO_MB'] * 1e6
+    cuerpo = bytearray()
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'http.disconnect':
+            raise ClienteDesconectado()
+        cuerpo.extend(mensaje.get('body', b''))
+        if len(cuerpo) > limite:
+            raise CuerpoDemasiadoGrande()
+        if not mensaje.get('more_body', False):
+            return bytes(cuerpo)
+
+async def _esperar_desconexion(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+def _crear_environ(scope, cuerpo):
+    """
+    Traduce el scope ASGI a un environ WSGI para la aplicación Flask.
+    """
+    servidor = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(servidor[0]),
+        'SERVER_PORT': str(servidor[1]) if servidor[1] is not None else '80',
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'CONTENT_LENGTH': str(len(cuerpo)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(cuerpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # Evento que app.comprobar_cancelacion consulta entre etapas
+        'luminaria.desconectado': threading.Event(),
+    }
+    for nombre, valor in scope.get('headers', []):
+        nombre = nombre.decode('latin-1').upper().replace('-', '_')
+        valor = valor.decode('latin-1')
+        if nombre == 'CONTENT_LENGTH':
+            continue
+        clave = nombre if nombre == 'CONTENT_TYPE' else f'HTTP_{nombre}'
+        environ[clave] = f'{environ[clave]},{valor}' if clave in environ else valor
+    return environ
+
+def _llamar_wsgi(environ, vision):
+    """
+    Ejecuta la aplicación Flask en un hilo del executor y devuelve la respuesta completa.
+    """
+    if vision:
+        with _lock:
+            _estadisticas['en_espera'] -= 1
+            _estadisticas['en_curso'] += 1
+    try:
+        respuesta = {}
+        partes = []
+
+        def start_response(estado, cabeceras, exc_info=None):
+            respuesta['estado'] = int(estado.split(' ', 1)[0])
+            respuesta['cabeceras'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in cabeceras]
+            return partes.append
+
+        iterable = app_flask(environ, start_response)
+        try:
+            partes.extend(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        return respuesta['estado'], respuesta['cabeceras'], b''.join(partes)
+    finally:
+        if vision:
+            _contar('en_curso', -1)
+
+async def _responder(send, estado, cabeceras, cuerpo):
+    await send({'type': 'http.response.start', 'status': estado, 'headers': cabeceras})
+    await send({'type': 'http.response.body', 'body': cuerpo})
+
+async def _responder_json(send, estado, datos):
+    cuerpo = (app_flask.json.dumps(datos) + "\n").encode('utf-8')
+    await _responder(send, estado, [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(cuerpo)).encode())], cuerpo)
+
+async def _ciclo_vida(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            _executor_vision.shutdown(wait=False, cancel_futures=True)
+            _executor_general.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """
+    Aplicación ASGI. Todas las rutas de Flask se mantienen tal cual: aquí solo
+    cambia cómo se recibe el cuerpo (sin bloquear un hilo mientras llega por
+    una red móvil lenta) y dónde se ejecuta la vista. Si el cliente se
+    desconecta, la petición se descarta si aún no empezó, y si está en curso
+    se interrumpe en la siguiente etapa (detección, geometría, visualización).
+    """
+    if scope['type'] == 'lifespan':
+        await _ciclo_vida(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    _contar('peticiones')
+
+    try:
+        cuerpo = await _leer_cuerpo(receive)
+    except ClienteDesconectado:
+        _contar('desconexiones_subida')
+        return
+    except CuerpoDemasiadoGrande:
+        await _responder_json(send, 413, {"error": "La petición es demasiado grande"})
+        return
+
+    environ = _crear_environ(scope, cuerpo)
+    vision = RUTAS_VISION.match(scope['path']) is not None
+    if vision:
+        with _lock:
+            ocupado = _estadisticas['en_espera'] >= CONFIG_ASGI['MAX_EN_ESPERA']
+            if ocupado:
+                _estadisticas['rechazadas'] += 1
+            else:
+                _estadisticas['en_espera'] += 1
+        if ocupado:
+            await _responder_json(send, 200, {"error": MENSAJE_OCUPADO})
+            return
+
+    loop = asyncio.get_running_loop()
+    concurrente = (_executor_vision if vision else _executor_general).submit(_llamar_wsgi, environ, vision)
+    futuro = asyncio.wrap_future(concurrente, loop=loop)
+    vigilante = asyncio.ensure_future(_esperar_desconexion(receive))
+    try:
+        await asyncio.wait({futuro, vigilante}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not vigilante.done():
+            vigilante.cancel()
+
+    if not futuro.done():
+        # El cliente se fue: sin hilo todavía se descarta; en curso, se avisa a la vista
+        environ['luminaria.desconectado'].set()
+        if concurrente.cancel():
+            if vision:
+                _contar('en_espera', -1)
+            _contar('canceladas_en_cola')
+        else:
+            _contar('canceladas_en_curso')
+            futuro.add_done_callback(lambda f: f.exception())  # El resultado ya no se envía
+        return
+
+    estado, cabeceras, cuerpo_respuesta = futuro.result()
+    await _responder(send, estado, cabeceras, cuerpo_respuesta)
+
+def estado_asgi():
+    """
+    Ocupación del executor de visión y peticiones canceladas por desconexión.
+    """
+    with _lock:
+        return dict(_estadisticas, trabajadores_vision=CONFIG_ASGI['TRABAJADORES_VISION'],
+                    max_en_espera=CONFIG_ASGI['MAX_EN_ESPERA'])
+
+app_flask.extensions['servidor_asgi'] = estado_asgi
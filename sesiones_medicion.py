@@ -0,0 +1,224 @@
+# --- Sesiones de medición con señal de convergencia ---
+import threading
+import time
+import uuid
+from collections import deque
+import numpy as np
+from config_optimizacion import obtener_configuracion
+from almacen_estado import leer, escribir, actualizar, borrar, valores
+
+MAX_SESIONES = 256            # Sesiones guardadas como máximo (se descarta la menos reciente)
+EXPIRACION_SESION = 600.0     # Segundos sin frames antes de descartar una sesión
+MAX_HISTORIAL = 10            # Mediciones del filtro temporal por sesión
+
+# Espacios del almacén (almacen_estado.py), compartidos entre workers con el backend sqlite:
+# 'sesiones': sesion_id -> {'tamano_lado', 'modelo_dispositivo', 'historial', 'racha', 'inicio',
+#     'tiempo', 'frames', 'frames_validos', 'ultimo', 'convergida', 'resultado_final'}
+# 'seguimiento': sesion_id -> frame y esquinas anteriores para el flujo óptico (seguimiento_esquinas.py),
+#     aparte para no copiar el frame cada vez que se lee la sesión
+# 'filtro': 'global' -> historial del filtro temporal de las mediciones sin sesión
+ESPACIO_SESIONES = 'sesiones'
+ESPACIO_SEGUIMIENTO = 'seguimiento'
+ESPACIO_FILTRO = 'filtro'
+
+_lock = threading.Lock()
+_frames_hasta_convergencia = []  # Frames recibidos por cada sesión que convergió (en este proceso)
+
+def crear_sesion(tamano_lado, modelo_dispositivo=None):
+    """
+    Abre una sesión de medición. Los frames de la sesión comparten el filtro
+    temporal y se evalúan hasta que la lectura converge.
+
+    Args:
+        tamano_lado: Tamaño real del lado del marcador en metros
+        modelo_dispositivo: Modelo para usar los intrínsecos calibrados (opcional)
+
+    Returns:
+        sesion_id: Identificador de la sesión
+    """
+    sesion_id = uuid.uuid4().hex
+    tiempo_actual = time.time()
+    escribir(ESPACIO_SESIONES, sesion_id, {
+        'tamano_lado': tamano_lado,
+        'modelo_dispositivo': modelo_dispositivo,
+        'historial': deque(maxlen=MAX_HISTORIAL),
+        'racha': [],  # (tiempo, distancia) de las lecturas estables consecutivas
+        'inicio': tiempo_actual,
+        'tiempo': tiempo_actual,
+        'frames': 0,
+        'frames_validos': 0,
+        'ultimo': None,
+        'convergida': False,
+        'resultado_final': None,
+    }, EXPIRACION_SESION, MAX_SESIONES)
+    return sesion_id
+
+def obtener_sesion(sesion_id):
+    """
+    Devuelve la sesión (con su historial para el filtro temporal) o None si no existe o expiró.
+    Con un almacén compartido es una copia: los cambios se guardan con registrar_frame.
+    """
+    return leer(ESPACIO_SESIONES, sesion_id)
+
+def obtener_seguimiento(sesion_id):
+    """
+    Estado del seguimiento de esquinas de la sesión ({} si aún no hay esquinas).
+    """
+    return leer(ESPACIO_SEGUIMIENTO, sesion_id) or {}
+
+def _guardar_seguimiento(sesion_id, seguimiento):
+    if seguimiento:
+        escribir(ESPACIO_SEGUIMIENTO, sesion_id, seguimiento, EXPIRACION_SESION, MAX_SESIONES)
+    else:
+        borrar(ESPACIO_SEGUIMIENTO, sesion_id)
+
+def _fusionar_historial(guardado, local):
+    """
+    Lleva al historial guardado las mediciones que el frame añadió a su copia.
+    Si otro worker midió a la vez un frame de la misma sesión, se conservan las
+    dos (las que ya salieron de la ventana las descarta el siguiente filtrado).
+    """
+    if local is guardado:
+        return guardado
+    por_tiempo = {medicion['tiempo']: medicion for medicion in guardado}
+    por_tiempo.update((medicion['tiempo'], medicion) for medicion in local)
+    guardado.clear()
+    guardado.extend(sorted(por_tiempo.values(), key=lambda medicion: medicion['tiempo']))
+    return guardado
+
+def obtener_filtro_global():
+    """
+    Historial del filtro temporal de las mediciones sin sesión, común a todos
+    los workers con un almacén compartido. Se guarda con guardar_filtro_global.
+    """
+    historial = leer(ESPACIO_FILTRO, 'global')
+    if historial is None:
+        historial = deque(maxlen=MAX_HISTORIAL)
+        escribir(ESPACIO_FILTRO, 'global', historial)
+    return historial
+
+def guardar_filtro_global(historial):
+    """
+    Guarda el historial del filtro global tras añadirle una medición.
+    """
+    actualizar(ESPACIO_FILTRO, 'global',
+               lambda guardado: historial if guardado is None else _fusionar_historial(guardado, historial))
+
+def _actualizar_racha(racha, tiempo_actual, distancia, config):
+    """
+    Añade una lectura a la racha estable; si la dispersión supera la tolerancia
+    se descartan las lecturas más antiguas. No se mira la confianza del filtro
+    temporal: depende de cuántas lecturas caben en su ventana y, con frames
+    cada más de 0,5 s, nunca llega a los valores altos aunque la lectura no varíe.
+    """
+    racha.append((tiempo_actual, distancia))
+    while len(racha) > 1:
+        distancias = [d for _, d in racha]
+        if max(distancias) - min(distancias) <= config['CONVERGENCIA_TOLERANCIA'] * np.median(distancias):
+            break
+        racha.pop(0)
+
+def registrar_frame(sesion_id, resultado, tiempo_actual=None, historial=None, seguimiento=None):
+    """
+    Registra el resultado de un frame de la sesión y comprueba la convergencia:
+    la lectura converge cuando al menos CONVERGENCIA_MIN_FRAMES frames seguidos se
+    mantienen dentro de la tolerancia durante CONVERGENCIA_SEGUNDOS. La sesión se lee y
+    se guarda en una sola operación atómica del almacén.
+
+    Args:
+        sesion_id: Identificador de la sesión
+        resultado: Respuesta de la medición del frame (con 'distancia' y 'confianza' si tuvo éxito)
+        tiempo_actual: Marca de tiempo del frame (por defecto time.time())
+        historial: Historial del filtro temporal tras medir el frame (el de obtener_sesion)
+        seguimiento: Estado del seguimiento de esquinas tras medir el frame (el de obtener_seguimiento)
+
+    Returns:
+        dict: Estado de convergencia de la sesión, o None si la sesión no existe
+    """
+    if tiempo_actual is None:
+        tiempo_actual = time.time()
+    config = obtener_configuracion()
+    convergio = []
+
+    def aplicar(sesion):
+        if sesion is None:
+            return None
+        if historial is not None:
+            _fusionar_historial(sesion['historial'], historial)
+        sesion['tiempo'] = tiempo_actual
+
+        if not sesion['convergida']:
+            sesion['frames'] += 1
+            if resultado.get('success'):
+                sesion['frames_validos'] += 1
+                # La visualización no se guarda: solo interesa en el frame que la pidió
+                sesion['ultimo'] = {k: v for k, v in resultado.items() if k != 'visualizacion'}
+                _actualizar_racha(sesion['racha'], tiempo_actual, resultado['distancia'], config)
+
+            racha = sesion['racha']
+            duracion = racha[-1][0] - racha[0][0] if racha else 0.0
+            if duracion >= config['CONVERGENCIA_SEGUNDOS'] and len(racha) >= config['CONVERGENCIA_MIN_FRAMES']:
+                sesion['convergida'] = True
+                distancia = float(np.median([d for _, d in racha]))
+                sesion['resultado_final'] = dict(
+                    sesion['ultimo'], distancia=round(distancia, 3), area=round(distancia * distancia, 2)
+                )
+                convergio.append(sesion['frames'])
+        return sesion
+
+    sesion = actualizar(ESPACIO_SESIONES, sesion_id, aplicar, EXPIRACION_SESION, MAX_SESIONES)
+    if sesion is None:
+        return None
+    if convergio:
+        # Ya no llegan más frames: se libera el frame guardado para el seguimiento
+        borrar(ESPACIO_SEGUIMIENTO, sesion_id)
+        with _lock:
+            _frames_hasta_convergencia.append(convergio[0])
+            del _frames_hasta_convergencia[:-MAX_SESIONES]
+    elif seguimiento is not None:
+        _guardar_seguimiento(sesion_id, seguimiento)
+    return _resumen(sesion_id, sesion, config)
+
+def _resumen(sesion_id, sesion, config):
+    racha = sesion['racha']
+    duracion = racha[-1][0] - racha[0][0] if racha else 0.0
+    return {
+        "sesion_id": sesion_id,
+        "convergida": sesion['convergida'],
+        "progreso": 1.0 if sesion['convergida'] else round(min(1.0, duracion / config['CONVERGENCIA_SEGUNDOS']), 2),
+        "frames": sesion['frames'],
+        "frames_validos": sesion['frames_validos'],
+        "duracion_s": round(sesion['tiempo'] - sesion['inicio'], 2),
+        "resultado_final": sesion['resultado_final'],
+    }
+
+def resumen_sesion(sesion_id):
+    """
+    Estado de una sesión para consultarlo después de medir.
+
+    Returns:
+        dict con la convergencia, los frames usados y el resultado final, o None
+    """
+    sesion = obtener_sesion(sesion_id)
+    if sesion is None:
+        return None
+    resumen = _resumen(sesion_id, sesion, obtener_configuracion())
+    resumen["tamano_lado"] = sesion['tamano_lado']
+    resumen["ultimo"] = sesion['ultimo']
+    return resumen
+
+def estado_sesiones():
+    """
+    Sesiones abiertas (en todos los workers si el almacén es compartido) y
+    frames medios que necesitó cada medición de este proceso hasta converger.
+    """
+    sesiones = valores(ESPACIO_SESIONES)
+    with _lock:
+        return {
+            "activas": len(sesiones),
+            "convergidas": sum(1 for s in sesiones if s['convergida']),
+            "frames_medios_convergencia": (
+                round(sum(_frames_hasta_convergencia) / len(_frames_hasta_convergencia), 1)
+                if _frames_hasta_convergencia else None
+            ),
+        }
@@ -9,6 +9,9 @@ let modoCamara = true; // true = cámara, false = manual
 let intervaloMedicion = null; // Para medición en tiempo real
 let distanciaGuardada = null; // Para guardar la distancia medida
 let debugInfoVisible = false; // Para mostrar/ocultar información técnica
+let capacidadesServidor = null; // Formatos de entrada y compresiones aceptadas por /detectar_aruco
+let sesionMedicion = null; // Sesión del servidor que indica cuándo la medición ha convergido
+let sugerenciaCaptura = null; // Ancho, calidad JPEG y región (relativa al vídeo) del siguiente frame
 
 // --- Inicialización al cargar la página ---
 document.addEventListener("DOMContentLoaded", function () {
@@ -188,11 +191,19 @@ window.activarCamara = async function() {
       });
     });
     
+    // Consultar una sola vez qué formatos de frame acepta el servidor
+    if (!capacidadesServidor) {
+      capacidadesServidor = await obtenerCapacidadesServidor();
+    }
+    
     // Mostrar botones correctamente
     document.getElementById('btnActivarCamara').style.display = 'none';
     document.getElementById('btnDetenerCamara').style.display = 'inline-block';
     mostrarStatus("Cámara activada. Medición en tiempo real con precisión mejorada...", "success");
     
+    // Abrir una sesión de medición: el servidor avisa cuando la lectura converge
+    sesionMedicion = await crearSesionMedicion();
+    
     // Inicia medición en tiempo real cada 500 ms
     intervaloMedicion = setInterval(() => { medirEnTiempoReal(); }, 500);
     
@@ -234,8 +245,8 @@ window.capturarYMedir = function() {
   try {
     mostrarStatus("Capturando imagen y detectando códigos ArUco con precisión mejorada...", "info");
     
-    // Dibujar el frame actual en el canvas
-    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+    // Dibujar el frame actual completo en el canvas
+    dibujarFrame(null);
     
     // Convertir canvas a base64
     const imageData = canvas.toDataURL('image/jpeg', 0.8);
@@ -262,6 +273,8 @@ window.detenerCamara = function() {
     clearInterval(intervaloMedicion);
     intervaloMedicion = null;
   }
+  sesionMedicion = null;
+  sugerenciaCaptura = null;
   
   // Detener el stream de la cámara
   if (stream) {
@@ -294,12 +307,18 @@ window.detenerCamara = function() {
 function medirEnTiempoReal() {
   if (!stream) return;
   try {
-    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-    const imageData = canvas.toDataURL('image/jpeg', 0.8);
+    // Aplica la sugerencia de captura del servidor (región, ancho y calidad)
+    const roiFrame = dibujarFrame(sugerenciaCaptura);
     // Convierte el tamaño del lado de cm a metros
     const tamanoLadoCm = parseFloat(document.getElementById('tamanoLado').value) || 5;
     const tamanoLado = tamanoLadoCm / 100.0;
-    detectarArUcoTiempoReal(imageData, tamanoLado);
+    if (usarCapturaCruda()) {
+      detectarArUcoCrudoTiempoReal(tamanoLado, roiFrame);
+    } else {
+      const calidad = sugerenciaCaptura ? sugerenciaCaptura.calidad : 0.8;
+      const imageData = canvas.toDataURL('image/jpeg', calidad);
+      detectarArUcoTiempoReal(imageData, tamanoLado, roiFrame);
+    }
   } catch (error) {
     mostrarStatus("Error en medición en tiempo real.", "error");
   }
@@ -339,7 +358,8 @@ async function detectarArUco(imageData, tamanoLado) {
       },
       body: JSON.stringify({
         image: imageData,
-        tamano_lado: tamanoLado
+        tamano_lado: tamanoLado,
+        modelo_dispositivo: obtenerModeloDispositivo()
       })
     });
     
@@ -377,73 +397,271 @@ async function detectarArUco(imageData, tamanoLado) {
 }
 
 // --- Envía el frame al backend y actualiza los resultados en la web ---
-async function detectarArUcoTiempoReal(imageData, tamanoLado) {
+async function detectarArUcoTiempoReal(imageData, tamanoLado, roiFrame) {
   try {
-    const response = await fetch('/detectar_aruco', {
+    const response = await fetch(urlMedicionTiempoReal(), {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ image: imageData, tamano_lado: tamanoLado })
+      body: JSON.stringify({
+        image: imageData,
+        tamano_lado: tamanoLado,
+        modelo_dispositivo: obtenerModeloDispositivo(),
+        formato_respuesta: formatoRespuestaTiempoReal(),
+        generar_visualizacion: true,
+        progresivo: usarMedicionProgresiva()
+      })
+    });
+    mostrarResultadoTiempoReal(await response.json(), roiFrame);
+  } catch (error) {
+    mostrarStatus("Error al procesar la imagen en el servidor.", "error");
+  }
+}
+
+// --- Envía el frame en escala de grises sin JPEG (modo crudo) ---
+async function detectarArUcoCrudoTiempoReal(tamanoLado, roiFrame) {
+  try {
+    const pixeles = ctx.getImageData(0, 0, canvas.width, canvas.height).data;
+    const gris = new Uint8Array(canvas.width * canvas.height);
+    for (let i = 0, j = 0; i < gris.length; i++, j += 4) {
+      // Luminancia BT.601 con enteros (igual que cv2.COLOR_RGB2GRAY)
+      gris[i] = (pixeles[j] * 77 + pixeles[j + 1] * 150 + pixeles[j + 2] * 29) >> 8;
+    }
+    
+    // Comprimir con deflate si el navegador y el servidor lo soportan
+    let cuerpo = gris;
+    let compresion = 'ninguna';
+    if (window.CompressionStream && capacidadesServidor.compresiones.includes('zlib')) {
+      const comprimido = new Blob([gris]).stream().pipeThrough(new CompressionStream('deflate'));
+      cuerpo = await new Response(comprimido).arrayBuffer();
+      compresion = 'zlib';
+    }
+    
+    const parametros = new URLSearchParams({
+      tamano_lado: tamanoLado,
+      formato_respuesta: formatoRespuestaTiempoReal(),
+      generar_visualizacion: '1',
+      progresivo: usarMedicionProgresiva() ? '1' : '0'
+    });
+    const modelo = obtenerModeloDispositivo();
+    if (modelo) parametros.set('modelo_dispositivo', modelo);
+    
+    const response = await fetch(urlMedicionTiempoReal() + '?' + parametros.toString(), {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/octet-stream',
+        'X-Ancho': String(canvas.width),
+        'X-Alto': String(canvas.height),
+        'X-Compresion': compresion
+      },
+      body: cuerpo
+    });
+    mostrarResultadoTiempoReal(await response.json(), roiFrame);
+  } catch (error) {
+    mostrarStatus("Error al procesar la imagen en el servidor.", "error");
+  }
+}
+
+// --- Abre una sesión de medición en el servidor (null si no está disponible) ---
+async function crearSesionMedicion() {
+  try {
+    const tamanoLadoCm = parseFloat(document.getElementById('tamanoLado').value) || 5;
+    const response = await fetch('/sesiones', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ tamano_lado: tamanoLadoCm / 100.0, modelo_dispositivo: obtenerModeloDispositivo() })
     });
     const data = await response.json();
-    if (data.error) {
-      mostrarStatus(data.error, "error");
-      document.getElementById('measurementResults').style.display = 'none';
+    return data.success ? data.sesion_id : null;
+  } catch (error) {
+    return null;
+  }
+}
+
+// --- Formato de respuesta: el debug_info completo solo con la información técnica visible ---
+function formatoRespuestaTiempoReal() {
+  return debugInfoVisible ? 'completo' : 'ligero';
+}
+
+// --- Medición progresiva: estimación inmediata y resultado refinado del mismo frame después ---
+function usarMedicionProgresiva() {
+  return Boolean(capacidadesServidor && capacidadesServidor.progresivo);
+}
+
+// --- Recoge el resultado refinado de una medición progresiva ---
+async function recogerResultadoRefinado(medicionId, roiFrame) {
+  try {
+    let data;
+    do {
+      const response = await fetch(`/mediciones/${medicionId}?espera=2`);
+      data = await response.json();
+    } while (data.fase === 'pendiente' && stream);
+    // Descartado (llegaron frames más nuevos) o expirado: se queda la estimación preliminar
+    if (data.fase === 'refinado') mostrarResultadoTiempoReal(data, roiFrame);
+  } catch (error) {
+    console.error('Error al recoger el resultado refinado:', error);
+  }
+}
+
+// --- Ruta a la que se envían los frames en tiempo real ---
+function urlMedicionTiempoReal() {
+  return sesionMedicion ? `/sesiones/${sesionMedicion}/frame` : '/detectar_aruco';
+}
+
+// --- Dibuja el frame del vídeo en el canvas: solo la región y al ancho sugeridos ---
+function dibujarFrame(sugerencia) {
+  const roi = sugerencia ? sugerencia.roi : [0, 0, 1, 1];
+  const anchoFuente = roi[2] * video.videoWidth;
+  const altoFuente = roi[3] * video.videoHeight;
+  // Nunca por encima de la resolución real del vídeo
+  const ancho = sugerencia ? Math.min(sugerencia.ancho, anchoFuente) : anchoFuente;
+  canvas.width = Math.max(1, Math.round(ancho));
+  canvas.height = Math.max(1, Math.round(ancho * altoFuente / anchoFuente));
+  ctx.drawImage(video, roi[0] * video.videoWidth, roi[1] * video.videoHeight, anchoFuente, altoFuente,
+                0, 0, canvas.width, canvas.height);
+  return roi;
+}
+
+// --- Guarda la sugerencia de captura para el siguiente frame ---
+function actualizarSugerenciaCaptura(data, roiFrame) {
+  // Un frame rechazado por calidad no dice nada del encuadre, y la estimación
+  // preliminar no trae sugerencia (llega con el refinado): se mantiene la actual
+  if (data.rechazo_calidad || data.fase === 'preliminar') return;
+  const sugerencia = data.success ? data.sugerencia_captura : null;
+  if (!sugerencia || !roiFrame) {
+    // Sin medición válida se vuelve al frame completo
+    sugerenciaCaptura = null;
+    return;
+  }
+  // La región sugerida es relativa al frame enviado: pasarla a coordenadas del vídeo
+  const roi = sugerencia.roi ? [
+    roiFrame[0] + sugerencia.roi[0] * roiFrame[2],
+    roiFrame[1] + sugerencia.roi[1] * roiFrame[3],
+    sugerencia.roi[2] * roiFrame[2],
+    sugerencia.roi[3] * roiFrame[3]
+  ] : roiFrame;
+  sugerenciaCaptura = { ancho: sugerencia.ancho, calidad: sugerencia.calidad, roi: roi };
+}
+
+// --- Actualiza la web con el resultado de una medición en tiempo real ---
+function mostrarResultadoTiempoReal(data, roiFrame) {
+  actualizarSugerenciaCaptura(data, roiFrame);
+
+  // Con sesión: al converger se usa el resultado final y se deja de capturar
+  const sesion = data.sesion;
+  if (sesion && sesion.convergida) {
+    if (!intervaloMedicion) return; // Respuesta de un frame que ya estaba en vuelo
+    clearInterval(intervaloMedicion);
+    intervaloMedicion = null;
+    data = Object.assign({}, sesion.resultado_final, { visualizacion: data.visualizacion });
+  }
+  
+  if (data.rechazo_calidad) {
+    // Frame movido o mal expuesto: se avisa sin ocultar la última medición
+    mostrarStatus(data.error, "info");
+    return;
+  }
+  if (data.fase === 'preliminar' && data.medicion_id) {
+    recogerResultadoRefinado(data.medicion_id, roiFrame);
+    // Sin marcadores a baja resolución: puede que aparezcan en el refinado
+    if (data.error) return;
+  }
+  if (data.error) {
+    mostrarStatus(data.error, "error");
+    document.getElementById('measurementResults').style.display = 'none';
+    return;
+  }
+  if (data.success) {
+    // Guardar la distancia medida
+    distanciaGuardada = data.distancia;
+    const area = data.area;
+    
+    // Mostrar resultados principales
+    document.getElementById('distanciaDetectada').textContent = data.distancia;
+    document.getElementById('areaDetectada').textContent = area;
+    document.getElementById('confianzaMedicion').textContent = (data.confianza * 100).toFixed(1) + '%';
+    document.getElementById('metodoUsado').textContent = traducirMetodo(data.metodo_usado);
+    document.getElementById('measurementResults').style.display = 'block';
+    
+    // Mostrar información técnica si está disponible
+    if (data.debug_info) {
+      document.getElementById('ladoPx').textContent = data.debug_info.lado_px.toFixed(2);
+      document.getElementById('metrosPorPixel').textContent = data.debug_info.metros_por_pixel.toFixed(6);
+      document.getElementById('distanciaCentros').textContent = data.debug_info.distancia_centros_metros.toFixed(3);
+      document.getElementById('distanciaMultipunto').textContent = data.debug_info.distancia_multipunto_metros.toFixed(3);
+      document.getElementById('distanciaFiltrada').textContent = data.debug_info.distancia_filtrada_metros.toFixed(3);
+      document.getElementById('numMedicionesPrevias').textContent = data.debug_info.num_mediciones_previas;
+      document.getElementById('numPuntosMedicion').textContent = data.debug_info.num_puntos_medicion;
+      document.getElementById('diferenciaCentrosBordes').textContent = data.debug_info.diferencia_centros_bordes.toFixed(3);
+      document.getElementById('diferenciaMultipuntoBordes').textContent = data.debug_info.diferencia_multipunto_bordes.toFixed(3);
+      document.getElementById('idsDetectados').textContent = data.debug_info.ids_detectados.join(', ');
+    }
+    
+    // Llenar campo manual automáticamente
+    document.getElementById('distancia').value = data.distancia;
+    
+    // Mostrar mensaje con información de confianza
+    const mensajeConfianza = data.confianza > 0.8 ? "alta" : data.confianza > 0.6 ? "media" : "baja";
+    mostrarStatus(`Distancia medida: ${data.distancia} m | Área: ${area} m² | Confianza: ${mensajeConfianza}`, "success");
+    
+    // Mostrar visualización si está disponible
+    if (data.visualizacion) {
+      const visualizationImage = document.getElementById('visualizationImage');
+      visualizationImage.src = 'data:image/png;base64,' + data.visualizacion;
+      document.getElementById('visualizationSection').style.display = 'block';
+      document.getElementById('btnToggleVisualization').textContent = '📊 Ocultar Visualización del Método';
+    }
+    
+    // Estimación preliminar: el resultado refinado sustituye a esta al llegar
+    if (data.fase === 'preliminar') {
+      mostrarStatus(`Distancia estimada: ${data.distancia} m | Refinando...`, "info");
       return;
     }
-    if (data.success) {
-      // Guardar la distancia medida
-      distanciaGuardada = data.distancia;
-      
-      // Mostrar resultados principales
-      document.getElementById('distanciaDetectada').textContent = data.distancia;
-      document.getElementById('areaDetectada').textContent = data.area;
-      document.getElementById('confianzaMedicion').textContent = (data.confianza * 100).toFixed(1) + '%';
-      document.getElementById('metodoUsado').textContent = traducirMetodo(data.metodo_usado);
-      document.getElementById('measurementResults').style.display = 'block';
-      
-      // Mostrar información técnica si está disponible
-      if (data.debug_info) {
-        document.getElementById('ladoPx').textContent = data.debug_info.lado_px.toFixed(2);
-        document.getElementById('metrosPorPixel').textContent = data.debug_info.metros_por_pixel.toFixed(6);
-        document.getElementById('distanciaCentros').textContent = data.debug_info.distancia_centros_metros.toFixed(3);
-        document.getElementById('distanciaMultipunto').textContent = data.debug_info.distancia_multipunto_metros.toFixed(3);
-        document.getElementById('distanciaFiltrada').textContent = data.debug_info.distancia_filtrada_metros.toFixed(3);
-        document.getElementById('numMedicionesPrevias').textContent = data.debug_info.num_mediciones_previas;
-        document.getElementById('numPuntosMedicion').textContent = data.debug_info.num_puntos_medicion;
-        document.getElementById('diferenciaCentrosBordes').textContent = data.debug_info.diferencia_centros_bordes.toFixed(3);
-        document.getElementById('diferenciaMultipuntoBordes').textContent = data.debug_info.diferencia_multipunto_bordes.toFixed(3);
-        document.getElementById('idsDetectados').textContent = data.debug_info.ids_detectados.join(', ');
-      }
-      
-      // Llenar campo manual automáticamente
-      document.getElementById('distancia').value = data.distancia;
-      
-      // Mostrar mensaje con información de confianza
-      const mensajeConfianza = data.confianza > 0.8 ? "alta" : data.confianza > 0.6 ? "media" : "baja";
-      mostrarStatus(`Distancia medida: ${data.distancia} m | Área: ${data.area} m² | Confianza: ${mensajeConfianza}`, "success");
-      
-      // Mostrar visualización si está disponible
-      if (data.visualizacion) {
-        const visualizationImage = document.getElementById('visualizationImage');
-        visualizationImage.src = 'data:image/png;base64,' + data.visualizacion;
-        document.getElementById('visualizationSection').style.display = 'block';
-        document.getElementById('btnToggleVisualization').textContent = '📊 Ocultar Visualización del Método';
-      }
-      
-      // Detener cámara automáticamente después de 2 segundos
-      setTimeout(() => {
-        detenerCamara();
-        mostrarStatus("Medición completada. Cámara cerrada automáticamente.", "success");
-      }, 2000);
+    
+    // Con sesión abierta se sigue midiendo hasta que el servidor indique convergencia
+    if (sesion && !sesion.convergida) {
+      mostrarStatus(`Distancia medida: ${data.distancia} m | Estabilizando: ${Math.round(sesion.progreso * 100)}%`, "info");
+      return;
     }
+    
+    // Detener cámara automáticamente después de 2 segundos
+    setTimeout(() => {
+      detenerCamara();
+      mostrarStatus("Medición completada. Cámara cerrada automáticamente.", "success");
+    }, 2000);
+  }
+}
+
+// --- Formatos de entrada que acepta el servidor ---
+async function obtenerCapacidadesServidor() {
+  try {
+    const response = await fetch('/capacidades');
+    return await response.json();
   } catch (error) {
-    mostrarStatus("Error al procesar la imagen en el servidor.", "error");
+    return { formatos_entrada: ['jpeg_base64'], compresiones: [] };
   }
 }
 
+// --- Modo crudo opcional (ej: localStorage.setItem('capturaCruda', '1')) ---
+function usarCapturaCruda() {
+  return localStorage.getItem('capturaCruda') === '1' &&
+    capacidadesServidor !== null &&
+    capacidadesServidor.formatos_entrada.includes('gris_crudo');
+}
+
+// --- Modelo del dispositivo para usar la calibración de cámara guardada ---
+function obtenerModeloDispositivo() {
+  // Permite fijar el modelo manualmente (ej: localStorage.setItem('modeloDispositivo', 'Pixel 7'))
+  const modeloGuardado = localStorage.getItem('modeloDispositivo');
+  if (modeloGuardado) return modeloGuardado;
+  // En Android el modelo aparece en el user agent: "...; SM-G991B Build/..."
+  const coincidencia = navigator.userAgent.match(/;\s*([^;)]+?)\s+Build\//);
+  return coincidencia ? coincidencia[1] : null;
+}
+
 // --- Función para traducir métodos de medición ---
 function traducirMetodo(metodo) {
   const traducciones = {
+    'pnp': 'Pose del Marcador (Cámara Calibrada)',
     'filtrado_temporal': 'Filtrado Temporal (Alta Precisión)',
     'multipunto': 'Múltiples Puntos',
     'bordes_externos': 'Bordes Externos'
@@ -0,0 +1,78 @@
+# --- Sugerencias de captura para el siguiente frame del cliente ---
+import numpy as np
+from config_optimizacion import obtener_configuracion
+
+LADO_MINIMO_DETECCION = 24   # Lado (px) por debajo del cual el detector empieza a fallar
+ANCHO_MINIMO = 160           # Ancho mínimo sugerido en píxeles
+ANCHO_MAXIMO = 4096          # Ancho máximo sugerido si el perfil no reduce la imagen
+FRACCION_ROI_MAXIMA = 0.7    # Si la región ocupa más de esta fracción del frame se envía entero
+
+def lado_medido_px(marcadores):
+    """
+    Lado aparente de los marcadores tal como se ven: mediana de los lados de
+    sus esquinas. No es el lado_px de la escala global, que convierte cada
+    marcador al equivalente de tamaño por defecto y no sirve para decidir si
+    hay que acercarse o alejarse.
+
+    Args:
+        marcadores: Esquinas de los marcadores (N x 4 x 2)
+
+    Returns:
+        float: Mediana de los lados en las mismas unidades que las esquinas
+    """
+    marcadores = np.asarray(marcadores, dtype=np.float64).reshape(-1, 4, 2)
+    return float(np.median(np.linalg.norm(marcadores - np.roll(marcadores, 1, axis=1), axis=2)))
+
+def sugerir_captura(esquinas, lado_px, tamano_imagen, confianza, usar_roi=True):
+    """
+    Calcula el ancho, la calidad JPEG y la región de interés más baratos con los
+    que el siguiente frame se sigue midiendo bien. Con confianza alta las
+    sugerencias se ajustan; con confianza baja se relajan (más píxeles, más
+    calidad y más margen alrededor de los marcadores).
+
+    Args:
+        esquinas: Array (N x 2) con las esquinas de los marcadores de medición,
+            en píxeles del frame recibido
+        lado_px: Lado aparente de los marcadores (lado_medido_px) en píxeles del frame recibido
+        tamano_imagen: (ancho, alto) del frame recibido
+        confianza: Confianza de la medición (0-1)
+        usar_roi: False si el frame debe llegar entero (p. ej. con intrínsecos calibrados,
+            que suponen el centro óptico del frame completo)
+
+    Returns:
+        dict: 'ancho' (px del frame a enviar), 'calidad' (0-1), 'roi' ([x, y, ancho, alto]
+            relativos al frame recibido, o None) y 'margen_deteccion' (lado_px respecto
+            al lado mínimo detectable)
+    """
+    config = obtener_configuracion()
+    ancho, alto = tamano_imagen
+    confianza = float(np.clip(confianza, 0.0, 1.0))
+    holgura = 1.0 + 2.0 * (1.0 - confianza)  # 1 con confianza total, 3 sin confianza
+
+    # Región de interés: los marcadores con un margen proporcional a su tamaño
+    roi = None
+    x0, y0, x1, y1 = 0.0, 0.0, float(ancho), float(alto)
+    if usar_roi:
+        margen = config['CAPTURA_MARGEN_ROI'] * holgura * lado_px
+        minimo = np.maximum(np.min(esquinas, axis=0) - margen, 0.0)
+        maximo = np.minimum(np.max(esquinas, axis=0) + margen, (ancho, alto))
+        if (maximo[0] - minimo[0]) * (maximo[1] - minimo[1]) <= FRACCION_ROI_MAXIMA * ancho * alto:
+            x0, y0 = minimo
+            x1, y1 = maximo
+            roi = [round(x0 / ancho, 4), round(y0 / alto, 4),
+                   round((x1 - x0) / ancho, 4), round((y1 - y0) / alto, 4)]
+
+    # Escala para que el marcador mida el lado objetivo (puede ser > 1 si hay que recuperar resolución)
+    lado_objetivo = max(config['CAPTURA_LADO_OBJETIVO'] * holgura, LADO_MINIMO_DETECCION)
+    escala = lado_objetivo / max(lado_px, 1e-6)
+    ancho_maximo = config['MAX_WIDTH'] if config['REDUCIR_IMAGEN'] else ANCHO_MAXIMO
+    ancho_sugerido = int(np.clip(round((x1 - x0) * escala), ANCHO_MINIMO, ancho_maximo))
+
+    calidad = config['CAPTURA_CALIDAD_MAX'] - (config['CAPTURA_CALIDAD_MAX'] - config['CAPTURA_CALIDAD_MIN']) * confianza
+
+    return {
+        "ancho": ancho_sugerido,
+        "calidad": round(float(calidad), 2),
+        "roi": roi,
+        "margen_deteccion": round(float(lado_px / LADO_MINIMO_DETECCION), 2),
+    }
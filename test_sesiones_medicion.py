@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Prueba de la convergencia de las sesiones de medición con el ritmo real del
+cliente: un frame cada 500 ms más la subida y el procesamiento.
+"""
+
+import random
+import time
+from config_optimizacion import usar_perfil
+from medicion_marcadores import filtrar_mediciones_temporales
+from sesiones_medicion import crear_sesion, obtener_sesion, registrar_frame
+
+MAX_FRAMES = 40
+
+def simular_sesion(perfil, semilla=0):
+    """
+    Envía frames de una lectura estable (ruido de ±0,05 %) separados entre
+    0,5 y 0,55 s, como hace la cámara del navegador.
+
+    Returns:
+        int: Frames hasta converger, o None si no convergió en MAX_FRAMES
+    """
+    aleatorio = random.Random(semilla)
+    with usar_perfil(perfil):
+        sesion_id = crear_sesion(0.05)
+        tiempo_actual = time.time()
+        for frame in range(1, MAX_FRAMES + 1):
+            tiempo_actual += aleatorio.uniform(0.5, 0.55)
+            historial = obtener_sesion(sesion_id)['historial']
+            distancia = 2.0 * (1 + aleatorio.uniform(-0.0005, 0.0005))
+            filtrada, confianza = filtrar_mediciones_temporales(distancia, historial=historial,
+                                                                tiempo_actual=tiempo_actual)
+            resultado = {"success": True, "distancia": round(float(filtrada), 3), "confianza": round(float(confianza), 2)}
+            estado = registrar_frame(sesion_id, resultado, tiempo_actual, historial)
+            if estado['convergida']:
+                return frame
+    return None
+
+def test_sesiones_convergen_con_frames_cada_medio_segundo():
+    for perfil in ('velocidad', 'precision'):
+        frames = simular_sesion(perfil)
+        assert frames is not None, f"La sesión en perfil {perfil} no convergió en {MAX_FRAMES} frames"
+        # Una lectura estable converge en cuanto la racha dura CONVERGENCIA_SEGUNDOS
+        assert frames <= 10, f"La sesión en perfil {perfil} tardó {frames} frames en converger"